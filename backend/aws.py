@@ -0,0 +1,47 @@
+"""
+Shared AWS clients, created on first use.
+
+Importing boto3 and building clients is a large part of a Lambda cold
+start, so nothing is loaded until a client is first needed. All clients
+come from one boto3 session, so endpoint and service data are only loaded
+once. botocore clients are thread-safe, so a single client per service
+serves every worker thread.
+"""
+import os
+import threading
+from typing import Any, Dict
+
+AWS_REGION_NAME = os.environ.get('AWS_REGION_NAME', 'us-east-1')
+
+_session = None
+_clients: Dict[str, Any] = {}
+# boto3 sessions are not thread-safe, so clients are created under a lock
+_lock = threading.Lock()
+
+
+def get_client(service_name: str, **client_kwargs) -> Any:
+    """
+    Get the client for an AWS service, creating it on first use.
+
+    client_kwargs (e.g. config) only apply when the client is created.
+    """
+    client = _clients.get(service_name)
+    if client is None:
+        with _lock:
+            client = _clients.get(service_name)
+            if client is None:
+                client = _get_session().client(
+                    service_name,
+                    region_name=AWS_REGION_NAME,
+                    **client_kwargs
+                )
+                _clients[service_name] = client
+    return client
+
+
+def _get_session():
+    global _session
+    if _session is None:
+        import boto3
+        _session = boto3.session.Session()
+    return _session
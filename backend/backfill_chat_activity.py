@@ -0,0 +1,104 @@
+"""
+One-off migration: backfill message counts, token totals and previews on chats.
+
+Chats keep message_count, total_tokens and a preview of their last message,
+updated as messages are saved. Chats created before these fields existed
+started counting from their next message. This script scans the chats
+table and recomputes the fields of every chat from its messages. Each
+update only applies if the chat's message_count hasn't changed since the
+scan, so chats written to meanwhile are skipped; re-run the script for them.
+
+The SQLite backend backfills these fields itself when it adds the columns.
+
+Usage:
+    CHATS_TABLE=<table> MESSAGES_TABLE=<table> python backfill_chat_activity.py [--dry-run]
+"""
+import argparse
+from typing import Dict, Any, Iterator
+
+import storage_dynamodb
+from storage import chat_activity, unpack_message
+
+
+def scan_chats() -> Iterator[Dict[str, Any]]:
+    """Scan the chats table, skipping chats pending deletion."""
+    table = storage_dynamodb.get_chats_table()
+    scan_kwargs = {}
+
+    while True:
+        response = table.scan(**scan_kwargs)
+        for item in response.get('Items', []):
+            if 'deleted_at' not in item:
+                yield item
+
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def backfill_chat(chat: Dict[str, Any], dry_run: bool = False) -> bool:
+    """
+    Recompute one chat's activity fields from its messages.
+
+    Returns:
+        False if the chat changed since it was scanned and was left alone
+    """
+    messages = storage_dynamodb.DynamoDBStorage().get_messages(chat['chat_id'])
+    if messages:
+        # Only the last message's content is needed, for the preview
+        activity = chat_activity(messages[:-1] + [unpack_message(messages[-1])])
+    else:
+        activity = {'message_count': 0, 'total_tokens': 0}
+
+    print(
+        f"Chat {chat['chat_id']}: {chat.get('message_count', '-')} -> {activity['message_count']} messages, "
+        f"{chat.get('total_tokens', '-')} -> {activity['total_tokens']} tokens"
+    )
+    if dry_run:
+        return True
+
+    update_expr = 'SET message_count = :count, total_tokens = :tokens'
+    expr_values = {':count': activity['message_count'], ':tokens': activity['total_tokens']}
+    if messages:
+        update_expr += ', last_message_preview = :preview, last_message_role = :role'
+        expr_values[':preview'] = activity['last_message_preview']
+        expr_values[':role'] = activity['last_message_role']
+
+    if 'message_count' in chat:
+        condition = 'message_count = :seen'
+        expr_values[':seen'] = chat['message_count']
+    else:
+        condition = 'attribute_exists(chat_id) AND attribute_not_exists(message_count)'
+
+    table = storage_dynamodb.get_chats_table()
+    client = table.meta.client
+    try:
+        table.update_item(
+            Key={'user_id': chat['user_id'], 'chat_id': chat['chat_id']},
+            UpdateExpression=update_expr,
+            ConditionExpression=condition,
+            ExpressionAttributeValues=expr_values
+        )
+    except client.exceptions.ConditionalCheckFailedException:
+        print(f"  Chat {chat['chat_id']} changed during the backfill; skipped")
+        return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dry-run', action='store_true', help='Print the new values without writing')
+    args = parser.parse_args()
+
+    total = skipped = 0
+    for chat in scan_chats():
+        total += 1
+        if not backfill_chat(chat, dry_run=args.dry_run):
+            skipped += 1
+
+    action = 'Would backfill' if args.dry_run else 'Backfilled'
+    print(f"{action} {total - skipped} chats" + (f", {skipped} skipped" if skipped else ''))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,41 +1,450 @@
 """
 AWS Bedrock client for Claude model interactions.
+
+All model calls go through a BedrockScheduler, which limits concurrent calls
+per model, paces requests with an adaptive token bucket and retries
+throttling and transient errors with jittered exponential backoff.
 """
+import asyncio
+import contextvars
 import json
-import boto3
+import logging
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
 import os
-from typing import Generator, Dict, Any, Optional, List
+from typing import AsyncGenerator, Callable, Generator, Dict, Any, Iterator, Optional, List
+
+import aws
+import context_window
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# Bedrock client, created on first use by get_bedrock_runtime. Can be set
+# to a local fake before the first call.
+bedrock_runtime = None
+
+
+def get_bedrock_runtime():
+    """Get the Bedrock runtime client, creating it on first use."""
+    global bedrock_runtime
+    if bedrock_runtime is None:
+        from botocore.config import Config
+        # Retries are done by the scheduler, not botocore
+        bedrock_runtime = aws.get_client(
+            'bedrock-runtime',
+            config=Config(retries={'mode': 'standard', 'total_max_attempts': 1})
+        )
+    return bedrock_runtime
+
+
+# Max chunks buffered between a stream's worker thread and the event loop
+STREAM_QUEUE_SIZE = int(os.environ.get('BEDROCK_STREAM_QUEUE_SIZE', '64'))
+
+_STREAM_END = object()
+
+# Seconds to wait for a generated title before using the local fallback
+TITLE_TIMEOUT = float(os.environ.get('TITLE_TIMEOUT', '10'))
+
+# Concurrent calls allowed per model
+BEDROCK_MAX_CONCURRENCY = int(os.environ.get('BEDROCK_MAX_CONCURRENCY', '8'))
+
+# Requests per second allowed per model, and the burst size (0 disables)
+BEDROCK_RATE_LIMIT = float(os.environ.get('BEDROCK_RATE_LIMIT', '10'))
+BEDROCK_RATE_BURST = int(os.environ.get('BEDROCK_RATE_BURST', '20'))
+
+# Attempts per call, including the first
+BEDROCK_MAX_ATTEMPTS = int(os.environ.get('BEDROCK_MAX_ATTEMPTS', '4'))
 
-# Initialize Bedrock client
-bedrock_runtime = boto3.client(
-    'bedrock-runtime',
-    region_name=os.environ.get('AWS_REGION_NAME', 'us-east-1')
+# Seconds a call may wait for a free slot before failing
+BEDROCK_QUEUE_TIMEOUT = float(os.environ.get('BEDROCK_QUEUE_TIMEOUT', '30'))
+
+# Backoff before retry n is uniform in [0, min(cap, base * 2**(n-1))] seconds
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 8.0
+
+# The rate never adapts below this fraction of the configured limit
+MIN_RATE_FRACTION = 0.1
+
+# Send cache_control breakpoints to models that support prompt caching
+PROMPT_CACHING = os.environ.get('PROMPT_CACHING', 'true').lower() == 'true'
+
+# Bedrock model IDs that accept cache_control
+PROMPT_CACHE_MODELS = re.compile(os.environ.get(
+    'PROMPT_CACHE_MODELS',
+    r'claude-(3-5-haiku|3-7-sonnet|sonnet-4|opus-4|haiku-4)'
+))
+
+CACHE_CONTROL = {"type": "ephemeral"}
+
+# Token counts reported in a stream's usage events
+USAGE_KEYS = (
+    'input_tokens',
+    'output_tokens',
+    'cache_read_input_tokens',
+    'cache_creation_input_tokens',
 )
 
+THROTTLING_ERROR_CODES = frozenset({
+    'ThrottlingException',
+    'TooManyRequestsException',
+})
 
-def build_messages_with_context(
-    messages: List[Dict[str, str]],
+RETRYABLE_ERROR_CODES = THROTTLING_ERROR_CODES | frozenset({
+    'ServiceUnavailableException',
+    'InternalServerException',
+    'ModelNotReadyException',
+    'ModelTimeoutException',
+})
+
+# botocore connection errors worth retrying. botocore is only imported once
+# a client is created, so they are named here and resolved when checked.
+RETRYABLE_EXCEPTIONS = (
+    'ConnectionClosedError',
+    'ConnectTimeoutError',
+    'EndpointConnectionError',
+    'ReadTimeoutError',
+)
+
+
+# ============================================
+# Call Scheduling
+# ============================================
+
+class BedrockBusyError(Exception):
+    """No call slot for a model became free within the queue timeout."""
+
+
+def _error_code(error: Exception) -> Optional[str]:
+    from botocore.exceptions import ClientError
+    if not isinstance(error, ClientError):
+        return None
+    code = error.response.get('Error', {}).get('Code') or ''
+    # Errors inside an event stream use camelCase codes (throttlingException)
+    return code[:1].upper() + code[1:]
+
+
+def is_throttling_error(error: Exception) -> bool:
+    return _error_code(error) in THROTTLING_ERROR_CODES
+
+
+def is_retryable_error(error: Exception) -> bool:
+    import botocore.exceptions
+    retryable = tuple(getattr(botocore.exceptions, name) for name in RETRYABLE_EXCEPTIONS)
+    return isinstance(error, retryable) or _error_code(error) in RETRYABLE_ERROR_CODES
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket whose rate adapts to throttling.
+
+    The rate is halved on each throttle and recovers additively on success,
+    staying between MIN_RATE_FRACTION of the configured rate and the rate.
+    """
+
+    def __init__(self, rate: float, burst: int, clock: Callable[[], float] = time.monotonic):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self._clock = clock
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self) -> float:
+        """Take a token. Returns the seconds to wait before using it."""
+        if self.max_rate <= 0:
+            return 0.0
+        with self._lock:
+            self._refill()
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def on_throttle(self) -> None:
+        if self.max_rate <= 0:
+            return
+        with self._lock:
+            self._refill()
+            self.rate = max(self.max_rate * MIN_RATE_FRACTION, self.rate / 2)
+
+    def on_success(self) -> None:
+        if self.max_rate <= 0 or self.rate >= self.max_rate:
+            return
+        with self._lock:
+            self._refill()
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+
+class _ModelLimits:
+    def __init__(self, max_concurrency: int, bucket: TokenBucket):
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.bucket = bucket
+        self.lock = threading.Lock()
+        self.stats = {
+            'calls': 0,
+            'in_flight': 0,
+            'retries': 0,
+            'throttles': 0,
+            'errors': 0,
+            'queue_wait_ms_total': 0.0,
+            'queue_wait_ms_max': 0.0,
+        }
+
+    def count(self, **increments) -> None:
+        with self.lock:
+            for key, value in increments.items():
+                self.stats[key] += value
+
+
+class BedrockScheduler:
+    """
+    Runs Bedrock calls under per-model concurrency and rate limits.
+
+    Throttling and transient errors are retried with jittered exponential
+    backoff. A streaming call is only retried before its first event has
+    been passed on, so a client never sees a repeated start. The client,
+    sleep and clock can be replaced, e.g. with a local fake in tests.
+    """
+
+    def __init__(
+        self,
+        client=None,
+        max_concurrency: int = BEDROCK_MAX_CONCURRENCY,
+        rate: float = BEDROCK_RATE_LIMIT,
+        burst: int = BEDROCK_RATE_BURST,
+        max_attempts: int = BEDROCK_MAX_ATTEMPTS,
+        queue_timeout: float = BEDROCK_QUEUE_TIMEOUT,
+        sleep: Callable[[float], None] = time.sleep,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self._client = client
+        self.max_concurrency = max_concurrency
+        self.rate = rate
+        self.burst = burst
+        self.max_attempts = max_attempts
+        self.queue_timeout = queue_timeout
+        self._sleep = sleep
+        self._clock = clock
+        self._limits: Dict[str, _ModelLimits] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        # Resolved per call so the module-level client can be swapped
+        return self._client if self._client is not None else get_bedrock_runtime()
+
+    def _get_limits(self, model_id: str) -> _ModelLimits:
+        with self._lock:
+            limits = self._limits.get(model_id)
+            if limits is None:
+                limits = self._limits[model_id] = _ModelLimits(
+                    self.max_concurrency,
+                    TokenBucket(self.rate, self.burst, self._clock)
+                )
+            return limits
+
+    @contextmanager
+    def _slot(self, model_id: str) -> Iterator[_ModelLimits]:
+        limits = self._get_limits(model_id)
+        started = self._clock()
+        if not limits.slots.acquire(timeout=self.queue_timeout):
+            limits.count(errors=1)
+            raise BedrockBusyError(f"Model {model_id} is busy, try again shortly")
+
+        self._wait_for_token(limits)
+        wait_ms = (self._clock() - started) * 1000
+        with limits.lock:
+            limits.stats['calls'] += 1
+            limits.stats['in_flight'] += 1
+            limits.stats['queue_wait_ms_total'] += wait_ms
+            limits.stats['queue_wait_ms_max'] = max(limits.stats['queue_wait_ms_max'], wait_ms)
+        if wait_ms >= 1000:
+            logger.info("Bedrock call to %s queued for %.0f ms", model_id, wait_ms)
+        tracing.record('bedrock_queue', wait_ms, model=model_id)
+
+        try:
+            yield limits
+        finally:
+            limits.count(in_flight=-1)
+            limits.slots.release()
+
+    def _wait_for_token(self, limits: _ModelLimits) -> None:
+        delay = limits.bucket.reserve()
+        if delay > 0:
+            self._sleep(delay)
+
+    def _retry_or_raise(self, limits: _ModelLimits, model_id: str, error: Exception, attempt: int) -> None:
+        """Back off before the next attempt, or re-raise if the error is final."""
+        if is_throttling_error(error):
+            limits.count(throttles=1)
+            limits.bucket.on_throttle()
+
+        if attempt >= self.max_attempts or not is_retryable_error(error):
+            limits.count(errors=1)
+            raise error
+
+        limits.count(retries=1)
+        delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+        logger.warning(
+            "Bedrock call to %s failed (%s), retry %d in %.2fs",
+            model_id, _error_code(error) or type(error).__name__, attempt, delay
+        )
+        self._sleep(delay)
+        self._wait_for_token(limits)
+
+    def invoke(self, model_id: str, request_body: Dict[str, Any]) -> Dict[str, Any]:
+        """Invoke a model and return the parsed response body."""
+        with self._slot(model_id) as limits, tracing.span('bedrock_invoke', model=model_id):
+            for attempt in range(1, self.max_attempts + 1):
+                try:
+                    response = self.client.invoke_model(
+                        modelId=model_id,
+                        contentType="application/json",
+                        accept="application/json",
+                        body=json.dumps(request_body)
+                    )
+                    result = json.loads(response['body'].read())
+                except Exception as e:
+                    self._retry_or_raise(limits, model_id, e, attempt)
+                    continue
+
+                limits.bucket.on_success()
+                return result
+
+    def stream(
+        self,
+        model_id: str,
+        request_body: Dict[str, Any],
+        on_open: Optional[Callable[[Any], None]] = None,
+        stop: Optional[threading.Event] = None
+    ) -> Generator[Dict[str, Any], None, None]:
+        """
+        Invoke a model with a streaming response and yield its parsed events.
+
+        Args:
+            on_open: Called with each attempt's event stream, so it can be
+                closed from another thread
+            stop: Stops retrying once set
+        """
+        with self._slot(model_id) as limits, tracing.span('bedrock_stream', model=model_id) as span:
+            started_at = self._clock()
+            for attempt in range(1, self.max_attempts + 1):
+                if stop is not None and stop.is_set():
+                    return
+
+                response = None
+                started = False
+                try:
+                    response = self.client.invoke_model_with_response_stream(
+                        modelId=model_id,
+                        contentType="application/json",
+                        accept="application/json",
+                        body=json.dumps(request_body)
+                    )
+                    if on_open:
+                        on_open(response['body'])
+
+                    for event in response['body']:
+                        if not started:
+                            started = True
+                            limits.bucket.on_success()
+                        chunk = json.loads(event['chunk']['bytes'])
+                        if tracing.ENABLED:
+                            _trace_stream_chunk(span, chunk, (self._clock() - started_at) * 1000)
+                        yield chunk
+                    return
+                except Exception as e:
+                    if started or (stop is not None and stop.is_set()):
+                        raise
+                    self._retry_or_raise(limits, model_id, e, attempt)
+                finally:
+                    if response is not None:
+                        # Release the HTTP connection even if the consumer stops early
+                        response['body'].close()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Get call counters and queue wait times per model."""
+        with self._lock:
+            limits = dict(self._limits)
+
+        snapshot = {}
+        for model_id, model_limits in limits.items():
+            with model_limits.lock:
+                stats = dict(model_limits.stats)
+            stats['queue_wait_ms_avg'] = stats['queue_wait_ms_total'] / stats['calls'] if stats['calls'] else 0.0
+            stats['rate'] = model_limits.bucket.rate
+            snapshot[model_id] = stats
+        return snapshot
+
+
+def _trace_stream_chunk(span: Dict[str, Any], chunk: Dict[str, Any], elapsed_ms: float) -> None:
+    """Add time to first token, output tokens and tokens/sec to a stream's span."""
+    if chunk.get('type') == 'content_block_delta' and 'ttft_ms' not in span:
+        span['ttft_ms'] = elapsed_ms
+    elif chunk.get('type') == 'message_delta':
+        output_tokens = chunk.get('usage', {}).get('output_tokens')
+        if output_tokens is not None:
+            span['output_tokens'] = output_tokens
+            generating_ms = elapsed_ms - span.get('ttft_ms', 0)
+            if generating_ms > 0:
+                span['tokens_per_s'] = output_tokens / (generating_ms / 1000)
+
+
+scheduler = BedrockScheduler()
+
+
+def build_system_prompt(
     memories: List[Dict[str, Any]],
-    system_prompt: Optional[str] = None
-) -> tuple[str, List[Dict[str, str]]]:
-    """Build the system prompt with memories and return formatted messages."""
+    system_prompt: Optional[str] = None,
+    summary: Optional[str] = None
+) -> str:
+    """Build the system prompt, including the user's memories and a summary of earlier turns."""
     
-    # Build system prompt with memories
     system_parts = []
     
     if system_prompt:
         system_parts.append(system_prompt)
     
-    if memories:
-        memory_text = "\n".join([f"- {m['content']}" for m in memories])
+    if summary:
         system_parts.append(f"""
+Summary of the earlier part of this conversation:
+{summary}
+""")
+    
+    if memories:
+        system_parts.append(build_memory_context(memories))
+    
+    return "\n\n".join(system_parts) if system_parts else "You are a helpful AI assistant."
+
+
+def build_memory_context(memories: List[Dict[str, Any]]) -> str:
+    """Build the block of text that tells the model about the user's memories."""
+    memory_text = "\n".join([f"- {m['content']}" for m in memories])
+    return f"""
 Here are some things to remember about the user:
 {memory_text}
 
 Use this context to personalize your responses when relevant.
-""")
+"""
+
+
+def build_messages_with_context(
+    messages: List[Dict[str, str]],
+    memories: List[Dict[str, Any]],
+    system_prompt: Optional[str] = None,
+    summary: Optional[str] = None
+) -> tuple[str, List[Dict[str, str]]]:
+    """Build the system prompt with memories and return formatted messages."""
     
-    system = "\n\n".join(system_parts) if system_parts else "You are a helpful AI assistant."
+    system = build_system_prompt(memories, system_prompt, summary)
     
     # Format messages for Claude
     formatted_messages = []
@@ -48,13 +457,58 @@ Use this context to personalize your responses when relevant.
     return system, formatted_messages
 
 
+def supports_prompt_caching(model_id: str) -> bool:
+    """Check whether prompt caching is enabled for a model."""
+    return PROMPT_CACHING and bool(PROMPT_CACHE_MODELS.search(model_id))
+
+
+def build_cached_messages_with_context(
+    messages: List[Dict[str, str]],
+    memories: List[Dict[str, Any]],
+    system_prompt: Optional[str] = None,
+    summary: Optional[str] = None
+) -> tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Build the system blocks and messages with prompt cache breakpoints.
+    
+    The system prompt (with the summary) and the history up to the last
+    assistant turn are marked with cache_control, so each turn reads the
+    prefix cached by the previous one. Memories are picked per message, so
+    they go in the final user turn, after the cached prefix, instead of in
+    the system prompt where they would invalidate it.
+    """
+    system = [{
+        "type": "text",
+        "text": build_system_prompt([], system_prompt, summary),
+        "cache_control": CACHE_CONTROL
+    }]
+    
+    formatted_messages = [{'role': m['role'], 'content': m['content']} for m in messages]
+    
+    # Rolling breakpoint at the end of the history
+    for msg in reversed(formatted_messages[:-1]):
+        if msg['role'] == 'assistant':
+            msg['content'] = [{"type": "text", "text": msg['content'], "cache_control": CACHE_CONTROL}]
+            break
+    
+    if memories and formatted_messages:
+        last = formatted_messages[-1]
+        last['content'] = [
+            {"type": "text", "text": build_memory_context(memories)},
+            {"type": "text", "text": last['content']}
+        ]
+    
+    return system, formatted_messages
+
+
 def invoke_model_stream(
     messages: List[Dict[str, str]],
     model_id: str,
     max_tokens: int = 4096,
     temperature: float = 0.7,
     memories: Optional[List[Dict[str, Any]]] = None,
-    system_prompt: Optional[str] = None
+    system_prompt: Optional[str] = None,
+    summary: Optional[str] = None
 ) -> Generator[str, None, None]:
     """
     Invoke a Claude model with streaming response.
@@ -66,47 +520,370 @@ def invoke_model_stream(
         temperature: Sampling temperature
         memories: Optional list of memory items to include in context
         system_prompt: Optional custom system prompt
+        summary: Optional summary of earlier turns not included in messages
     
     Yields:
         Text chunks as they are generated
     """
     
-    system, formatted_messages = build_messages_with_context(
+    try:
+        request_body = _build_request_body(
+            messages, max_tokens, temperature, memories, system_prompt, summary,
+            prompt_caching=supports_prompt_caching(model_id)
+        )
+        yield from _iter_stream_text(scheduler.stream(model_id, request_body))
+                
+    except Exception as e:
+        yield _error_text(e)
+
+
+def _build_request_body(
+    messages: List[Dict[str, str]],
+    max_tokens: int,
+    temperature: float,
+    memories: Optional[List[Dict[str, Any]]],
+    system_prompt: Optional[str],
+    summary: Optional[str] = None,
+    prompt_caching: bool = False
+) -> Dict[str, Any]:
+    """Build the Messages API request body for Claude."""
+    build = build_cached_messages_with_context if prompt_caching else build_messages_with_context
+    system, formatted_messages = build(
         messages, 
         memories or [],
-        system_prompt
+        system_prompt,
+        summary
     )
     
-    # Build request body for Claude
-    request_body = {
+    return {
         "anthropic_version": "bedrock-2023-05-31",
         "max_tokens": max_tokens,
         "temperature": temperature,
         "system": system,
         "messages": formatted_messages
     }
+
+
+def _iter_stream_text(
+    chunks: Iterator[Dict[str, Any]],
+    usage: Optional[Dict[str, int]] = None
+) -> Generator[str, None, None]:
+    """
+    Yield the text deltas of a stream of parsed Bedrock events.
     
-    try:
-        response = bedrock_runtime.invoke_model_with_response_stream(
-            modelId=model_id,
-            contentType="application/json",
-            accept="application/json",
-            body=json.dumps(request_body)
-        )
+    If a usage dict is given, it is filled in with the token counts the
+    stream reports (see USAGE_KEYS).
+    """
+    for chunk in chunks:
+        if chunk['type'] == 'message_start':
+            if usage is not None:
+                _update_usage(usage, chunk.get('message', {}).get('usage', {}))
+        
+        elif chunk['type'] == 'message_delta':
+            if usage is not None:
+                _update_usage(usage, chunk.get('usage', {}))
         
-        for event in response['body']:
-            chunk = json.loads(event['chunk']['bytes'])
-            
-            if chunk['type'] == 'content_block_delta':
-                delta = chunk.get('delta', {})
-                if 'text' in delta:
-                    yield delta['text']
-            
-            elif chunk['type'] == 'message_stop':
+        elif chunk['type'] == 'content_block_delta':
+            delta = chunk.get('delta', {})
+            if 'text' in delta:
+                yield delta['text']
+        
+        elif chunk['type'] == 'message_stop':
+            break
+
+
+def _update_usage(usage: Dict[str, int], reported: Dict[str, Any]) -> None:
+    # Counts are cumulative, so later events replace earlier ones
+    for key in USAGE_KEYS:
+        if reported.get(key) is not None:
+            usage[key] = int(reported[key])
+
+
+def _log_usage(model_id: str, usage: Dict[str, int]) -> None:
+    cache_read = usage.get('cache_read_input_tokens', 0)
+    prompt_tokens = usage.get('input_tokens', 0) + cache_read + usage.get('cache_creation_input_tokens', 0)
+    logger.info(
+        "Usage for %s: %d prompt tokens (%d cache read, %d cache write, %.0f%% hit), %d output",
+        model_id,
+        prompt_tokens,
+        cache_read,
+        usage.get('cache_creation_input_tokens', 0),
+        100 * cache_read / prompt_tokens if prompt_tokens else 0,
+        usage.get('output_tokens', 0)
+    )
+
+
+def _error_text(error: Exception) -> str:
+    return f"\n\n**Error:** {str(error)}"
+
+
+async def invoke_model_stream_async(
+    messages: List[Dict[str, str]],
+    model_id: str,
+    max_tokens: int = 4096,
+    temperature: float = 0.7,
+    memories: Optional[List[Dict[str, Any]]] = None,
+    system_prompt: Optional[str] = None,
+    summary: Optional[str] = None,
+    raise_on_error: bool = False,
+    usage: Optional[Dict[str, int]] = None
+) -> AsyncGenerator[str, None]:
+    """
+    Async variant of invoke_model_stream.
+    
+    The blocking Bedrock event stream is read on a dedicated worker thread
+    which pumps chunks into a bounded asyncio queue, so slow generations never
+    block the event loop. When the queue is full the worker waits. When the
+    consumer stops early, e.g. because the generation was cancelled, the
+    event stream is closed right away, which also interrupts a worker that
+    is blocked waiting for the model.
+    
+    Args:
+        raise_on_error: Raise Bedrock errors instead of yielding them as text
+        usage: Filled in with the stream's token counts, including prompt
+            cache reads and writes (see USAGE_KEYS)
+    
+    Yields:
+        Text chunks as they are generated
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+    stop = threading.Event()
+    body = None
+    body_lock = threading.Lock()
+    
+    def put(item) -> None:
+        # Blocks the worker thread (not the loop) while the queue is full
+        asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+    
+    def close_body() -> None:
+        with body_lock:
+            if body is not None:
+                body.close()
+    
+    def on_open(stream_body) -> None:
+        nonlocal body
+        with body_lock:
+            body = stream_body
+        # The consumer may have stopped while the request was in flight
+        if stop.is_set():
+            close_body()
+    
+    stream_usage = usage if usage is not None else {}
+    
+    def pump() -> None:
+        chunks = None
+        try:
+            request_body = _build_request_body(
+                messages, max_tokens, temperature, memories, system_prompt, summary,
+                prompt_caching=supports_prompt_caching(model_id)
+            )
+            chunks = scheduler.stream(model_id, request_body, on_open=on_open, stop=stop)
+            for chunk in _iter_stream_text(chunks, stream_usage):
+                if stop.is_set():
+                    break
+                put(chunk)
+            _log_usage(model_id, stream_usage)
+        except Exception as e:
+            if not stop.is_set():
+                put(e if raise_on_error else _error_text(e))
+        finally:
+            if chunks is not None:
+                # Releases the model's call slot
+                chunks.close()
+            if not stop.is_set():
+                put(_STREAM_END)
+    
+    # Run in a copy of the caller's context so spans land in its trace
+    worker = threading.Thread(
+        target=contextvars.copy_context().run,
+        args=(pump,),
+        name=f"bedrock-stream-{model_id}",
+        daemon=True
+    )
+    worker.start()
+    
+    try:
+        while True:
+            item = await queue.get()
+            if item is _STREAM_END:
                 break
-                
-    except Exception as e:
-        yield f"\n\n**Error:** {str(e)}"
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        close_body()
+        # Unblock a worker waiting on a full queue so it can observe `stop`
+        while not queue.empty():
+            queue.get_nowait()
+
+
+class FallbackStream:
+    """
+    Streams a reply from the first model in a chain that answers in time.
+
+    Each model config may set ttft_deadline_ms. If a model errors before its
+    first token, or its deadline passes first, the next config in the chain
+    is tried. With hedging the slow model keeps running alongside the next
+    one and whichever streams first is kept; otherwise it is abandoned. Once
+    a model has streamed its first token it serves the whole reply.
+
+    Iterate it for the text chunks; `served_by` is the config that produced
+    them, `usage` its token counts, and `ttft_ms` and `latency_ms` the time
+    to the first chunk and to the end of the stream, failovers included.
+    `complete` is set once the model finished its reply. If every model
+    fails, the last error is yielded as text. Once iteration stops, read
+    the usage to save with finish().
+    """
+
+    def __init__(
+        self,
+        model_configs: List[Dict[str, Any]],
+        messages: List[Dict[str, str]],
+        memories: Optional[List[Dict[str, Any]]] = None,
+        summary: Optional[str] = None
+    ):
+        self.model_configs = model_configs
+        self.messages = messages
+        self.memories = memories
+        self.summary = summary
+        self.served_by: Optional[Dict[str, Any]] = None
+        self.usage: Dict[str, int] = {}
+        self.ttft_ms: Optional[int] = None
+        self.latency_ms: Optional[int] = None
+        self.complete = False
+        self._started: Optional[float] = None
+
+    def __aiter__(self) -> AsyncGenerator[str, None]:
+        return self._run()
+
+    def _start(self, config: Dict[str, Any], usage: Dict[str, int]) -> AsyncGenerator[str, None]:
+        return invoke_model_stream_async(
+            messages=self.messages,
+            model_id=config['model_id'],
+            max_tokens=int(config.get('max_tokens', 4096)),
+            temperature=float(config.get('temperature', 0.7)),
+            memories=self.memories,
+            summary=self.summary,
+            raise_on_error=True,
+            usage=usage
+        )
+
+    def finish(self, text: str) -> Dict[str, int]:
+        """
+        Get the token counts and latencies of the reply, once iteration stops.
+
+        A cancelled or cut-off stream may not have been closed yet, so the
+        latency is taken now if it isn't set. Output tokens are only reported
+        by the message_delta event at the end of the reply (message_start
+        reports a placeholder of 1), so without it they're estimated from
+        the text the stream emitted.
+
+        Args:
+            text: The text the stream yielded
+        """
+        if self.latency_ms is None and self._started is not None:
+            self.latency_ms = int((time.monotonic() - self._started) * 1000)
+        usage = dict(self.usage)
+        if text and (not self.complete or usage.get('output_tokens', 0) <= 1):
+            usage['output_tokens'] = max(
+                usage.get('output_tokens', 0), context_window.estimate_tokens(text)
+            )
+        return {**usage, 'ttft_ms': self.ttft_ms, 'latency_ms': self.latency_ms}
+
+    async def _run(self) -> AsyncGenerator[str, None]:
+        started = self._started = time.monotonic()
+        pending = list(self.model_configs)
+        # First-token reads in flight, with their config, stream and usage
+        racers: Dict[asyncio.Task, tuple] = {}
+        winner: Optional[AsyncGenerator[str, None]] = None
+        last_error: Optional[Exception] = None
+        deadline = None
+
+        def start_next() -> None:
+            nonlocal deadline
+            config = pending.pop(0)
+            usage = {}
+            stream = self._start(config, usage)
+            racers[asyncio.ensure_future(stream.__anext__())] = (config, stream, usage)
+            ttft_ms = config.get('ttft_deadline_ms')
+            # The last model in the chain gets as long as it needs
+            deadline = time.monotonic() + int(ttft_ms) / 1000 if ttft_ms and pending else None
+
+        try:
+            start_next()
+            while racers:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                done, _ = await asyncio.wait(
+                    set(racers), timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+
+                if not done:
+                    slow = [racer[0] for racer in racers.values()]
+                    logger.warning(
+                        "No first token from %s within deadline, trying %s",
+                        slow[-1]['config_id'], pending[0]['config_id']
+                    )
+                    if not slow[-1].get('hedge'):
+                        for task in list(racers):
+                            await _discard(task, racers.pop(task)[1])
+                    start_next()
+                    continue
+
+                for task in done:
+                    config, stream, usage = racers.pop(task)
+                    try:
+                        first = task.result()
+                    except StopAsyncIteration:
+                        first = None
+                    except Exception as e:
+                        logger.warning("Model %s failed before its first token: %s", config['config_id'], e)
+                        last_error = e
+                        continue
+
+                    # First to stream wins; stop the others
+                    for other in list(racers):
+                        await _discard(other, racers.pop(other)[1])
+
+                    self.served_by = config
+                    self.usage = usage
+                    winner = stream
+                    if first is None:
+                        self.complete = True
+                        return
+                    self.ttft_ms = int((time.monotonic() - started) * 1000)
+                    yield first
+                    try:
+                        async for chunk in stream:
+                            yield chunk
+                    except Exception as e:
+                        # Too late to fail over once the reply has started
+                        yield _error_text(e)
+                    else:
+                        self.complete = True
+                    return
+
+                if not racers and pending:
+                    start_next()
+
+            self.served_by = self.model_configs[-1]
+            yield _error_text(last_error)
+        finally:
+            for task in list(racers):
+                await _discard(task, racers.pop(task)[1])
+            if winner is not None:
+                await winner.aclose()
+            self.latency_ms = int((time.monotonic() - started) * 1000)
+
+
+async def _discard(task: asyncio.Task, stream: AsyncGenerator) -> None:
+    """Cancel a pending read and close its stream, releasing the model call."""
+    task.cancel()
+    await asyncio.wait({task})
+    if not task.cancelled():
+        task.exception()
+    await stream.aclose()
 
 
 def invoke_model(
@@ -115,44 +892,47 @@ def invoke_model(
     max_tokens: int = 4096,
     temperature: float = 0.7,
     memories: Optional[List[Dict[str, Any]]] = None,
-    system_prompt: Optional[str] = None
+    system_prompt: Optional[str] = None,
+    raise_on_error: bool = False
 ) -> str:
     """
     Invoke a Claude model without streaming (for simple responses).
     
+    Args:
+        raise_on_error: Raise Bedrock errors instead of returning them as text
+    
     Returns:
         Complete response text
     """
     
-    system, formatted_messages = build_messages_with_context(
-        messages,
-        memories or [],
-        system_prompt
-    )
-    
-    request_body = {
-        "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": max_tokens,
-        "temperature": temperature,
-        "system": system,
-        "messages": formatted_messages
-    }
-    
     try:
-        response = bedrock_runtime.invoke_model(
-            modelId=model_id,
-            contentType="application/json",
-            accept="application/json",
-            body=json.dumps(request_body)
+        request_body = _build_request_body(
+            messages, max_tokens, temperature, memories, system_prompt
         )
-        
-        response_body = json.loads(response['body'].read())
+        response_body = scheduler.invoke(model_id, request_body)
         return response_body['content'][0]['text']
         
     except Exception as e:
+        if raise_on_error:
+            raise
         return f"Error: {str(e)}"
 
 
+def heuristic_title(first_message: str) -> str:
+    """Build a title locally from the first words of a message."""
+    
+    for line in first_message.splitlines():
+        # Drop markdown markers and punctuation-only lines
+        words = re.sub(r"[#>*_`\[\]]+", " ", line).split()
+        if words:
+            title = " ".join(words[:6])
+            if len(title) > 60:
+                title = title[:57].rstrip() + "..."
+            return title[0].upper() + title[1:]
+    
+    return "New Chat"
+
+
 def generate_chat_title(first_message: str, model_id: str) -> str:
     """Generate a title for a chat based on the first message."""
     
@@ -170,8 +950,50 @@ Respond with ONLY the title, no quotes or extra text."""
             messages=messages,
             model_id=model_id,
             max_tokens=50,
-            temperature=0.5
+            temperature=0.5,
+            raise_on_error=True
+        )
+        return title.strip()[:100] or heuristic_title(first_message)
+    except Exception:
+        return heuristic_title(first_message)
+
+
+async def invoke_model_async(
+    messages: List[Dict[str, str]],
+    model_id: str,
+    max_tokens: int = 4096,
+    temperature: float = 0.7,
+    memories: Optional[List[Dict[str, Any]]] = None,
+    system_prompt: Optional[str] = None,
+    raise_on_error: bool = False
+) -> str:
+    """Async variant of invoke_model, run on a worker thread."""
+    return await asyncio.to_thread(
+        invoke_model,
+        messages=messages,
+        model_id=model_id,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        memories=memories,
+        system_prompt=system_prompt,
+        raise_on_error=raise_on_error
+    )
+
+
+async def generate_chat_title_async(
+    first_message: str,
+    model_id: str,
+    timeout: float = TITLE_TIMEOUT
+) -> str:
+    """
+    Async variant of generate_chat_title, run on a worker thread.
+    
+    Falls back to heuristic_title if the model doesn't answer within timeout.
+    """
+    try:
+        return await asyncio.wait_for(
+            asyncio.to_thread(generate_chat_title, first_message, model_id),
+            timeout
         )
-        return title.strip()[:100]
-    except:
-        return "New Chat"
+    except asyncio.TimeoutError:
+        return heuristic_title(first_message)
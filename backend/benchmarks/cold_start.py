@@ -0,0 +1,126 @@
+"""
+Cold start profile of the Lambda handler.
+
+Each run starts a fresh interpreter with `python -X importtime` and
+measures:
+
+- the time to import main, which is the work done in Lambda's init phase
+- the time to create the AWS clients on first use, which the first
+  request pays
+
+The report lists both medians and the top-level packages that take the
+most import time. Raw importtime output for one run can be reproduced with:
+
+    python -X importtime -c "import main" 2> importtime.log
+
+Usage (from backend/):
+    python -m benchmarks.cold_start --runs 10 --output cold_start.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from typing import Any, Dict, List
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Written to stderr between init and first use, to split the importtime log
+MARKER = '-- first use --'
+
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+sys.stderr.write('{marker}\\n')
+import bedrock_client, storage_dynamodb
+bedrock_client.get_bedrock_runtime()
+storage_dynamodb.get_dynamodb()
+clients = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_use_ms': (clients - imported) * 1000,
+}))
+""".replace('{marker}', MARKER)
+
+
+def parse_importtime(output: str) -> Dict[str, float]:
+    """Sum -X importtime self times (in ms) by top-level package."""
+    totals: Dict[str, float] = defaultdict(float)
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        totals[name.strip().split('.')[0]] += int(self_us) / 1000
+    return totals
+
+
+def run_once() -> Dict[str, Any]:
+    # Placeholder credentials let clients be created without an AWS profile;
+    # no request is sent
+    env = {
+        'AWS_ACCESS_KEY_ID': 'profile',
+        'AWS_SECRET_ACCESS_KEY': 'profile',
+        **os.environ,
+        'PYTHONDONTWRITEBYTECODE': '1',
+    }
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', CHILD],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    init_log, _, first_use_log = proc.stderr.partition(MARKER)
+    result['init_packages'] = parse_importtime(init_log)
+    result['first_use_packages'] = parse_importtime(first_use_log)
+    return result
+
+
+def _median_by_package(samples: List[Dict[str, Any]], key: str) -> Dict[str, float]:
+    packages = defaultdict(list)
+    for sample in samples:
+        for name, ms in sample[key].items():
+            packages[name].append(ms)
+    medians = {name: round(statistics.median(values), 1) for name, values in packages.items()}
+    return dict(sorted(medians.items(), key=lambda kv: -kv[1]))
+
+
+def profile(runs: int) -> Dict[str, Any]:
+    samples: List[Dict[str, Any]] = [run_once() for _ in range(runs)]
+
+    return {
+        'runs': runs,
+        'python': sys.version.split()[0],
+        'import_ms': round(statistics.median(s['import_ms'] for s in samples), 1),
+        'first_use_ms': round(statistics.median(s['first_use_ms'] for s in samples), 1),
+        'init_packages_ms': _median_by_package(samples, 'init_packages'),
+        'first_use_packages_ms': _median_by_package(samples, 'first_use_packages'),
+    }
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters to measure')
+    parser.add_argument('--top', type=int, default=15, help='Packages to list')
+    parser.add_argument('--output', help='Write the report as JSON to this file')
+    args = parser.parse_args()
+
+    report = profile(args.runs)
+
+    print(f"Cold start, median of {report['runs']} runs (Python {report['python']})")
+    print(f"  import main (init):        {report['import_ms']:8.1f} ms")
+    print(f"  AWS clients on first use:  {report['first_use_ms']:8.1f} ms")
+    for title, key in (('init', 'init_packages_ms'), ('first use', 'first_use_packages_ms')):
+        print(f"Import time during {title} by top-level package (self time):")
+        for name, ms in list(report[key].items())[:args.top]:
+            print(f"  {name:<28} {ms:8.1f} ms")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main_cli()
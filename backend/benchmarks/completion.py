@@ -0,0 +1,302 @@
+"""
+Benchmark for the chat completion pipeline.
+
+Drives the FastAPI app in-process, with an ASGI client and no server.
+Bedrock is replaced by a local fake with configurable TTFT, speed and chunk
+size. Storage is a SQLite database in a temporary directory, wrapped to
+count storage calls per request. Each scenario (history size x memory count
+x concurrency) sends completions for seeded chats and reports:
+
+- TTFT: time to the first content event
+- end-to-end latency: time to the end of the response
+- throughput
+- storage calls per request, by Storage method
+
+Storage calls are counted at the Storage interface, not as DynamoDB API
+calls: one call can be several requests on DynamoDB (query pages,
+BatchWriteItem batches), and their sizes aren't measured. Use tracing
+(TRACING_ENABLED) against real tables for DynamoDB request counts.
+
+Results are written as JSON. Pass an earlier results file as --baseline to
+compare p50/p95 against it.
+
+Usage (from backend/):
+    python -m benchmarks.completion --output results.json
+    python -m benchmarks.completion --history 2,2000 --memories 0,500 --concurrency 1,32
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import bedrock_client as bedrock
+import blob_store
+import database as db
+import main
+import storage
+from blob_store import LocalBlobStore
+from storage_sqlite import SQLiteStorage
+
+from benchmarks.fakes import CountingStorage, FakeBedrock, count_request_calls
+
+USER_ID = main.DEFAULT_USER_ID
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """Get the mean, p50, p95, p99 and max of a sample, with linear interpolation."""
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def at(q: float) -> float:
+        position = (len(ordered) - 1) * q
+        lower = math.floor(position)
+        upper = min(lower + 1, len(ordered) - 1)
+        return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+    return {
+        'mean': round(sum(ordered) / len(ordered), 2),
+        'p50': round(at(0.50), 2),
+        'p95': round(at(0.95), 2),
+        'p99': round(at(0.99), 2),
+        'max': round(ordered[-1], 2),
+    }
+
+
+# ============================================
+# In-process client
+# ============================================
+
+async def post_completion(body: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Send one completion request to the app and time its response.
+
+    Returns:
+        TTFT and end-to-end latency in ms, status, response size and the
+        storage calls made while handling it
+    """
+    calls = count_request_calls()
+    request_body = json.dumps(body).encode()
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'POST',
+        'scheme': 'http',
+        'path': '/api/chat/completions',
+        'raw_path': b'/api/chat/completions',
+        'query_string': b'',
+        'root_path': '',
+        'headers': [(b'content-type', b'application/json'), (b'host', b'benchmark')],
+        'client': ('127.0.0.1', 0),
+        'server': ('benchmark', 80),
+    }
+
+    result = {'status': None, 'ttft_ms': None, 'latency_ms': None, 'bytes': 0}
+    received = False
+    finished = asyncio.Event()
+    started = time.perf_counter()
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {'type': 'http.request', 'body': request_body, 'more_body': False}
+        await finished.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            result['status'] = message['status']
+        elif message['type'] == 'http.response.body':
+            chunk = message.get('body', b'')
+            result['bytes'] += len(chunk)
+            if result['ttft_ms'] is None and b'event: content' in chunk:
+                result['ttft_ms'] = (time.perf_counter() - started) * 1000
+            if not message.get('more_body'):
+                result['latency_ms'] = (time.perf_counter() - started) * 1000
+                finished.set()
+
+    await main.app(scope, receive, send)
+    result['storage_calls'] = dict(calls)
+    return result
+
+
+# ============================================
+# Scenarios
+# ============================================
+
+def seed_chat(history: int) -> str:
+    """Create a chat with `history` alternating user and assistant messages."""
+    chat = db.create_chat(USER_ID, "Benchmark chat")
+    messages = [
+        db.build_message_item(
+            chat['chat_id'],
+            'user' if i % 2 == 0 else 'assistant',
+            f"Message {i}: " + 'lorem ipsum dolor sit amet ' * 8
+        )
+        for i in range(history)
+    ]
+    if messages:
+        db.save_exchange(USER_ID, chat['chat_id'], messages)
+    return chat['chat_id']
+
+
+def seed_memories(count: int) -> None:
+    """Replace the user's memories with `count` generated ones."""
+    for memory in db.get_memories(USER_ID, enabled_only=False):
+        db.delete_memory(USER_ID, memory['memory_id'])
+    for i in range(count):
+        db.add_memory(USER_ID, f"Memory {i}: the user likes topic {i % 37} and tool {i % 11}")
+
+
+async def run_scenario(history: int, memories: int, concurrency: int, requests: int) -> Dict[str, Any]:
+    """Send `requests` completions, `concurrency` at a time, each to its own seeded chat."""
+    seed_memories(memories)
+    chat_ids = [seed_chat(history) for _ in range(requests)]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(chat_id: str) -> Dict[str, Any]:
+        async with semaphore:
+            return await post_completion({'content': 'What should I read next?', 'chat_id': chat_id})
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one(chat_id) for chat_id in chat_ids))
+    elapsed = time.perf_counter() - started
+
+    ok = [r for r in results if r['status'] == 200 and r['ttft_ms'] is not None]
+    calls_total = Counter()
+    for r in ok:
+        calls_total.update(r['storage_calls'])
+
+    return {
+        'history': history,
+        'memories': memories,
+        'concurrency': concurrency,
+        'requests': requests,
+        'errors': len(results) - len(ok),
+        'ttft_ms': percentiles([r['ttft_ms'] for r in ok]),
+        'latency_ms': percentiles([r['latency_ms'] for r in ok]),
+        'throughput_rps': round(len(ok) / elapsed, 2),
+        'storage_calls_per_request': {
+            'total': round(sum(calls_total.values()) / len(ok), 2) if ok else 0,
+            **{op: round(n / len(ok), 2) for op, n in sorted(calls_total.items())}
+        },
+    }
+
+
+def scenario_key(result: Dict[str, Any]) -> tuple:
+    return result['history'], result['memories'], result['concurrency']
+
+
+def print_result(result: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> None:
+    line = (
+        f"history={result['history']:<5} memories={result['memories']:<4} "
+        f"concurrency={result['concurrency']:<3} "
+        f"ttft p50/p95/p99={result['ttft_ms']['p50']:.1f}/{result['ttft_ms']['p95']:.1f}/{result['ttft_ms']['p99']:.1f} ms  "
+        f"e2e p50/p95={result['latency_ms']['p50']:.1f}/{result['latency_ms']['p95']:.1f} ms  "
+        f"{result['throughput_rps']:.1f} req/s  "
+        f"{result['storage_calls_per_request']['total']:.1f} storage calls/req"
+    )
+    if result['errors']:
+        line += f"  errors={result['errors']}"
+    if baseline:
+        changes = []
+        for metric in ('ttft_ms', 'latency_ms'):
+            for q in ('p50', 'p95'):
+                before, after = baseline[metric].get(q), result[metric].get(q)
+                if before:
+                    changes.append(f"{metric[:-3]} {q} {(after - before) / before * 100:+.0f}%")
+        line += "  [vs baseline: " + ', '.join(changes) + "]"
+    print(line, flush=True)
+
+
+def parse_sizes(value: str) -> List[int]:
+    return [int(v) for v in value.split(',') if v]
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    fake = FakeBedrock(
+        ttft_ms=args.ttft_ms,
+        tokens_per_s=args.tokens_per_s,
+        chunk_tokens=args.chunk_tokens,
+        output_tokens=args.output_tokens
+    )
+    bedrock.bedrock_runtime = fake
+    if not args.bedrock_limits:
+        # Measure the app, not the production rate limits
+        bedrock.scheduler = bedrock.BedrockScheduler(client=fake, max_concurrency=10_000, rate=1e9, burst=10**9)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {scenario_key(r): r for r in json.load(f)['results']}
+
+    # The database, and blobs if offloading is enabled, are removed with the
+    # work directory when the run ends
+    results = []
+    with tempfile.TemporaryDirectory(prefix='chatbot-bench-') as workdir:
+        storage.set_storage(CountingStorage(SQLiteStorage(os.path.join(workdir, 'bench.db'))))
+        if blob_store.BLOB_STORE:
+            blob_store.set_blob_store(LocalBlobStore(os.path.join(workdir, 'blobs')))
+        try:
+            db.init_default_models()
+            for history in parse_sizes(args.history):
+                for memories in parse_sizes(args.memories):
+                    for concurrency in parse_sizes(args.concurrency):
+                        requests = max(args.requests, concurrency)
+                        result = await run_scenario(history, memories, concurrency, requests)
+                        results.append(result)
+                        print_result(result, baseline.get(scenario_key(result)))
+        finally:
+            storage.set_storage(None)
+            blob_store.set_blob_store(None)
+
+    return {
+        'benchmark': 'completion',
+        'created_at': datetime.utcnow().isoformat(),
+        'environment': {'python': platform.python_version(), 'platform': platform.platform()},
+        'config': {
+            'ttft_ms': args.ttft_ms,
+            'tokens_per_s': args.tokens_per_s,
+            'chunk_tokens': args.chunk_tokens,
+            'output_tokens': args.output_tokens,
+            'bedrock_limits': args.bedrock_limits,
+        },
+        'bedrock_calls': dict(fake.calls),
+        'results': results,
+    }
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--history', default='2,200,2000', help='Comma-separated chat history sizes (messages)')
+    parser.add_argument('--memories', default='0,50,500', help='Comma-separated memory counts')
+    parser.add_argument('--concurrency', default='1,8,32', help='Comma-separated numbers of concurrent streams')
+    parser.add_argument('--requests', type=int, default=16, help='Requests per scenario (at least the concurrency)')
+    parser.add_argument('--ttft-ms', type=float, default=50, help='Fake model time to first token')
+    parser.add_argument('--tokens-per-s', type=float, default=500, help='Fake model output speed')
+    parser.add_argument('--chunk-tokens', type=int, default=1, help='Tokens per streamed delta')
+    parser.add_argument('--output-tokens', type=int, default=100, help='Tokens per answer')
+    parser.add_argument('--bedrock-limits', action='store_true', help='Keep the configured Bedrock rate and concurrency limits')
+    parser.add_argument('--baseline', help='Earlier results file to compare against')
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,124 @@
+"""
+Local stand-ins for the completion pipeline's external services.
+"""
+import io
+import json
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from storage import Storage
+
+
+class FakeEventStream:
+    """A Bedrock response stream that emits text at a fixed pace."""
+
+    def __init__(self, ttft_ms: float, tokens_per_s: float, chunk_tokens: int, output_tokens: int, input_tokens: int):
+        self.ttft_ms = ttft_ms
+        self.tokens_per_s = tokens_per_s
+        self.chunk_tokens = chunk_tokens
+        self.output_tokens = output_tokens
+        self.input_tokens = input_tokens
+        self.closed = False
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        yield self._event({'type': 'message_start', 'message': {'usage': {'input_tokens': self.input_tokens, 'output_tokens': 1}}})
+        time.sleep(self.ttft_ms / 1000)
+
+        sent = 0
+        while sent < self.output_tokens and not self.closed:
+            tokens = min(self.chunk_tokens, self.output_tokens - sent)
+            if sent:
+                time.sleep(tokens / self.tokens_per_s)
+            yield self._event({'type': 'content_block_delta', 'delta': {'type': 'text_delta', 'text': 'token ' * tokens}})
+            sent += tokens
+
+        yield self._event({'type': 'message_delta', 'usage': {'output_tokens': sent}})
+        yield self._event({'type': 'message_stop'})
+
+    @staticmethod
+    def _event(data: Dict[str, Any]) -> Dict[str, Any]:
+        return {'chunk': {'bytes': json.dumps(data).encode()}}
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class FakeBedrock:
+    """
+    A bedrock-runtime client with configurable latency and streaming speed.
+
+    Args:
+        ttft_ms: Delay before the first text delta, and the latency of
+            non-streaming calls (titles and summaries)
+        tokens_per_s: Output speed after the first delta
+        chunk_tokens: Tokens per text delta
+        output_tokens: Tokens in each streamed answer
+    """
+
+    def __init__(self, ttft_ms: float = 50, tokens_per_s: float = 500, chunk_tokens: int = 1, output_tokens: int = 100):
+        self.ttft_ms = ttft_ms
+        self.tokens_per_s = tokens_per_s
+        self.chunk_tokens = chunk_tokens
+        self.output_tokens = output_tokens
+        self.calls: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def _count(self, operation: str, body: str) -> int:
+        with self._lock:
+            self.calls[operation] += 1
+        # A rough token count of the prompt, for the usage events
+        return len(body) // 4
+
+    def invoke_model_with_response_stream(self, modelId: str, body: str, **kwargs) -> Dict[str, Any]:
+        input_tokens = self._count('invoke_model_with_response_stream', body)
+        return {'body': FakeEventStream(
+            self.ttft_ms, self.tokens_per_s, self.chunk_tokens, self.output_tokens, input_tokens
+        )}
+
+    def invoke_model(self, modelId: str, body: str, **kwargs) -> Dict[str, Any]:
+        input_tokens = self._count('invoke_model', body)
+        time.sleep(self.ttft_ms / 1000)
+        response = {
+            'content': [{'type': 'text', 'text': 'Benchmark summary'}],
+            'usage': {'input_tokens': input_tokens, 'output_tokens': 2}
+        }
+        return {'body': io.BytesIO(json.dumps(response).encode())}
+
+
+# Storage call counts of the request being handled. Worker threads run in
+# a copy of the request's context, so their calls are counted too.
+_request_calls: ContextVar[Optional[Tuple[Counter, threading.Lock]]] = ContextVar('request_calls', default=None)
+
+
+def count_request_calls() -> Counter:
+    """Start counting the current request's storage calls; returns the counter."""
+    calls = Counter()
+    _request_calls.set((calls, threading.Lock()))
+    return calls
+
+
+@Storage.register
+class CountingStorage:
+    """Wraps a storage backend and counts its calls per request."""
+
+    def __init__(self, storage: Storage):
+        self.storage = storage
+
+    def __getattribute__(self, name: str):
+        if name.startswith('_') or name == 'storage':
+            return object.__getattribute__(self, name)
+
+        method = getattr(object.__getattribute__(self, 'storage'), name)
+
+        def counted(*args, **kwargs):
+            entry = _request_calls.get()
+            if entry is not None:
+                calls, lock = entry
+                with lock:
+                    calls[name] += 1
+            return method(*args, **kwargs)
+
+        return counted
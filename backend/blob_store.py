@@ -0,0 +1,132 @@
+"""
+Blob storage for message content too large to keep inline.
+
+Messages whose compressed content is above MESSAGE_OFFLOAD_THRESHOLD are
+written here and referenced from their item (see storage.pack_message).
+The store is chosen with BLOB_STORE:
+
+- (unset): offloading is disabled and all content stays inline
+- local: files under BLOB_STORE_PATH, for single-node deployments
+- s3: objects in BLOB_BUCKET, for the Lambda deployment
+"""
+import os
+import threading
+from abc import ABC, abstractmethod
+from typing import List, Optional
+
+BLOB_STORE = os.environ.get('BLOB_STORE', '').lower()
+
+
+class BlobStore(ABC):
+    """Stores opaque bytes by key. Implementations must be thread-safe."""
+
+    @abstractmethod
+    def put(self, key: str, data: bytes) -> None:
+        ...
+
+    @abstractmethod
+    def get(self, key: str) -> bytes:
+        """Get a blob's bytes. Raises KeyError if it doesn't exist."""
+
+    @abstractmethod
+    def delete(self, keys: List[str]) -> None:
+        """Delete blobs; keys that don't exist are ignored."""
+
+
+class LocalBlobStore(BlobStore):
+    """Blobs as files in a local directory."""
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+
+    def _path(self, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"Invalid blob key '{key}'")
+        return path
+
+    def put(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename, so readers never see a partial blob
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def get(self, key: str) -> bytes:
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            raise KeyError(key)
+
+    def delete(self, keys: List[str]) -> None:
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+
+# DeleteObjects accepts at most 1000 keys per call
+S3_DELETE_BATCH_SIZE = 1000
+
+
+class S3BlobStore(BlobStore):
+    """Blobs as objects in an S3 bucket."""
+
+    def __init__(self, bucket: str):
+        self.bucket = bucket
+
+    @property
+    def client(self):
+        import aws
+        return aws.get_client('s3')
+
+    def put(self, key: str, data: bytes) -> None:
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data)
+
+    def get(self, key: str) -> bytes:
+        client = self.client
+        try:
+            response = client.get_object(Bucket=self.bucket, Key=key)
+        except client.exceptions.NoSuchKey:
+            raise KeyError(key)
+        return response['Body'].read()
+
+    def delete(self, keys: List[str]) -> None:
+        for i in range(0, len(keys), S3_DELETE_BATCH_SIZE):
+            batch = keys[i:i + S3_DELETE_BATCH_SIZE]
+            self.client.delete_objects(
+                Bucket=self.bucket,
+                Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True}
+            )
+
+
+_blob_store: Optional[BlobStore] = None
+_blob_store_lock = threading.Lock()
+
+
+def get_blob_store() -> Optional[BlobStore]:
+    """Get the blob store selected by BLOB_STORE, or None if offloading is disabled."""
+    global _blob_store
+    if _blob_store is None and BLOB_STORE:
+        with _blob_store_lock:
+            if _blob_store is None:
+                _blob_store = _create_blob_store(BLOB_STORE)
+    return _blob_store
+
+
+def set_blob_store(store: Optional[BlobStore]) -> None:
+    """Use a different blob store, e.g. in benchmarks."""
+    global _blob_store
+    _blob_store = store
+
+
+def _create_blob_store(kind: str) -> BlobStore:
+    if kind == 'local':
+        return LocalBlobStore(os.environ.get('BLOB_STORE_PATH', 'blobs'))
+    if kind == 's3':
+        return S3BlobStore(os.environ['BLOB_BUCKET'])
+    raise ValueError(f"Unknown BLOB_STORE '{kind}' (expected local or s3)")
@@ -0,0 +1,89 @@
+"""
+Context window management for conversation assembly.
+
+Estimates token counts with a fast local heuristic and trims the
+conversation history so the prompt fits a model's context budget.
+"""
+import math
+import os
+from typing import Dict, List, Tuple
+
+# Context window used when a model config doesn't set one (all Claude 3+ models)
+DEFAULT_CONTEXT_WINDOW = int(os.environ.get('DEFAULT_CONTEXT_WINDOW', '200000'))
+
+# Claude averages ~3.5-4 characters per token for English text and code;
+# the lower bound keeps the estimate on the safe side
+CHARS_PER_TOKEN = 3.5
+
+# Role markers and message framing
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Headroom for estimation error
+SAFETY_MARGIN_TOKENS = 1000
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens in a piece of text."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def estimate_message_tokens(message: Dict[str, str]) -> int:
+    """Estimate the tokens a single chat message contributes to the prompt."""
+    if 'content' not in message and 'content_length' in message:
+        # Packed content is measured without decoding it
+        return math.ceil(int(message['content_length']) / CHARS_PER_TOKEN) + MESSAGE_OVERHEAD_TOKENS
+    return estimate_tokens(message['content']) + MESSAGE_OVERHEAD_TOKENS
+
+
+def get_history_budget(model_config: Dict, system: str) -> int:
+    """
+    Get the number of tokens available for conversation history.
+
+    The model's context window is reduced by the output reservation
+    (max_tokens), the system prompt (including memories) and a safety margin.
+    """
+    context_window = int(model_config.get('context_window') or DEFAULT_CONTEXT_WINDOW)
+    max_tokens = int(model_config.get('max_tokens', 4096))
+    return context_window - max_tokens - estimate_tokens(system) - SAFETY_MARGIN_TOKENS
+
+
+def get_chain_budget(model_configs: List[Dict], system: str) -> int:
+    """
+    Get the history budget for a fallback chain of models.
+
+    Any model in the chain may serve the reply, so the history has to fit
+    the smallest of their budgets.
+    """
+    return min(get_history_budget(config, system) for config in model_configs)
+
+
+def fit_conversation(
+    conversation: List[Dict[str, str]],
+    budget: int
+) -> Tuple[List[Dict[str, str]], int]:
+    """
+    Keep the newest turns of a conversation that fit within a token budget.
+
+    The latest message is always kept. The kept history always starts with
+    a user turn, as the Messages API requires.
+
+    Args:
+        conversation: Messages in chronological order
+        budget: Tokens available for the history
+
+    Returns:
+        The kept messages and the number of turns dropped
+    """
+    used = 0
+    start = len(conversation)
+
+    for index in range(len(conversation) - 1, -1, -1):
+        used += estimate_message_tokens(conversation[index])
+        if used > budget and index < len(conversation) - 1:
+            break
+        start = index
+
+    while start < len(conversation) - 1 and conversation[start]['role'] != 'user':
+        start += 1
+
+    return conversation[start:], start
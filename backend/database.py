@@ -1,27 +1,31 @@
 """
-DynamoDB database operations for the ChatGPT clone.
+Database operations for the ChatGPT clone.
+
+Persistence is delegated to the storage backend selected by STORAGE_BACKEND
+(see storage.py). This module adds what is common to all backends: item
+building, validation, the model config cache and memory index updates.
 """
 import os
-import boto3
-from datetime import datetime
-from typing import Optional, List, Dict, Any
+import threading
+import time
+from typing import Optional, List, Dict, Any, Tuple
 from uuid import uuid4
 
-# Initialize DynamoDB client
-dynamodb = boto3.resource('dynamodb', region_name=os.environ.get('AWS_REGION_NAME', 'us-east-1'))
-
-# Table references
-def get_chats_table():
-    return dynamodb.Table(os.environ.get('CHATS_TABLE', 'mychatgpt-chats'))
-
-def get_messages_table():
-    return dynamodb.Table(os.environ.get('MESSAGES_TABLE', 'mychatgpt-messages'))
-
-def get_memories_table():
-    return dynamodb.Table(os.environ.get('MEMORIES_TABLE', 'mychatgpt-memories'))
-
-def get_model_config_table():
-    return dynamodb.Table(os.environ.get('MODEL_CONFIG_TABLE', 'mychatgpt-model-config'))
+import memory_index
+import search_index
+from storage import (
+    MODEL_CONFIG_META_ID,
+    LazyMessage,
+    USAGE_FIELDS,
+    USAGE_GROUPS,
+    USAGE_TOTALS,
+    get_storage,
+    is_time_ordered_id,
+    message_id_from_timestamp,
+    new_message_id,
+    unpack_message,
+    utcnow
+)
 
 
 # ============================================
@@ -30,81 +34,106 @@ def get_model_config_table():
 
 def create_chat(user_id: str, title: str = "New Chat") -> Dict[str, Any]:
     """Create a new chat session."""
-    table = get_chats_table()
-    chat_id = str(uuid4())
-    now = datetime.utcnow().isoformat()
-    
-    item = {
-        'user_id': user_id,
-        'chat_id': chat_id,
-        'title': title,
-        'created_at': now,
-        'updated_at': now
-    }
-    
-    table.put_item(Item=item)
-    return item
+    chat = get_storage().create_chat(user_id, title)
+    search_index.on_chat_created(user_id, chat)
+    return chat
 
 
 def get_chats(user_id: str) -> List[Dict[str, Any]]:
     """Get all chats for a user, sorted by updated_at descending."""
-    table = get_chats_table()
+    return get_storage().get_chats(user_id)
+
+
+def get_chats_page(
+    user_id: str,
+    limit: int = 50,
+    cursor: Optional[str] = None
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Get one page of a user's chats, most recently active first.
     
-    response = table.query(
-        KeyConditionExpression='user_id = :uid',
-        ExpressionAttributeValues={':uid': user_id},
-        ScanIndexForward=False  # Descending order
-    )
+    Each chat carries its message_count, total_tokens and a preview of its
+    last message, so the chat list needs no message reads.
+    
+    Args:
+        user_id: Owner of the chats
+        limit: Maximum number of chats in the page
+        cursor: Cursor from a previous page, to read the next page
     
-    return response.get('Items', [])
+    Returns:
+        The page, and a cursor for the next page (None when there are no
+        more chats)
+    """
+    return get_storage().get_chats_page(user_id, limit, cursor=cursor)
 
 
 def get_chat(user_id: str, chat_id: str) -> Optional[Dict[str, Any]]:
-    """Get a specific chat."""
-    table = get_chats_table()
-    
-    response = table.get_item(
-        Key={'user_id': user_id, 'chat_id': chat_id}
-    )
-    
-    return response.get('Item')
+    """Get a specific chat. Chats pending deletion are not returned."""
+    item = get_storage().get_chat(user_id, chat_id)
+    if item and 'deleted_at' in item:
+        return None
+    return item
 
 
 def update_chat_title(user_id: str, chat_id: str, title: str) -> Dict[str, Any]:
     """Update chat title."""
-    table = get_chats_table()
-    now = datetime.utcnow().isoformat()
-    
-    response = table.update_item(
-        Key={'user_id': user_id, 'chat_id': chat_id},
-        UpdateExpression='SET title = :title, updated_at = :updated_at',
-        ExpressionAttributeValues={
-            ':title': title,
-            ':updated_at': now
-        },
-        ReturnValues='ALL_NEW'
+    chat = get_storage().update_chat_title(user_id, chat_id, title)
+    search_index.on_chat_renamed(user_id, chat_id, title)
+    return chat
+
+
+def update_chat_summary(
+    user_id: str,
+    chat_id: str,
+    summary: str,
+    summary_through: str,
+    previous_through: Optional[str] = None
+) -> bool:
+    """
+    Store a rolling summary of a chat's messages up to summary_through.
+    
+    The write only succeeds if the stored summary still ends at
+    previous_through, so concurrent compactions can't overwrite each other.
+    
+    Returns:
+        True if the summary was stored
+    """
+    return get_storage().update_chat_summary(
+        user_id, chat_id, summary, summary_through, previous_through
     )
+
+
+def mark_chat_deleted(user_id: str, chat_id: str) -> None:
+    """Hide a chat immediately; delete_chat removes it and its messages later."""
+    get_storage().mark_chat_deleted(user_id, chat_id)
+    search_index.on_chats_deleted(user_id, [chat_id])
+
+
+def request_cancel(user_id: str, chat_id: str, generation_id: str) -> bool:
+    """
+    Ask whichever instance runs a chat's generation to stop it.
+    
+    Returns:
+        False if the chat doesn't exist
+    """
+    return get_storage().request_cancel(user_id, chat_id, generation_id)
+
+
+def delete_chats(user_id: str, chat_ids: List[str]) -> int:
+    """
+    Delete chats and all their messages.
     
-    return response.get('Attributes', {})
+    Returns:
+        Number of messages deleted
+    """
+    deleted = get_storage().delete_chats(user_id, chat_ids)
+    search_index.on_chats_deleted(user_id, chat_ids)
+    return deleted
 
 
 def delete_chat(user_id: str, chat_id: str) -> bool:
     """Delete a chat and all its messages."""
-    # Delete all messages first
-    messages_table = get_messages_table()
-    messages = get_messages(chat_id)
-    
-    for msg in messages:
-        messages_table.delete_item(
-            Key={'chat_id': chat_id, 'message_id': msg['message_id']}
-        )
-    
-    # Delete the chat
-    chats_table = get_chats_table()
-    chats_table.delete_item(
-        Key={'user_id': user_id, 'chat_id': chat_id}
-    )
-    
+    delete_chats(user_id, [chat_id])
     return True
 
 
@@ -112,38 +141,181 @@ def delete_chat(user_id: str, chat_id: str) -> bool:
 # Message Operations
 # ============================================
 
-def add_message(chat_id: str, role: str, content: str) -> Dict[str, Any]:
-    """Add a message to a chat."""
-    table = get_messages_table()
-    message_id = str(uuid4())
-    now = datetime.utcnow().isoformat()
-    
+def build_message_item(
+    chat_id: str,
+    role: str,
+    content: str,
+    truncated: bool = False,
+    model_config: Optional[Dict[str, Any]] = None,
+    usage: Optional[Dict[str, int]] = None
+) -> Dict[str, Any]:
+    """
+    Build a message item (with its time-ordered ID) without writing it.
+    
+    Args:
+        truncated: Whether the message is a partial answer whose generation
+            was cancelled
+        model_config: The model config that generated the message
+        usage: Token counts and latencies of the generation (see USAGE_FIELDS)
+    """
     item = {
         'chat_id': chat_id,
-        'message_id': message_id,
+        'message_id': new_message_id(),
         'role': role,
         'content': content,
-        'created_at': now
+        'created_at': utcnow()
     }
-    
-    table.put_item(Item=item)
+    if truncated:
+        item['truncated'] = True
+    if model_config:
+        item['model_config_id'] = model_config['config_id']
+        item['model_id'] = model_config['model_id']
+    if usage:
+        item['usage'] = {k: int(usage[k]) for k in USAGE_FIELDS if usage.get(k) is not None}
     return item
 
 
-def get_messages(chat_id: str) -> List[Dict[str, Any]]:
-    """Get all messages for a chat, sorted by created_at."""
-    table = get_messages_table()
-    
-    response = table.query(
-        KeyConditionExpression='chat_id = :cid',
-        ExpressionAttributeValues={':cid': chat_id}
-    )
-    
-    # Sort by created_at since DynamoDB doesn't sort by non-key attributes
-    items = response.get('Items', [])
-    items.sort(key=lambda x: x.get('created_at', ''))
-    
-    return items
+def add_message(
+    user_id: str,
+    chat_id: str,
+    role: str,
+    content: str,
+    usage: Optional[Dict[str, int]] = None
+) -> Dict[str, Any]:
+    """
+    Add a message to a chat.
+    
+    The message is written with save_exchange, so the chat's activity and
+    the usage totals are updated with it.
+    
+    Raises:
+        ValueError: If the chat doesn't exist or is pending deletion
+    """
+    item = build_message_item(chat_id, role, content, usage=usage)
+    if not save_exchange(user_id, chat_id, [item]):
+        raise ValueError("Chat not found")
+    return item
+
+
+def save_exchange(
+    user_id: str,
+    chat_id: str,
+    messages: List[Dict[str, Any]],
+    title: Optional[str] = None
+) -> bool:
+    """
+    Write a completed exchange in a single transaction.
+    
+    The message items (from build_message_item) are written together with
+    the chat's activity: updated_at, message_count, total_tokens and a
+    preview of the last message. The title is set when one is given, and
+    the usage of each message is added to the usage totals in the same
+    transaction.
+    
+    Returns:
+        False if the chat no longer exists, in which case nothing is written
+    """
+    saved = get_storage().save_exchange(user_id, chat_id, messages, title=title)
+    if saved:
+        search_index.on_messages_saved(user_id, chat_id, messages, title=title)
+    return saved
+
+
+def get_messages(
+    chat_id: str,
+    limit: Optional[int] = None,
+    after_message_id: Optional[str] = None,
+    lazy: bool = False
+) -> List[Dict[str, Any]]:
+    """
+    Get messages for a chat in chronological order.
+    
+    Args:
+        chat_id: Chat to read
+        limit: Only return the newest `limit` messages
+        after_message_id: Only return messages created after this one
+        lazy: Return LazyMessage items, whose compressed or offloaded
+            content is only decoded when read (see load_content)
+    """
+    items = get_storage().get_messages(chat_id, limit=limit, after_message_id=after_message_id)
+    if lazy:
+        return [LazyMessage(item) for item in items]
+    return [unpack_message(item) for item in items]
+
+
+def load_content(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Decode the content of lazily loaded messages that are needed after all."""
+    return [unpack_message(message) for message in messages]
+
+
+def get_messages_page(
+    chat_id: str,
+    limit: int = 50,
+    cursor: Optional[str] = None
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Get one page of a chat's messages, newest page first.
+    
+    Args:
+        chat_id: Chat to read
+        limit: Maximum number of messages in the page
+        cursor: Cursor from a previous page, to read the next older page
+    
+    Returns:
+        The page in chronological order, and a cursor for the next older
+        page (None when there are no older messages)
+    """
+    items, next_cursor = get_storage().get_messages_page(chat_id, limit, cursor=cursor)
+    return [unpack_message(item) for item in items], next_cursor
+
+
+def search_messages(user_id: str, query: str, limit: int = 20) -> List[Dict[str, Any]]:
+    """
+    Full-text search over a user's messages (see search_index).
+    
+    Returns:
+        The best matches, with chat and message IDs and a snippet
+    """
+    return search_index.get_index().search(user_id, query, limit=limit)
+
+
+# ============================================
+# Usage Operations
+# ============================================
+
+def get_usage(
+    user_id: str,
+    group_by: str,
+    since: Optional[str] = None,
+    until: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    Get a user's usage totals grouped by model, chat or day.
+    
+    Args:
+        group_by: One of USAGE_GROUPS
+        since: First day to include (YYYY-MM-DD), for group_by='day'
+        until: Last day to include (YYYY-MM-DD), for group_by='day'
+    
+    Returns:
+        One entry per group with message count, token totals and average
+        TTFT and latency in ms
+    """
+    if group_by not in USAGE_GROUPS:
+        raise ValueError(f"group_by must be one of {', '.join(USAGE_GROUPS)}")
+    
+    groups = []
+    for bucket in get_storage().get_usage_buckets(user_id, group_by, since=since, until=until):
+        messages = bucket['messages']
+        entry = {group_by: bucket['bucket'], 'messages': messages}
+        for total in USAGE_TOTALS:
+            if total.endswith('_ms_total'):
+                average = total[:-len('_total')] + '_avg'
+                entry[average] = round(bucket[total] / messages) if messages else 0
+            else:
+                entry[total] = bucket[total]
+        groups.append(entry)
+    return groups
 
 
 # ============================================
@@ -152,32 +324,23 @@ def get_messages(chat_id: str) -> List[Dict[str, Any]]:
 
 def add_memory(user_id: str, content: str) -> Dict[str, Any]:
     """Add a memory for a user."""
-    table = get_memories_table()
-    memory_id = str(uuid4())
-    now = datetime.utcnow().isoformat()
-    
     item = {
         'user_id': user_id,
-        'memory_id': memory_id,
+        'memory_id': str(uuid4()),
         'content': content,
-        'created_at': now,
+        'terms': memory_index.term_counts(content),
+        'created_at': utcnow(),
         'enabled': True
     }
     
-    table.put_item(Item=item)
+    get_storage().put_memory(item)
+    memory_index.on_memory_saved(user_id, item)
     return item
 
 
 def get_memories(user_id: str, enabled_only: bool = True) -> List[Dict[str, Any]]:
     """Get all memories for a user."""
-    table = get_memories_table()
-    
-    response = table.query(
-        KeyConditionExpression='user_id = :uid',
-        ExpressionAttributeValues={':uid': user_id}
-    )
-    
-    items = response.get('Items', [])
+    items = get_storage().get_memories(user_id)
     
     if enabled_only:
         items = [m for m in items if m.get('enabled', True)]
@@ -187,49 +350,32 @@ def get_memories(user_id: str, enabled_only: bool = True) -> List[Dict[str, Any]
 
 def update_memory(user_id: str, memory_id: str, content: Optional[str] = None, enabled: Optional[bool] = None) -> Dict[str, Any]:
     """Update a memory."""
-    table = get_memories_table()
-    
-    update_expr = []
-    expr_values = {}
+    updates = {}
     
     if content is not None:
-        update_expr.append('content = :content')
-        expr_values[':content'] = content
+        updates['content'] = content
+        updates['terms'] = memory_index.term_counts(content)
     
     if enabled is not None:
-        update_expr.append('enabled = :enabled')
-        expr_values[':enabled'] = enabled
+        updates['enabled'] = enabled
     
-    if not update_expr:
+    if not updates:
         return get_memory(user_id, memory_id)
     
-    response = table.update_item(
-        Key={'user_id': user_id, 'memory_id': memory_id},
-        UpdateExpression='SET ' + ', '.join(update_expr),
-        ExpressionAttributeValues=expr_values,
-        ReturnValues='ALL_NEW'
-    )
-    
-    return response.get('Attributes', {})
+    memory = get_storage().update_memory(user_id, memory_id, updates)
+    memory_index.on_memory_saved(user_id, memory)
+    return memory
 
 
 def get_memory(user_id: str, memory_id: str) -> Optional[Dict[str, Any]]:
     """Get a specific memory."""
-    table = get_memories_table()
-    
-    response = table.get_item(
-        Key={'user_id': user_id, 'memory_id': memory_id}
-    )
-    
-    return response.get('Item')
+    return get_storage().get_memory(user_id, memory_id)
 
 
 def delete_memory(user_id: str, memory_id: str) -> bool:
     """Delete a memory."""
-    table = get_memories_table()
-    table.delete_item(
-        Key={'user_id': user_id, 'memory_id': memory_id}
-    )
+    get_storage().delete_memory(user_id, memory_id)
+    memory_index.on_memory_deleted(user_id, memory_id)
     return True
 
 
@@ -237,23 +383,64 @@ def delete_memory(user_id: str, memory_id: str) -> bool:
 # Model Config Operations
 # ============================================
 
+# Seconds a process trusts its cached configs before revalidating
+MODEL_CONFIG_CACHE_TTL = float(os.environ.get('MODEL_CONFIG_CACHE_TTL', '60'))
+
+_model_config_cache: Dict[str, Any] = {'configs': None, 'version': None, 'checked_at': 0.0}
+_model_config_lock = threading.Lock()
+
+
+def _load_model_configs() -> List[Dict[str, Any]]:
+    """Read all model configs from storage and refresh the cache."""
+    configs, version = get_storage().load_model_configs()
+    
+    with _model_config_lock:
+        _model_config_cache.update(
+            configs=configs,
+            version=version,
+            checked_at=time.monotonic()
+        )
+    
+    return configs
+
+
+def invalidate_model_config_cache() -> None:
+    """Drop this process's cached model configs."""
+    with _model_config_lock:
+        _model_config_cache.update(configs=None, version=None, checked_at=0.0)
+
+
 def get_model_configs() -> List[Dict[str, Any]]:
-    """Get all model configurations."""
-    table = get_model_config_table()
+    """
+    Get all model configurations.
+    
+    Configs are cached in-process. After MODEL_CONFIG_CACHE_TTL seconds the
+    cache is revalidated against the stored version counter, and the
+    configs are only read again if another instance changed them.
+    """
+    cache = _model_config_cache
+    configs = cache['configs']
+    
+    if configs is not None and time.monotonic() - cache['checked_at'] >= MODEL_CONFIG_CACHE_TTL:
+        if get_storage().get_model_config_version() == cache['version']:
+            with _model_config_lock:
+                cache['checked_at'] = time.monotonic()
+        else:
+            configs = None
+    
+    if configs is None:
+        configs = _load_model_configs()
     
-    response = table.scan()
-    return response.get('Items', [])
+    return [dict(config) for config in configs]
 
 
 def get_model_config(config_id: str) -> Optional[Dict[str, Any]]:
     """Get a specific model configuration."""
-    table = get_model_config_table()
-    
-    response = table.get_item(
-        Key={'config_id': config_id}
-    )
+    for config in get_model_configs():
+        if config['config_id'] == config_id:
+            return config
     
-    return response.get('Item')
+    return None
 
 
 def get_default_model_config() -> Optional[Dict[str, Any]]:
@@ -272,28 +459,39 @@ def get_default_model_config() -> Optional[Dict[str, Any]]:
     return None
 
 
+def set_default_model_config(config_id: Optional[str]) -> None:
+    """Point the default at a config (or at none) with a single write."""
+    get_storage().set_default_model_config(config_id)
+    invalidate_model_config_cache()
+
+
 def upsert_model_config(
     config_id: str,
     name: str,
     model_id: str,
     max_tokens: int = 4096,
     temperature: float = 0.7,
-    is_default: bool = False
+    is_default: bool = False,
+    context_window: Optional[int] = None,
+    fallback_config_ids: Optional[List[str]] = None,
+    ttft_deadline_ms: Optional[int] = None,
+    hedge: bool = False
 ) -> Dict[str, Any]:
-    """Create or update a model configuration."""
-    table = get_model_config_table()
-    now = datetime.utcnow().isoformat()
-    
-    # If setting this as default, unset other defaults
-    if is_default:
-        configs = get_model_configs()
-        for config in configs:
-            if config['config_id'] != config_id and config.get('is_default', False):
-                table.update_item(
-                    Key={'config_id': config['config_id']},
-                    UpdateExpression='SET is_default = :false',
-                    ExpressionAttributeValues={':false': False}
-                )
+    """
+    Create or update a model configuration.
+    
+    Args:
+        fallback_config_ids: Configs to fail over to, in order, if this model
+            errors or misses its time-to-first-token deadline
+        ttft_deadline_ms: Time to the first token after which the next
+            fallback is tried
+        hedge: Start the next fallback alongside a slow model instead of
+            abandoning it, and keep whichever streams first
+    """
+    if config_id == MODEL_CONFIG_META_ID:
+        raise ValueError(f"'{MODEL_CONFIG_META_ID}' is a reserved config ID")
+    if config_id in (fallback_config_ids or []):
+        raise ValueError("A model config can't fall back to itself")
     
     item = {
         'config_id': config_id,
@@ -302,19 +500,35 @@ def upsert_model_config(
         'max_tokens': max_tokens,
         'temperature': float(temperature),
         'is_default': is_default,
-        'updated_at': now
+        'updated_at': utcnow()
     }
+    if context_window:
+        item['context_window'] = context_window
+    if fallback_config_ids:
+        item['fallback_config_ids'] = fallback_config_ids
+    if ttft_deadline_ms:
+        item['ttft_deadline_ms'] = ttft_deadline_ms
+    if hedge:
+        item['hedge'] = True
+    
+    storage = get_storage()
+    storage.put_model_config(item)
+    
+    # Flipping the default only moves the pointer; otherwise clear the
+    # pointer if this config was the default
+    if is_default:
+        storage.set_default_model_config(config_id)
+    else:
+        storage.set_default_model_config(None, only_if=config_id)
+    invalidate_model_config_cache()
     
-    table.put_item(Item=item)
     return item
 
 
 def delete_model_config(config_id: str) -> bool:
     """Delete a model configuration."""
-    table = get_model_config_table()
-    table.delete_item(
-        Key={'config_id': config_id}
-    )
+    get_storage().delete_model_config(config_id)
+    invalidate_model_config_cache()
     return True
 
 
@@ -323,14 +537,17 @@ def init_default_models():
     configs = get_model_configs()
     
     if not configs:
-        # Add Claude Opus 4.5 as default
+        # Add Claude Opus 4.5 as default, failing over to Sonnet
         upsert_model_config(
             config_id='claude-opus-4',
             name='Claude Opus 4',
             model_id='us.anthropic.claude-opus-4-20250514-v1:0',
             max_tokens=16000,
             temperature=0.7,
-            is_default=True
+            is_default=True,
+            context_window=200000,
+            fallback_config_ids=['claude-sonnet-4'],
+            ttft_deadline_ms=15000
         )
         
         # Add Claude Sonnet as backup
@@ -340,5 +557,6 @@ def init_default_models():
             model_id='us.anthropic.claude-sonnet-4-20250514-v1:0',
             max_tokens=8000,
             temperature=0.7,
-            is_default=False
+            is_default=False,
+            context_window=200000
         )
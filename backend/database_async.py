@@ -0,0 +1,241 @@
+"""
+Async wrappers around the DynamoDB operations in database.py.
+
+Each call runs the synchronous boto3 operation on a shared worker pool, so
+handlers never block the event loop and independent reads can be issued
+concurrently with asyncio.gather.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Any, Callable, Tuple
+
+import database as db
+
+# Worker pool for blocking DynamoDB calls
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('DB_MAX_WORKERS', '16')),
+    thread_name_prefix='dynamodb'
+)
+
+
+async def _run(fn: Callable, *args, **kwargs):
+    """Run a blocking database function on the worker pool, in the caller's context."""
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(_executor, functools.partial(ctx.run, fn, *args, **kwargs))
+
+
+# ============================================
+# Chat Operations
+# ============================================
+
+async def create_chat(user_id: str, title: str = "New Chat") -> Dict[str, Any]:
+    return await _run(db.create_chat, user_id, title)
+
+
+async def get_chats(user_id: str) -> List[Dict[str, Any]]:
+    return await _run(db.get_chats, user_id)
+
+
+async def get_chats_page(
+    user_id: str,
+    limit: int = 50,
+    cursor: Optional[str] = None
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    return await _run(db.get_chats_page, user_id, limit=limit, cursor=cursor)
+
+
+async def get_chat(user_id: str, chat_id: str) -> Optional[Dict[str, Any]]:
+    return await _run(db.get_chat, user_id, chat_id)
+
+
+async def update_chat_title(user_id: str, chat_id: str, title: str) -> Dict[str, Any]:
+    return await _run(db.update_chat_title, user_id, chat_id, title)
+
+
+async def update_chat_summary(
+    user_id: str,
+    chat_id: str,
+    summary: str,
+    summary_through: str,
+    previous_through: Optional[str] = None
+) -> bool:
+    return await _run(
+        db.update_chat_summary,
+        user_id,
+        chat_id,
+        summary,
+        summary_through,
+        previous_through=previous_through
+    )
+
+
+async def mark_chat_deleted(user_id: str, chat_id: str) -> None:
+    return await _run(db.mark_chat_deleted, user_id, chat_id)
+
+
+async def request_cancel(user_id: str, chat_id: str, generation_id: str) -> bool:
+    return await _run(db.request_cancel, user_id, chat_id, generation_id)
+
+
+async def delete_chats(user_id: str, chat_ids: List[str]) -> int:
+    return await _run(db.delete_chats, user_id, chat_ids)
+
+
+async def delete_chat(user_id: str, chat_id: str) -> bool:
+    return await _run(db.delete_chat, user_id, chat_id)
+
+
+# ============================================
+# Message Operations
+# ============================================
+
+# Builds an item without I/O, so there is nothing to run off the loop
+build_message_item = db.build_message_item
+
+
+async def add_message(
+    user_id: str,
+    chat_id: str,
+    role: str,
+    content: str,
+    usage: Optional[Dict[str, int]] = None
+) -> Dict[str, Any]:
+    return await _run(db.add_message, user_id, chat_id, role, content, usage=usage)
+
+
+async def save_exchange(
+    user_id: str,
+    chat_id: str,
+    messages: List[Dict[str, Any]],
+    title: Optional[str] = None
+) -> bool:
+    return await _run(db.save_exchange, user_id, chat_id, messages, title=title)
+
+
+async def get_messages(
+    chat_id: str,
+    limit: Optional[int] = None,
+    after_message_id: Optional[str] = None,
+    lazy: bool = False
+) -> List[Dict[str, Any]]:
+    return await _run(db.get_messages, chat_id, limit=limit, after_message_id=after_message_id, lazy=lazy)
+
+
+async def load_content(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return await _run(db.load_content, messages)
+
+
+async def get_messages_page(
+    chat_id: str,
+    limit: int = 50,
+    cursor: Optional[str] = None
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    return await _run(db.get_messages_page, chat_id, limit=limit, cursor=cursor)
+
+
+async def search_messages(user_id: str, query: str, limit: int = 20) -> List[Dict[str, Any]]:
+    return await _run(db.search_messages, user_id, query, limit=limit)
+
+
+# ============================================
+# Usage Operations
+# ============================================
+
+USAGE_TOTALS = db.USAGE_TOTALS
+
+
+async def get_usage(
+    user_id: str,
+    group_by: str,
+    since: Optional[str] = None,
+    until: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    return await _run(db.get_usage, user_id, group_by, since=since, until=until)
+
+
+# ============================================
+# Memory Operations
+# ============================================
+
+async def add_memory(user_id: str, content: str) -> Dict[str, Any]:
+    return await _run(db.add_memory, user_id, content)
+
+
+async def get_memories(user_id: str, enabled_only: bool = True) -> List[Dict[str, Any]]:
+    return await _run(db.get_memories, user_id, enabled_only)
+
+
+async def update_memory(
+    user_id: str,
+    memory_id: str,
+    content: Optional[str] = None,
+    enabled: Optional[bool] = None
+) -> Dict[str, Any]:
+    return await _run(db.update_memory, user_id, memory_id, content=content, enabled=enabled)
+
+
+async def get_memory(user_id: str, memory_id: str) -> Optional[Dict[str, Any]]:
+    return await _run(db.get_memory, user_id, memory_id)
+
+
+async def delete_memory(user_id: str, memory_id: str) -> bool:
+    return await _run(db.delete_memory, user_id, memory_id)
+
+
+# ============================================
+# Model Config Operations
+# ============================================
+
+async def get_model_configs() -> List[Dict[str, Any]]:
+    return await _run(db.get_model_configs)
+
+
+async def get_model_config(config_id: str) -> Optional[Dict[str, Any]]:
+    return await _run(db.get_model_config, config_id)
+
+
+async def get_default_model_config() -> Optional[Dict[str, Any]]:
+    return await _run(db.get_default_model_config)
+
+
+async def set_default_model_config(config_id: Optional[str]) -> None:
+    return await _run(db.set_default_model_config, config_id)
+
+
+async def upsert_model_config(
+    config_id: str,
+    name: str,
+    model_id: str,
+    max_tokens: int = 4096,
+    temperature: float = 0.7,
+    is_default: bool = False,
+    context_window: Optional[int] = None,
+    fallback_config_ids: Optional[List[str]] = None,
+    ttft_deadline_ms: Optional[int] = None,
+    hedge: bool = False
+) -> Dict[str, Any]:
+    return await _run(
+        db.upsert_model_config,
+        config_id=config_id,
+        name=name,
+        model_id=model_id,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        is_default=is_default,
+        context_window=context_window,
+        fallback_config_ids=fallback_config_ids,
+        ttft_deadline_ms=ttft_deadline_ms,
+        hedge=hedge
+    )
+
+
+async def delete_model_config(config_id: str) -> bool:
+    return await _run(db.delete_model_config, config_id)
+
+
+async def init_default_models() -> None:
+    return await _run(db.init_default_models)
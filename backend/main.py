@@ -2,23 +2,46 @@
 FastAPI backend for Personal ChatGPT Clone.
 Deployed on AWS Lambda with Mangum adapter.
 """
+import asyncio
 import os
+from contextlib import asynccontextmanager
 from typing import Optional, List
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
+from fastapi import BackgroundTasks, FastAPI, Header, HTTPException, Query
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
 from mangum import Mangum
 
-import database as db
+import database_async as db
 import bedrock_client as bedrock
+import context_window
+import memory_index
+import sse
+import stream_buffer
+import summarizer
+import tracing
+import write_behind
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Don't lose running generations or queued writes when the server stops.
+    # Only runs under uvicorn; on Lambda each request waits for its own writes.
+    await stream_buffer.flush()
+    await write_behind.flush()
+
 
 # Initialize FastAPI app
 app = FastAPI(
     title="Personal ChatGPT API",
     description="Personal ChatGPT clone using AWS Bedrock",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# Request spans, Server-Timing headers and metrics (see tracing.py)
+if tracing.ENABLED:
+    app.add_middleware(tracing.TracingMiddleware)
+
 # NOTE: CORS is handled by Lambda Function URL, not FastAPI
 # This avoids duplicate Access-Control-Allow-Origin headers
 
@@ -38,6 +61,11 @@ class ChatUpdate(BaseModel):
     title: str
 
 
+class ChatBulkDelete(BaseModel):
+    chat_ids: List[str] = Field(..., min_length=1, max_length=100)
+    background: bool = False
+
+
 class MessageCreate(BaseModel):
     content: str
     chat_id: Optional[str] = None
@@ -60,6 +88,10 @@ class ModelConfigCreate(BaseModel):
     max_tokens: int = 4096
     temperature: float = 0.7
     is_default: bool = False
+    context_window: Optional[int] = None
+    fallback_config_ids: List[str] = []
+    ttft_deadline_ms: Optional[int] = Field(None, gt=0)
+    hedge: bool = False
 
 
 # ============================================
@@ -83,56 +115,200 @@ async def api_health():
 # ============================================
 
 @app.get("/api/chats")
-async def list_chats():
-    """Get all chats for the user."""
-    chats = db.get_chats(DEFAULT_USER_ID)
-    return {"chats": chats}
+async def list_chats(
+    limit: Optional[int] = Query(None, ge=1, le=200),
+    cursor: Optional[str] = None
+):
+    """
+    Get the user's chats, most recently active first.
+    
+    Without `limit` all chats are returned. With `limit`, the first page is
+    returned along with `next_cursor`; pass it back as `cursor` to load the
+    next page.
+    """
+    if limit is None:
+        chats = await db.get_chats(DEFAULT_USER_ID)
+        return {"chats": chats}
+    
+    try:
+        chats, next_cursor = await db.get_chats_page(DEFAULT_USER_ID, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return {"chats": chats, "next_cursor": next_cursor}
 
 
 @app.post("/api/chats")
 async def create_chat(chat: ChatCreate):
     """Create a new chat."""
-    new_chat = db.create_chat(DEFAULT_USER_ID, chat.title)
+    new_chat = await db.create_chat(DEFAULT_USER_ID, chat.title)
     return new_chat
 
 
 @app.get("/api/chats/{chat_id}")
-async def get_chat(chat_id: str):
-    """Get a specific chat with its messages."""
-    chat = db.get_chat(DEFAULT_USER_ID, chat_id)
+async def get_chat(
+    chat_id: str,
+    limit: Optional[int] = Query(None, ge=1, le=200),
+    cursor: Optional[str] = None
+):
+    """
+    Get a specific chat with its messages.
+    
+    Without `limit` the full history is returned. With `limit`, the newest
+    page is returned along with `next_cursor`; pass it back as `cursor` to
+    load the next older page.
+    """
+    if limit is None:
+        chat, messages = await asyncio.gather(
+            db.get_chat(DEFAULT_USER_ID, chat_id),
+            db.get_messages(chat_id)
+        )
+        if not chat:
+            raise HTTPException(status_code=404, detail="Chat not found")
+        
+        return {**chat, "messages": messages}
+    
+    try:
+        chat, (messages, next_cursor) = await asyncio.gather(
+            db.get_chat(DEFAULT_USER_ID, chat_id),
+            db.get_messages_page(chat_id, limit=limit, cursor=cursor)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
     
-    messages = db.get_messages(chat_id)
-    return {**chat, "messages": messages}
+    return {**chat, "messages": messages, "next_cursor": next_cursor}
 
 
 @app.patch("/api/chats/{chat_id}")
 async def update_chat(chat_id: str, update: ChatUpdate):
     """Update a chat's title."""
-    chat = db.get_chat(DEFAULT_USER_ID, chat_id)
+    chat = await db.get_chat(DEFAULT_USER_ID, chat_id)
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
     
-    updated = db.update_chat_title(DEFAULT_USER_ID, chat_id, update.title)
+    updated = await db.update_chat_title(DEFAULT_USER_ID, chat_id, update.title)
     return updated
 
 
 @app.delete("/api/chats/{chat_id}")
-async def delete_chat(chat_id: str):
-    """Delete a chat and all its messages."""
-    chat = db.get_chat(DEFAULT_USER_ID, chat_id)
+async def delete_chat(chat_id: str, background_tasks: BackgroundTasks, background: bool = False):
+    """
+    Delete a chat and all its messages.
+    
+    With `background=true` the chat is hidden immediately and its messages
+    are deleted after the response is sent.
+    """
+    chat = await db.get_chat(DEFAULT_USER_ID, chat_id)
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
     
-    db.delete_chat(DEFAULT_USER_ID, chat_id)
+    if background:
+        await db.mark_chat_deleted(DEFAULT_USER_ID, chat_id)
+        background_tasks.add_task(_purge_chats, [chat_id])
+        return {"success": True, "pending": True}
+    
+    await db.delete_chat(DEFAULT_USER_ID, chat_id)
     return {"success": True}
 
 
+async def _purge_chats(chat_ids: List[str]) -> None:
+    """Delete chats marked for deletion, after the response is sent."""
+    # Retried like other write-behind work, and awaited so the purge
+    # finishes within the request's Lambda invocation
+    task = write_behind.submit(db.delete_chats, DEFAULT_USER_ID, chat_ids)
+    await asyncio.wait([task])
+
+
+@app.post("/api/chats/bulk-delete")
+async def bulk_delete_chats(request: ChatBulkDelete, background_tasks: BackgroundTasks):
+    """Delete several chats and their messages in one call."""
+    chat_ids = list(dict.fromkeys(request.chat_ids))
+    chats = await asyncio.gather(*(db.get_chat(DEFAULT_USER_ID, cid) for cid in chat_ids))
+    
+    found = [cid for cid, chat in zip(chat_ids, chats) if chat]
+    not_found = [cid for cid, chat in zip(chat_ids, chats) if not chat]
+    
+    if found and request.background:
+        await asyncio.gather(*(db.mark_chat_deleted(DEFAULT_USER_ID, cid) for cid in found))
+        background_tasks.add_task(_purge_chats, found)
+    elif found:
+        await db.delete_chats(DEFAULT_USER_ID, found)
+    
+    return {"deleted": found, "not_found": not_found, "pending": bool(found and request.background)}
+
+
+@app.get("/api/search")
+async def search_messages(
+    q: str = Query(..., min_length=1, max_length=500),
+    limit: int = Query(20, ge=1, le=50)
+):
+    """
+    Search all chats' messages for the words in `q`, best matches first.
+    
+    Each result has the chat and message IDs, the chat title and a snippet
+    with the matched words wrapped in <mark> tags.
+    """
+    results = await db.search_messages(DEFAULT_USER_ID, q, limit=limit)
+    return {"query": q, "results": results}
+
+
 # ============================================
 # Message/Chat Completion Endpoints
 # ============================================
 
+async def _resolve_model_config(selected_model_id: Optional[str]) -> Optional[dict]:
+    """Get the selected model config, falling back to the default."""
+    model_config = None
+    if selected_model_id:
+        model_config = await db.get_model_config(selected_model_id)
+    if not model_config:
+        model_config = await db.get_default_model_config()
+    if not model_config:
+        # Initialize default models if none exist
+        await db.init_default_models()
+        model_config = await db.get_default_model_config()
+    return model_config
+
+
+async def _resolve_fallback_chain(model_config: dict) -> list:
+    """Get a model config followed by its fallbacks, in failover order."""
+    chain = [model_config]
+    seen = {model_config['config_id']}
+    index = 0
+    while index < len(chain):
+        for config_id in chain[index].get('fallback_config_ids') or []:
+            if config_id in seen:
+                continue
+            seen.add(config_id)
+            fallback = await db.get_model_config(config_id)
+            if fallback:
+                chain.append(fallback)
+        index += 1
+    return chain
+
+
+async def _load_chat_history(chat_id: str) -> tuple[Optional[dict], list]:
+    """Get a chat and the messages not yet folded into its summary."""
+    chat = await db.get_chat(DEFAULT_USER_ID, chat_id)
+    if not chat:
+        return None, []
+    
+    # Loaded lazily: only the turns that fit the context are decoded
+    history = await db.get_messages(chat_id, after_message_id=chat.get('summary_through'), lazy=True)
+    return chat, history
+
+
+async def _get_relevant_memories(query: str) -> list:
+    """Get the user's memories most relevant to a message."""
+    index = memory_index.get_cached_index(DEFAULT_USER_ID)
+    if index is None:
+        memories = await db.get_memories(DEFAULT_USER_ID, enabled_only=True)
+        index = memory_index.load_index(DEFAULT_USER_ID, memories)
+    return index.search(query)
+
+
 @app.post("/api/chat/completions")
 async def chat_completion(message: MessageCreate):
     """
@@ -140,74 +316,205 @@ async def chat_completion(message: MessageCreate):
     Creates a new chat if chat_id is not provided.
     """
     chat_id = message.chat_id
-    is_new_chat = False
+    is_new_chat = not chat_id
     
-    # Create a new chat if needed
-    if not chat_id:
-        new_chat = db.create_chat(DEFAULT_USER_ID)
-        chat_id = new_chat['chat_id']
-        is_new_chat = True
+    # Independent reads run concurrently: the chat check (or creation)
+    # with its unsummarized history, model config and memories
+    if is_new_chat:
+        chat, model_config, memories = await asyncio.gather(
+            db.create_chat(DEFAULT_USER_ID),
+            _resolve_model_config(message.selected_model_id),
+            _get_relevant_memories(message.content)
+        )
+        chat_id = chat['chat_id']
+        history = []
     else:
-        # Verify chat exists
-        chat = db.get_chat(DEFAULT_USER_ID, chat_id)
+        (chat, history), model_config, memories = await asyncio.gather(
+            _load_chat_history(chat_id),
+            _resolve_model_config(message.selected_model_id),
+            _get_relevant_memories(message.content)
+        )
         if not chat:
             raise HTTPException(status_code=404, detail="Chat not found")
     
-    # Save user message
-    db.add_message(chat_id, 'user', message.content)
-    
-    # Get model config
-    model_config = None
-    if message.selected_model_id:
-        model_config = db.get_model_config(message.selected_model_id)
-    if not model_config:
-        model_config = db.get_default_model_config()
-    if not model_config:
-        # Initialize default models if none exist
-        db.init_default_models()
-        model_config = db.get_default_model_config()
+    summary = chat.get('summary')
     
     if not model_config:
         raise HTTPException(status_code=500, detail="No model configuration available")
     
-    # Get conversation history
-    all_messages = db.get_messages(chat_id)
-    conversation = [{'role': msg['role'], 'content': msg['content']} for msg in all_messages]
+    model_chain = await _resolve_fallback_chain(model_config)
+    
+    # The user message is written together with the reply once it finishes
+    user_message = db.build_message_item(chat_id, 'user', message.content)
+    
+    # Fit the history to the context budget of every model in the fallback
+    # chain, newest turns first
+    system = bedrock.build_system_prompt(memories, summary=summary)
+    kept, dropped_turns = context_window.fit_conversation(
+        history + [user_message],
+        context_window.get_chain_budget(model_chain, system)
+    )
+    if any('content' not in msg for msg in kept):
+        kept = await db.load_content(kept)
+    conversation = [{'role': msg['role'], 'content': msg['content']} for msg in kept]
     
-    # Get memories
-    memories = db.get_memories(DEFAULT_USER_ID, enabled_only=True)
+    generation = stream_buffer.Generation()
+    # The exchange's write, once the reply is complete
+    save_tasks = []
+    
+    async def cancel_requested():
+        current = await db.get_chat(DEFAULT_USER_ID, chat_id)
+        return bool(current) and current.get('cancel_generation_id') == generation.generation_id
     
     async def generate():
         full_response = []
         
-        # First, yield the chat_id so frontend knows which chat to use
-        yield f"data: {{'chat_id': '{chat_id}', 'is_new': {str(is_new_chat).lower()}}}\n\n"
+        # The title only depends on the first message, so generate it
+        # alongside the reply instead of after it
+        title = None
+        title_task = None
+        if is_new_chat:
+            title_task = asyncio.create_task(
+                bedrock.generate_chat_title_async(message.content, model_config['model_id'])
+            )
+        
+        # First, tell the frontend which chat to use and how to resume
+        await generation.emit(sse.META, {
+            'chat_id': chat_id,
+            'is_new': is_new_chat,
+            'generation_id': generation.generation_id,
+            'model': model_config['config_id'],
+            'dropped_turns': dropped_turns
+        })
         
-        # Stream the response
-        for chunk in bedrock.invoke_model_stream(
-            messages=conversation,
-            model_id=model_config['model_id'],
-            max_tokens=model_config.get('max_tokens', 4096),
-            temperature=float(model_config.get('temperature', 0.7)),
-            memories=memories
-        ):
-            full_response.append(chunk)
-            yield f"data: {{'content': {repr(chunk)}}}\n\n"
+        # Stream the response from the first model in the chain to answer,
+        # coalescing small deltas into fewer frames
+        stream = bedrock.FallbackStream(model_chain, conversation, memories, summary)
+        # A cancel that reaches another instance is passed on through the chat
+        cancel_watch = asyncio.create_task(generation.cancel_when(cancel_requested))
+        try:
+            async for text in generation.until_cancelled(sse.coalesce(stream)):
+                full_response.append(text)
+                await generation.emit(sse.CONTENT, {'text': text})
+                
+                if title_task and title is None and title_task.done():
+                    title = title_task.result()
+                    await generation.emit(sse.TITLE, {'title': title})
+        finally:
+            cancel_watch.cancel()
         
-        # Save the complete response
+        # A cancelled generation keeps the partial answer, marked as truncated
+        truncated = generation.cancelled
         complete_response = ''.join(full_response)
-        db.add_message(chat_id, 'assistant', complete_response)
+        served_by = stream.served_by or model_config
+        usage = stream.finish(complete_response)
+        assistant_message = db.build_message_item(
+            chat_id, 'assistant', complete_response,
+            truncated=truncated, model_config=served_by, usage=usage
+        )
         
-        # Generate title for new chats
-        if is_new_chat:
-            title = bedrock.generate_chat_title(message.content, model_config['model_id'])
-            db.update_chat_title(DEFAULT_USER_ID, chat_id, title)
-            yield f"data: {{'title': {repr(title)}}}\n\n"
+        if title_task and title is None:
+            title = await title_task
+            await generation.emit(sse.TITLE, {'title': title})
+        
+        # Persist both messages and the chat's updated_at/title in one
+        # transaction, off the response path. An empty assistant turn
+        # would be rejected by the model later, so an exchange cancelled
+        # before any output isn't saved.
+        save_task = None
+        if complete_response:
+            save_task = write_behind.submit(
+                db.save_exchange,
+                DEFAULT_USER_ID,
+                chat_id,
+                [user_message, assistant_message],
+                title=title
+            )
+        elif title:
+            save_task = write_behind.submit(db.update_chat_title, DEFAULT_USER_ID, chat_id, title)
+        if save_task is not None:
+            save_tasks.append(save_task)
         
-        yield "data: [DONE]\n\n"
+        # Token counts, including prompt cache reads and writes, and latencies
+        await generation.emit(sse.USAGE, assistant_message.get('usage', {}))
+        await generation.emit(sse.DONE, {'truncated': truncated, 'model': served_by['config_id']})
+        await generation.close()
+        
+        if save_task is None:
+            return
+        
+        # Fold older turns into the chat summary once the unsummarized history
+        # gets long. The summary is another model call, so it runs as its own
+        # write-behind task that the response doesn't wait for. On Lambda it
+        # may finish in a later invocation; if it's lost, the next reply
+        # triggers it again.
+        unsummarized = history + [user_message, assistant_message]
+        if summarizer.needs_compaction(unsummarized):
+            await asyncio.wait({save_task})
+            write_behind.submit(
+                summarizer.compact_chat,
+                DEFAULT_USER_ID,
+                chat_id,
+                summary,
+                chat.get('summary_through'),
+                unsummarized
+            )
+    
+    # The generation runs independently of this connection, so a client
+    # that drops can resume from the stream buffer
+    stream_buffer.start(generation, generate())
     
+    async def relay():
+        async for frame in stream_buffer.follow(generation.generation_id):
+            yield frame
+        # The client is done; keep the request open until the reply is
+        # saved, so the write lands before the invocation ends, but not for
+        # the rest of the generation's work
+        if save_tasks:
+            await asyncio.wait(save_tasks)
+    
+    return _event_stream(relay())
+
+
+@app.post("/api/generations/{generation_id}/cancel")
+async def cancel_generation(generation_id: str, chat_id: Optional[str] = Query(None)):
+    """
+    Stop a running generation. The partial answer is saved as truncated.
+    
+    If the generation runs on another instance, pass its chat_id: the
+    request is recorded on the chat and that instance stops the generation
+    when it next checks (see GENERATION_CANCEL_POLL_INTERVAL).
+    """
+    if stream_buffer.cancel(generation_id):
+        return {"success": True}
+    if chat_id and await db.request_cancel(DEFAULT_USER_ID, chat_id, generation_id):
+        return {"success": True, "pending": True}
+    raise HTTPException(status_code=404, detail="Generation not found or already finished")
+
+
+@app.get("/api/generations/{generation_id}/stream")
+async def resume_generation(
+    generation_id: str,
+    last_event_id: Optional[str] = Header(None)
+):
+    """
+    Resume a completion stream after a dropped connection.
+    Replays the events after Last-Event-ID, then follows the live stream.
+    """
+    try:
+        after_id = int(last_event_id or 0)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Last-Event-ID")
+    
+    if not await stream_buffer.exists(generation_id):
+        raise HTTPException(status_code=404, detail="Generation not found or expired")
+    
+    return _event_stream(stream_buffer.follow(generation_id, after_id))
+
+
+def _event_stream(frames) -> StreamingResponse:
     return StreamingResponse(
-        generate(),
+        frames,
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -217,48 +524,84 @@ async def chat_completion(message: MessageCreate):
     )
 
 
+# ============================================
+# Usage Endpoints
+# ============================================
+
+@app.get("/api/usage")
+async def get_usage(
+    group_by: str = Query("model", pattern="^(model|chat|day)$"),
+    since: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}-\d{2}$"),
+    until: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}-\d{2}$")
+):
+    """
+    Get token usage and latency totals grouped by model, chat or day.
+    since/until (YYYY-MM-DD) limit the days included when grouping by day.
+    """
+    groups = await db.get_usage(DEFAULT_USER_ID, group_by, since=since, until=until)
+    
+    total = {'messages': sum(g['messages'] for g in groups)}
+    for field in db.USAGE_TOTALS:
+        if not field.endswith('_ms_total'):
+            total[field] = sum(g[field] for g in groups)
+    
+    return {"group_by": group_by, "usage": groups, "total": total}
+
+
+if tracing.METRICS_ENABLED:
+    @app.get("/api/metrics", response_class=PlainTextResponse)
+    async def get_metrics():
+        """Get request, DynamoDB and Bedrock metrics in Prometheus text format."""
+        return PlainTextResponse(tracing.render_metrics(), media_type="text/plain; version=0.0.4")
+
+
 # ============================================
 # Memory Endpoints
 # ============================================
 
+def _public_memory(memory: dict) -> dict:
+    """Strip index data from a memory item before returning it."""
+    return {k: v for k, v in memory.items() if k != 'terms'}
+
+
 @app.get("/api/memories")
 async def list_memories():
     """Get all memories for the user."""
-    memories = db.get_memories(DEFAULT_USER_ID, enabled_only=False)
-    return {"memories": memories}
+    memories = await db.get_memories(DEFAULT_USER_ID, enabled_only=False)
+    return {"memories": [_public_memory(m) for m in memories]}
 
 
 @app.post("/api/memories")
 async def create_memory(memory: MemoryCreate):
     """Create a new memory."""
-    new_memory = db.add_memory(DEFAULT_USER_ID, memory.content)
-    return new_memory
+    new_memory = await db.add_memory(DEFAULT_USER_ID, memory.content)
+    return _public_memory(new_memory)
 
 
 @app.patch("/api/memories/{memory_id}")
 async def update_memory(memory_id: str, update: MemoryUpdate):
     """Update a memory."""
-    memory = db.get_memory(DEFAULT_USER_ID, memory_id)
+    memory = await db.get_memory(DEFAULT_USER_ID, memory_id)
     if not memory:
         raise HTTPException(status_code=404, detail="Memory not found")
     
-    updated = db.update_memory(
+    updated = await db.update_memory(
         DEFAULT_USER_ID, 
         memory_id, 
         content=update.content, 
         enabled=update.enabled
     )
-    return updated
+    return _public_memory(updated)
 
 
 @app.delete("/api/memories/{memory_id}")
 async def delete_memory(memory_id: str):
     """Delete a memory."""
-    memory = db.get_memory(DEFAULT_USER_ID, memory_id)
+    memory = await db.get_memory(DEFAULT_USER_ID, memory_id)
     if not memory:
         raise HTTPException(status_code=404, detail="Memory not found")
     
-    db.delete_memory(DEFAULT_USER_ID, memory_id)
+    await db.delete_memory(DEFAULT_USER_ID, memory_id)
     return {"success": True}
 
 
@@ -270,29 +613,36 @@ async def delete_memory(memory_id: str):
 async def list_models():
     """Get all model configurations."""
     # Ensure default models exist
-    db.init_default_models()
-    configs = db.get_model_configs()
+    await db.init_default_models()
+    configs = await db.get_model_configs()
     return {"models": configs}
 
 
 @app.post("/api/models")
 async def create_model(config: ModelConfigCreate):
     """Create or update a model configuration."""
-    new_config = db.upsert_model_config(
-        config_id=config.config_id,
-        name=config.name,
-        model_id=config.model_id,
-        max_tokens=config.max_tokens,
-        temperature=config.temperature,
-        is_default=config.is_default
-    )
+    try:
+        new_config = await db.upsert_model_config(
+            config_id=config.config_id,
+            name=config.name,
+            model_id=config.model_id,
+            max_tokens=config.max_tokens,
+            temperature=config.temperature,
+            is_default=config.is_default,
+            context_window=config.context_window,
+            fallback_config_ids=config.fallback_config_ids,
+            ttft_deadline_ms=config.ttft_deadline_ms,
+            hedge=config.hedge
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return new_config
 
 
 @app.get("/api/models/{config_id}")
 async def get_model(config_id: str):
     """Get a specific model configuration."""
-    config = db.get_model_config(config_id)
+    config = await db.get_model_config(config_id)
     if not config:
         raise HTTPException(status_code=404, detail="Model config not found")
     return config
@@ -301,30 +651,23 @@ async def get_model(config_id: str):
 @app.delete("/api/models/{config_id}")
 async def delete_model(config_id: str):
     """Delete a model configuration."""
-    config = db.get_model_config(config_id)
+    config = await db.get_model_config(config_id)
     if not config:
         raise HTTPException(status_code=404, detail="Model config not found")
     
-    db.delete_model_config(config_id)
+    await db.delete_model_config(config_id)
     return {"success": True}
 
 
 @app.post("/api/models/{config_id}/set-default")
 async def set_default_model(config_id: str):
     """Set a model as the default."""
-    config = db.get_model_config(config_id)
+    config = await db.get_model_config(config_id)
     if not config:
         raise HTTPException(status_code=404, detail="Model config not found")
     
-    updated = db.upsert_model_config(
-        config_id=config['config_id'],
-        name=config['name'],
-        model_id=config['model_id'],
-        max_tokens=config.get('max_tokens', 4096),
-        temperature=config.get('temperature', 0.7),
-        is_default=True
-    )
-    return updated
+    await db.set_default_model_config(config_id)
+    return {**config, "is_default": True}
 
 
 # Lambda handler
@@ -0,0 +1,193 @@
+"""
+Relevance ranking for user memories.
+
+Memories are scored against the current message with BM25, and only the
+best matches are sent to the model. Each memory item stores its term
+frequencies (`terms`) when written, so a user's index is assembled from
+stored statistics without re-tokenizing, and is then kept up to date
+incrementally as memories are added, updated or deleted.
+"""
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Any, Optional
+
+from context_window import estimate_tokens
+
+# Maximum number of memories included per request
+MEMORY_TOP_K = int(os.environ.get('MEMORY_TOP_K', '8'))
+
+# Maximum tokens of memory text included per request
+MEMORY_TOKEN_CAP = int(os.environ.get('MEMORY_TOKEN_CAP', '800'))
+
+# Seconds before a cached index is reloaded, to pick up writes made by
+# other instances
+MEMORY_INDEX_TTL = float(os.environ.get('MEMORY_INDEX_TTL', '300'))
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset("""
+a an and are as at be but by can do for from has have how i if in is it its
+me my of on or so that the their them this to was we what when which who why
+will with you your
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase terms, dropping stopwords."""
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+
+def term_counts(text: str) -> Dict[str, int]:
+    """Get the term frequencies stored alongside a memory item."""
+    return dict(Counter(tokenize(text)))
+
+
+class MemoryIndex:
+    """In-process BM25 index over one user's enabled memories."""
+
+    def __init__(self, memories: Optional[List[Dict[str, Any]]] = None):
+        self._docs: Dict[str, tuple] = {}
+        self._doc_freq: Counter = Counter()
+        self._total_length = 0
+        self._lock = threading.Lock()
+        self.loaded_at = time.monotonic()
+
+        for memory in memories or []:
+            self.upsert(memory)
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def upsert(self, memory: Dict[str, Any]) -> None:
+        """Add or replace a memory. Disabled memories are removed."""
+        with self._lock:
+            self._remove(memory['memory_id'])
+            if not memory.get('enabled', True):
+                return
+
+            terms = memory.get('terms')
+            if terms is None:
+                terms = term_counts(memory['content'])
+            terms = {term: int(count) for term, count in terms.items()}
+            length = sum(terms.values())
+
+            self._docs[memory['memory_id']] = (memory, terms, length)
+            self._doc_freq.update(terms.keys())
+            self._total_length += length
+
+    def remove(self, memory_id: str) -> None:
+        """Remove a memory from the index."""
+        with self._lock:
+            self._remove(memory_id)
+
+    def _remove(self, memory_id: str) -> None:
+        entry = self._docs.pop(memory_id, None)
+        if entry is None:
+            return
+
+        _, terms, length = entry
+        for term in terms:
+            self._doc_freq[term] -= 1
+            if self._doc_freq[term] <= 0:
+                del self._doc_freq[term]
+        self._total_length -= length
+
+    def search(
+        self,
+        query: str,
+        k: int = MEMORY_TOP_K,
+        token_cap: int = MEMORY_TOKEN_CAP
+    ) -> List[Dict[str, Any]]:
+        """
+        Get the memories most relevant to a query.
+
+        Memories are ranked by BM25 score, then by recency, and taken until k
+        memories or token_cap tokens are reached. Memories with no matching
+        terms fill any remaining room, so general preferences still apply.
+        The result is returned in creation order.
+        """
+        with self._lock:
+            entries = list(self._docs.values())
+            doc_freq = dict(self._doc_freq)
+            total_length = self._total_length
+
+        if not entries:
+            return []
+
+        query_terms = set(tokenize(query))
+        doc_count = len(entries)
+        avg_length = total_length / doc_count or 1
+
+        def score(entry) -> float:
+            _, terms, length = entry
+            total = 0.0
+            for term in query_terms:
+                freq = terms.get(term)
+                if not freq:
+                    continue
+                df = doc_freq.get(term, 0)
+                idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+                total += idf * freq * (BM25_K1 + 1) / (freq + norm)
+            return total
+
+        ranked = sorted(
+            entries,
+            key=lambda e: (score(e), e[0].get('created_at', '')),
+            reverse=True
+        )
+
+        selected = []
+        used = 0
+        for memory, _, _ in ranked:
+            if len(selected) >= k:
+                break
+            cost = estimate_tokens(memory['content'])
+            if used + cost > token_cap:
+                continue
+            selected.append(memory)
+            used += cost
+
+        selected.sort(key=lambda m: m.get('created_at', ''))
+        return selected
+
+
+# Per-user indexes cached for the life of the process
+_indexes: Dict[str, MemoryIndex] = {}
+
+
+def get_cached_index(user_id: str) -> Optional[MemoryIndex]:
+    """Get a user's index if it is loaded and fresh."""
+    index = _indexes.get(user_id)
+    if index is None or time.monotonic() - index.loaded_at > MEMORY_INDEX_TTL:
+        return None
+    return index
+
+
+def load_index(user_id: str, memories: List[Dict[str, Any]]) -> MemoryIndex:
+    """Build and cache a user's index from their stored memories."""
+    index = MemoryIndex(memories)
+    _indexes[user_id] = index
+    return index
+
+
+def on_memory_saved(user_id: str, memory: Dict[str, Any]) -> None:
+    """Apply an added or updated memory to the user's cached index."""
+    index = _indexes.get(user_id)
+    if index is not None:
+        index.upsert(memory)
+
+
+def on_memory_deleted(user_id: str, memory_id: str) -> None:
+    """Remove a deleted memory from the user's cached index."""
+    index = _indexes.get(user_id)
+    if index is not None:
+        index.remove(memory_id)
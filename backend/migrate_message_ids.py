@@ -0,0 +1,145 @@
+"""
+One-off migration: re-key legacy messages to time-ordered UUIDv7 IDs.
+
+Messages written before UUIDv7 IDs used uuid4 as the range key, so
+DynamoDB returns them in random order. This script scans the messages
+table and migrates every legacy row in three passes, so no message is
+lost if it stops part way:
+
+1. Write a copy of each legacy row keyed by a UUIDv7 derived from its
+   created_at, recording the old key in migrated_from. Each copy is a
+   conditional PutItem, so it is confirmed before anything is deleted.
+2. Point chats' summary_through at the copy of the message it named.
+3. Delete the legacy rows.
+
+Re-running reuses existing copies instead of writing new ones, so the
+script is safe to run again after a failure.
+
+Usage:
+    CHATS_TABLE=<table> MESSAGES_TABLE=<table> python migrate_message_ids.py [--dry-run]
+"""
+import argparse
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Tuple
+
+import database as db
+import storage_dynamodb
+
+
+def find_legacy_messages() -> Tuple[Dict[str, List[Dict[str, Any]]], Dict[str, str]]:
+    """
+    Scan the messages table for legacy rows.
+
+    Returns:
+        Legacy rows grouped by chat, and the new ID of every legacy row
+        already copied by an earlier run
+    """
+    legacy = defaultdict(list)
+    copies = {}
+    for item in storage_dynamodb._scan_all(storage_dynamodb.get_messages_table()):
+        if not db.is_time_ordered_id(item['message_id']):
+            legacy[item['chat_id']].append(item)
+        elif 'migrated_from' in item:
+            copies[item['migrated_from']] = item['message_id']
+    return legacy, copies
+
+
+def copy_chat(messages: List[Dict[str, Any]], copies: Dict[str, str], dry_run: bool = False) -> Dict[str, str]:
+    """
+    Write UUIDv7-keyed copies of one chat's legacy messages, preserving their order.
+
+    Returns:
+        The new ID of each legacy message, by old ID
+    """
+    table = storage_dynamodb.get_messages_table()
+    client = table.meta.client
+    messages.sort(key=lambda x: x.get('created_at', ''))
+
+    new_ids = {}
+    last_created = None
+    for msg in messages:
+        created_at = msg.get('created_at') or datetime.utcnow().isoformat()
+        # Keep the millisecond prefix strictly increasing so messages
+        # created in the same millisecond keep their relative order
+        moment = datetime.fromisoformat(created_at)
+        if last_created and moment <= last_created:
+            moment = last_created + timedelta(milliseconds=1)
+        last_created = moment
+
+        if msg['message_id'] in copies:
+            new_ids[msg['message_id']] = copies[msg['message_id']]
+            continue
+
+        new_id = db.message_id_from_timestamp(moment.isoformat())
+        new_ids[msg['message_id']] = new_id
+        if dry_run:
+            print(f"  {msg['message_id']} -> {new_id}")
+            continue
+
+        try:
+            table.put_item(
+                Item={**msg, 'message_id': new_id, 'migrated_from': msg['message_id']},
+                ConditionExpression='attribute_not_exists(message_id)'
+            )
+        except client.exceptions.ConditionalCheckFailedException:
+            raise RuntimeError(f"Message {new_id} already exists; re-run the migration")
+
+    return new_ids
+
+
+def remap_summaries(new_ids: Dict[str, str], dry_run: bool = False) -> int:
+    """Point summary_through at the new ID of re-keyed messages. Returns the number of chats updated."""
+    table = storage_dynamodb.get_chats_table()
+    client = table.meta.client
+    updated = 0
+
+    for chat in storage_dynamodb._scan_all(table):
+        old_id = chat.get('summary_through')
+        if old_id not in new_ids:
+            continue
+        print(f"Chat {chat['chat_id']}: summary_through {old_id} -> {new_ids[old_id]}")
+        updated += 1
+        if dry_run:
+            continue
+        try:
+            table.update_item(
+                Key={'user_id': chat['user_id'], 'chat_id': chat['chat_id']},
+                UpdateExpression='SET summary_through = :new',
+                ConditionExpression='summary_through = :old',
+                ExpressionAttributeValues={':new': new_ids[old_id], ':old': old_id}
+            )
+        except client.exceptions.ConditionalCheckFailedException:
+            # Summarized again meanwhile, through a UUIDv7 message
+            pass
+
+    return updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dry-run', action='store_true', help='Print the new IDs without writing')
+    args = parser.parse_args()
+
+    legacy, copies = find_legacy_messages()
+    new_ids = {}
+    for chat_id, messages in legacy.items():
+        print(f"Chat {chat_id}: {len(messages)} legacy messages")
+        new_ids.update(copy_chat(messages, copies, dry_run=args.dry_run))
+
+    remapped = remap_summaries(new_ids, dry_run=args.dry_run)
+
+    # Only delete once every copy has been written
+    if not args.dry_run:
+        storage_dynamodb._batch_delete(storage_dynamodb.get_messages_table(), [
+            {'chat_id': msg['chat_id'], 'message_id': msg['message_id']}
+            for messages in legacy.values()
+            for msg in messages
+        ])
+
+    action = 'Would migrate' if args.dry_run else 'Migrated'
+    print(f"{action} {len(new_ids)} messages across {len(legacy)} chats, {remapped} summaries")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,559 @@
+"""
+Full-text search over chat history.
+
+Messages are indexed in a SQLite FTS5 table at SEARCH_INDEX_PATH, so a
+search is one ranked index lookup and never reads the messages table. The
+index is kept up to date incrementally:
+
+- database.py applies each saved exchange, renamed chat and deleted chat
+  as it is written
+- before a search, at most once every SEARCH_SYNC_INTERVAL seconds, the
+  user's chat list is read newest first, back to the newest updated_at
+  the last sync saw, and only the messages of chats that changed elsewhere
+  (e.g. on another Lambda instance) are read and indexed
+- the whole chat list is compared at most once every
+  SEARCH_FULL_SYNC_INTERVAL seconds, to drop chats deleted elsewhere
+
+With a blob store configured (see blob_store.py), the index file is
+uploaded there after it changes, at most once every
+SEARCH_SNAPSHOT_INTERVAL seconds, and a new instance starts from that
+snapshot instead of an empty index. Without one, the first search on an
+empty index builds it from storage.
+"""
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, List, Any, Iterator, Optional
+
+from blob_store import get_blob_store
+from storage import get_storage, unpack_message
+
+logger = logging.getLogger(__name__)
+
+SEARCH_INDEX_PATH = os.environ.get('SEARCH_INDEX_PATH', 'search.db')
+
+# Seconds between checks of the chat list for changes made elsewhere
+SEARCH_SYNC_INTERVAL = float(os.environ.get('SEARCH_SYNC_INTERVAL', '30'))
+
+# Seconds between comparisons of the whole chat list, which find chats
+# deleted elsewhere
+SEARCH_FULL_SYNC_INTERVAL = float(os.environ.get('SEARCH_FULL_SYNC_INTERVAL', '600'))
+
+# Seconds before an incremental sync's high-water mark that it reads back
+# to, for exchanges saved late (write-behind) or by a skewed clock
+SEARCH_SYNC_LOOKBACK = 120
+
+# Chats read per page by an incremental sync
+SEARCH_SYNC_PAGE_SIZE = 50
+
+# Minimum seconds between uploads of the index to the blob store
+SEARCH_SNAPSHOT_INTERVAL = float(os.environ.get('SEARCH_SNAPSHOT_INTERVAL', '300'))
+
+# Blob store key of the index snapshot
+SEARCH_SNAPSHOT_KEY = 'search/index.db'
+
+# Maximum number of results per search
+SEARCH_MAX_RESULTS = 50
+
+# Tokens of context around the matches in a snippet
+SNIPPET_TOKENS = 16
+
+SNIPPET_START = '<mark>'
+SNIPPET_END = '</mark>'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS indexed_chats (
+    user_id TEXT NOT NULL,
+    chat_id TEXT NOT NULL,
+    title TEXT,
+    updated_at TEXT NOT NULL,
+    last_message_id TEXT,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, chat_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS documents (
+    rowid INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    chat_id TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    UNIQUE (chat_id, message_id)
+);
+
+-- Per user: the newest chat updated_at seen by a sync, and when the chat
+-- list was last compared in full (Unix time)
+CREATE TABLE IF NOT EXISTS sync_state (
+    user_id TEXT PRIMARY KEY,
+    updated_at TEXT NOT NULL,
+    full_sync_at REAL NOT NULL
+) WITHOUT ROWID;
+
+CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+    content,
+    tokenize = 'porter unicode61',
+    prefix = '2 3'
+);
+"""
+
+QUERY_TERM_PATTERN = re.compile(r"\w+")
+
+# Shortest last word that is also matched as a prefix
+MIN_PREFIX_CHARS = 2
+
+
+def build_match_query(query: str) -> Optional[str]:
+    """
+    Turn free text into an FTS5 query matching all of its words.
+
+    Each word is quoted, so FTS5 operators in the text are matched
+    literally. The last word also matches as a prefix, for search as you
+    type, once it is long enough to be served by the prefix index.
+    """
+    terms = QUERY_TERM_PATTERN.findall(query.lower())
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    if len(terms[-1]) >= MIN_PREFIX_CHARS:
+        quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+class SearchIndex:
+    """An FTS5 index of users' messages in a SQLite file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connection()
+        conn.executescript(SCHEMA)
+        # Index files from before message counts were tracked; their chats
+        # are read in full once by the next sync
+        existing = {row['name'] for row in conn.execute("PRAGMA table_info(indexed_chats)")}
+        if 'message_count' not in existing:
+            conn.execute("ALTER TABLE indexed_chats ADD COLUMN message_count INTEGER NOT NULL DEFAULT 0")
+        self._synced_at: Dict[str, float] = {}
+        self._sync_locks: Dict[str, threading.Lock] = {}
+        self._sync_locks_lock = threading.Lock()
+        # Whether the index changed since it was opened or last uploaded
+        self._dirty = False
+        self._snapshot_at = 0.0
+        self._snapshot_lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Run statements in one write transaction, rolled back on error."""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    # ============================================
+    # Updates
+    # ============================================
+
+    def add_chat(self, user_id: str, chat: Dict[str, Any]) -> None:
+        """Track a new, empty chat, so its messages are indexed as they are saved."""
+        self._connection().execute(
+            "INSERT OR IGNORE INTO indexed_chats (user_id, chat_id, title, updated_at) VALUES (?, ?, ?, ?)",
+            (user_id, chat['chat_id'], chat.get('title'), chat['updated_at'])
+        )
+
+    def add_messages(
+        self,
+        user_id: str,
+        chat_id: str,
+        messages: List[Dict[str, Any]],
+        title: Optional[str] = None
+    ) -> bool:
+        """
+        Index messages saved to a tracked chat.
+
+        Returns:
+            False if the chat isn't tracked yet; it is then indexed in full
+            by the next sync
+        """
+        with self._transaction() as conn:
+            tracked = conn.execute(
+                "SELECT 1 FROM indexed_chats WHERE user_id = ? AND chat_id = ?",
+                (user_id, chat_id)
+            ).fetchone() is not None
+            if tracked:
+                self._index_chat(conn, user_id, {'chat_id': chat_id, 'title': title}, messages)
+        return tracked
+
+    def rename_chat(self, user_id: str, chat_id: str, title: str) -> None:
+        self._connection().execute(
+            "UPDATE indexed_chats SET title = ? WHERE user_id = ? AND chat_id = ?",
+            (title, user_id, chat_id)
+        )
+
+    def remove_chats(self, user_id: str, chat_ids: List[str]) -> None:
+        """Remove chats and their messages from the index."""
+        with self._transaction() as conn:
+            for chat_id in chat_ids:
+                self._remove_chat(conn, user_id, chat_id)
+
+    def _index_chat(
+        self,
+        conn: sqlite3.Connection,
+        user_id: str,
+        chat: Dict[str, Any],
+        messages: List[Dict[str, Any]]
+    ) -> int:
+        """Index messages of a chat and return how many were new."""
+        inserted = 0
+        self._dirty = True
+        last_message_id = None
+        updated_at = chat.get('updated_at')
+        for message in messages:
+            # Messages already indexed (e.g. by another thread) are skipped
+            row = conn.execute(
+                "INSERT OR IGNORE INTO documents (user_id, chat_id, message_id, role, created_at) "
+                "VALUES (?, ?, ?, ?, ?) RETURNING rowid",
+                (user_id, chat['chat_id'], message['message_id'], message['role'], message['created_at'])
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "INSERT INTO documents_fts (rowid, content) VALUES (?, ?)",
+                    (row[0], message['content'])
+                )
+                inserted += 1
+            last_message_id = max(last_message_id or '', message['message_id'])
+            updated_at = max(updated_at or '', message['created_at'])
+
+        conn.execute(
+            "INSERT INTO indexed_chats (user_id, chat_id, title, updated_at, last_message_id, message_count) "
+            "VALUES (:user_id, :chat_id, :title, :updated_at, :last_message_id, :inserted) "
+            "ON CONFLICT (user_id, chat_id) DO UPDATE SET "
+            "title = COALESCE(:title, title), "
+            "updated_at = MAX(updated_at, COALESCE(:updated_at, '')), "
+            "last_message_id = MAX(COALESCE(last_message_id, ''), COALESCE(:last_message_id, '')), "
+            "message_count = message_count + :inserted",
+            {
+                'user_id': user_id,
+                'chat_id': chat['chat_id'],
+                'title': chat.get('title'),
+                'updated_at': updated_at or '',
+                'last_message_id': last_message_id,
+                'inserted': inserted,
+            }
+        )
+        return inserted
+
+    def _remove_chat(self, conn: sqlite3.Connection, user_id: str, chat_id: str) -> None:
+        self._dirty = True
+        conn.execute(
+            "DELETE FROM documents_fts WHERE rowid IN (SELECT rowid FROM documents WHERE chat_id = ?)",
+            (chat_id,)
+        )
+        conn.execute("DELETE FROM documents WHERE chat_id = ?", (chat_id,))
+        conn.execute(
+            "DELETE FROM indexed_chats WHERE user_id = ? AND chat_id = ?",
+            (user_id, chat_id)
+        )
+
+    # ============================================
+    # Sync
+    # ============================================
+
+    def _sync_lock(self, user_id: str) -> threading.Lock:
+        with self._sync_locks_lock:
+            return self._sync_locks.setdefault(user_id, threading.Lock())
+
+    def sync(self, user_id: str, force: bool = False) -> None:
+        """
+        Bring a user's index up to date with storage.
+
+        Reads the chats updated since the last sync (or all chats, for a
+        full sync), then only the messages of chats updated since they were
+        indexed. A chat whose indexed message count is still short of its
+        stored one afterwards has a gap, e.g. from a message written
+        elsewhere between two saved here, and is read in full.
+
+        Skipped if the user was synced in the last SEARCH_SYNC_INTERVAL
+        seconds, unless force is set. A forced sync is always full.
+        """
+        with self._sync_lock(user_id):
+            synced_at = self._synced_at.get(user_id)
+            if not force and synced_at is not None and time.monotonic() - synced_at < SEARCH_SYNC_INTERVAL:
+                return
+
+            storage = get_storage()
+            state = self._connection().execute(
+                "SELECT updated_at, full_sync_at FROM sync_state WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            full = force or state is None or time.time() - state['full_sync_at'] >= SEARCH_FULL_SYNC_INTERVAL
+            if full:
+                chats = storage.get_chats(user_id)
+            else:
+                chats = self._chats_updated_since(storage, user_id, state['updated_at'])
+
+            indexed = {
+                row['chat_id']: row
+                for row in self._connection().execute(
+                    "SELECT chat_id, title, updated_at, last_message_id, message_count "
+                    "FROM indexed_chats WHERE user_id = ?",
+                    (user_id,)
+                )
+            }
+
+            changed = 0
+            for chat in chats:
+                known = indexed.pop(chat['chat_id'], None)
+                stored_count = int(chat.get('message_count') or 0)
+                if (
+                    known is not None
+                    and known['updated_at'] >= chat['updated_at']
+                    and known['title'] == chat.get('title')
+                    and known['message_count'] >= stored_count
+                ):
+                    continue
+                after = known['last_message_id'] if known is not None else None
+                count = self._sync_chat(storage, user_id, chat, after or None)
+                if after and known['message_count'] + count < stored_count:
+                    self._sync_chat(storage, user_id, chat, None)
+                changed += 1
+
+            # Chats missing from the full list were deleted
+            removed = list(indexed) if full else []
+            if removed:
+                self.remove_chats(user_id, removed)
+
+            newest = max([chat['updated_at'] for chat in chats] + ([state['updated_at']] if state else []), default='')
+            self._connection().execute(
+                "INSERT OR REPLACE INTO sync_state (user_id, updated_at, full_sync_at) VALUES (?, ?, ?)",
+                (user_id, newest, time.time() if full else state['full_sync_at'])
+            )
+
+            self._synced_at[user_id] = time.monotonic()
+            if changed or removed:
+                logger.info(
+                    "Search index synced for %s (%s): %d chats updated, %d removed",
+                    user_id, 'full' if full else 'incremental', changed, len(removed)
+                )
+
+        self.upload_snapshot()
+
+    def _chats_updated_since(self, storage, user_id: str, since: str) -> List[Dict[str, Any]]:
+        """Read a user's chats newest first, back to a little before since."""
+        if since:
+            since = (datetime.fromisoformat(since) - timedelta(seconds=SEARCH_SYNC_LOOKBACK)).isoformat()
+        chats = []
+        cursor = None
+        while True:
+            page, cursor = storage.get_chats_page(user_id, SEARCH_SYNC_PAGE_SIZE, cursor)
+            chats.extend(chat for chat in page if chat['updated_at'] >= since)
+            if not cursor or (page and page[-1]['updated_at'] < since):
+                return chats
+
+    def _sync_chat(
+        self,
+        storage,
+        user_id: str,
+        chat: Dict[str, Any],
+        after_message_id: Optional[str]
+    ) -> int:
+        messages = [
+            unpack_message(item)
+            for item in storage.get_messages(chat['chat_id'], after_message_id=after_message_id)
+        ]
+        with self._transaction() as conn:
+            return self._index_chat(conn, user_id, chat, messages)
+
+    # ============================================
+    # Snapshots
+    # ============================================
+
+    def upload_snapshot(self, force: bool = False) -> None:
+        """
+        Upload a copy of the index to the blob store, if it changed.
+
+        At most once every SEARCH_SNAPSHOT_INTERVAL seconds unless force is
+        set. Does nothing without a blob store. A failure is logged, and
+        the upload is tried again after the next change.
+        """
+        store = get_blob_store()
+        if store is None or not self._dirty:
+            return
+        if not force and time.monotonic() - self._snapshot_at < SEARCH_SNAPSHOT_INTERVAL:
+            return
+        # Another thread is already uploading
+        if not self._snapshot_lock.acquire(blocking=False):
+            return
+        copy_path = f"{self.path}.snapshot"
+        try:
+            self._dirty = False
+            if os.path.exists(copy_path):
+                os.remove(copy_path)
+            # A consistent, compacted copy that doesn't block writers
+            self._connection().execute("VACUUM INTO ?", (copy_path,))
+            with open(copy_path, 'rb') as f:
+                store.put(SEARCH_SNAPSHOT_KEY, f.read())
+            self._snapshot_at = time.monotonic()
+        except Exception:
+            self._dirty = True
+            logger.exception("Failed to upload the search index snapshot")
+        finally:
+            if os.path.exists(copy_path):
+                os.remove(copy_path)
+            self._snapshot_lock.release()
+
+    # ============================================
+    # Search
+    # ============================================
+
+    def search(self, user_id: str, query: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        Find a user's messages matching all words of a query, best first.
+
+        Returns:
+            Matches with chat_id, chat_title, message_id, role, created_at,
+            a snippet with the matched words wrapped in <mark> tags, and the
+            BM25 score (lower is better)
+        """
+        match = build_match_query(query)
+        if match is None:
+            return []
+
+        self.sync(user_id)
+        # Rank first, then build snippets for the top matches only
+        rows = self._connection().execute(
+            "WITH top AS ("
+            "  SELECT documents_fts.rowid AS rowid, documents_fts.rank AS score FROM documents_fts "
+            "  JOIN documents d ON d.rowid = documents_fts.rowid "
+            "  WHERE documents_fts MATCH :match AND d.user_id = :user_id "
+            "  ORDER BY documents_fts.rank LIMIT :limit"
+            ") "
+            "SELECT d.chat_id, c.title AS chat_title, d.message_id, d.role, d.created_at, "
+            "snippet(documents_fts, 0, :start, :end, '…', :tokens) AS snippet, top.score "
+            "FROM top "
+            "JOIN documents_fts ON documents_fts.rowid = top.rowid "
+            "JOIN documents d ON d.rowid = top.rowid "
+            "LEFT JOIN indexed_chats c ON c.user_id = d.user_id AND c.chat_id = d.chat_id "
+            "WHERE documents_fts MATCH :match "
+            "ORDER BY top.score",
+            {
+                'match': match,
+                'user_id': user_id,
+                'limit': min(limit, SEARCH_MAX_RESULTS),
+                'start': SNIPPET_START,
+                'end': SNIPPET_END,
+                'tokens': SNIPPET_TOKENS,
+            }
+        )
+        return [{**dict(row), 'score': round(row['score'], 4)} for row in rows]
+
+
+_index: Optional[SearchIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> SearchIndex:
+    """Get the search index, opening it on first use."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                restore_snapshot(SEARCH_INDEX_PATH)
+                _index = SearchIndex(SEARCH_INDEX_PATH)
+    return _index
+
+
+def restore_snapshot(path: str) -> bool:
+    """
+    Download the index snapshot to path, unless an index file is already there.
+
+    Returns:
+        Whether a snapshot was restored. Without one, the index starts
+        empty and is built by the first sync.
+    """
+    store = get_blob_store()
+    if store is None or os.path.exists(path):
+        return False
+    try:
+        data = store.get(SEARCH_SNAPSHOT_KEY)
+    except KeyError:
+        return False
+    except Exception:
+        logger.exception("Failed to download the search index snapshot")
+        return False
+
+    tmp_path = f"{path}.download"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    logger.info("Search index restored from snapshot (%d bytes)", len(data))
+    return True
+
+
+# ============================================
+# Write Hooks
+# ============================================
+
+# Hooks only apply while this process has the index open; anything they
+# miss is picked up by the next sync. A failed update is logged and left
+# for the sync too, instead of failing the write.
+
+def on_chat_created(user_id: str, chat: Dict[str, Any]) -> None:
+    """Track a new chat, so its messages are indexed as they are saved."""
+    if _index is None:
+        return
+    try:
+        _index.add_chat(user_id, chat)
+    except Exception:
+        logger.exception("Failed to add chat %s to the search index", chat.get('chat_id'))
+
+
+def on_messages_saved(
+    user_id: str,
+    chat_id: str,
+    messages: List[Dict[str, Any]],
+    title: Optional[str] = None
+) -> None:
+    """Index a saved exchange."""
+    if _index is None:
+        return
+    try:
+        _index.add_messages(user_id, chat_id, messages, title=title)
+    except Exception:
+        logger.exception("Failed to index messages of chat %s", chat_id)
+
+
+def on_chat_renamed(user_id: str, chat_id: str, title: str) -> None:
+    if _index is None:
+        return
+    try:
+        _index.rename_chat(user_id, chat_id, title)
+    except Exception:
+        logger.exception("Failed to rename chat %s in the search index", chat_id)
+
+
+def on_chats_deleted(user_id: str, chat_ids: List[str]) -> None:
+    """Remove deleted (or pending deletion) chats from the index."""
+    if _index is None:
+        return
+    try:
+        _index.remove_chats(user_id, chat_ids)
+    except Exception:
+        logger.exception("Failed to remove chats from the search index")
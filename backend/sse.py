@@ -0,0 +1,114 @@
+"""
+Server-sent events encoding for streaming responses.
+
+Events carry a JSON payload, an `event:` type and a monotonically
+increasing `id:`. Small text deltas from the model can be coalesced by
+time or size to cut per-frame overhead.
+"""
+import asyncio
+import json
+import os
+import time
+from typing import Any, AsyncGenerator, AsyncIterator, Optional
+
+# Maximum time a text delta is held back while coalescing (0 disables)
+SSE_COALESCE_MS = float(os.environ.get('SSE_COALESCE_MS', '25'))
+
+# Buffered text size that triggers an immediate flush
+SSE_COALESCE_BYTES = int(os.environ.get('SSE_COALESCE_BYTES', '512'))
+
+# Event types
+META = 'meta'
+CONTENT = 'content'
+TITLE = 'title'
+USAGE = 'usage'
+DONE = 'done'
+ERROR = 'error'
+
+
+def format_event(event: str, data: Any, event_id: Optional[int] = None) -> str:
+    """Format a single SSE frame with a JSON payload."""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    # Compact JSON never contains raw newlines, so one data line suffices
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False, separators=(',', ':'))}")
+    return "\n".join(lines) + "\n\n"
+
+
+class EventEncoder:
+    """Encodes the events of one stream with monotonically increasing IDs."""
+
+    def __init__(self, last_id: int = 0):
+        self.last_id = last_id
+
+    def encode(self, event: str, data: Any) -> str:
+        self.last_id += 1
+        return format_event(event, data, self.last_id)
+
+
+async def coalesce(
+    chunks: AsyncIterator[str],
+    max_delay_ms: float = SSE_COALESCE_MS,
+    max_bytes: int = SSE_COALESCE_BYTES
+) -> AsyncGenerator[str, None]:
+    """
+    Merge small text deltas into larger chunks.
+
+    Buffered text is flushed once it reaches max_bytes, or max_delay_ms after
+    the first delta in the buffer arrived, whichever comes first. If a read
+    is cancelled while text is buffered, the read returns that text instead.
+    """
+    if max_delay_ms <= 0:
+        async for chunk in chunks:
+            yield chunk
+        return
+
+    iterator = chunks.__aiter__()
+    buffer = []
+    buffered_bytes = 0
+    deadline = None
+    # Keep one pending read; cancelling it would finalize the source stream
+    pending = asyncio.ensure_future(iterator.__anext__())
+
+    try:
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                done, _ = await asyncio.wait({pending}, timeout=timeout)
+            except asyncio.CancelledError:
+                # The read was cancelled, e.g. by Generation.until_cancelled;
+                # return the held-back text instead of dropping it
+                if not buffer:
+                    raise
+                yield ''.join(buffer)
+                return
+
+            if not done:
+                # Deadline passed with no new delta
+                yield ''.join(buffer)
+                buffer, buffered_bytes, deadline = [], 0, None
+                continue
+
+            try:
+                chunk = pending.result()
+            except StopAsyncIteration:
+                break
+
+            buffer.append(chunk)
+            buffered_bytes += len(chunk.encode())
+            if deadline is None:
+                deadline = time.monotonic() + max_delay_ms / 1000
+
+            if buffered_bytes >= max_bytes:
+                yield ''.join(buffer)
+                buffer, buffered_bytes, deadline = [], 0, None
+
+            pending = asyncio.ensure_future(iterator.__anext__())
+    finally:
+        if not pending.done():
+            pending.cancel()
+
+    if buffer:
+        yield ''.join(buffer)
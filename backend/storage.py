@@ -0,0 +1,490 @@
+"""
+Storage backends for chats, messages, usage, memories and model configs.
+
+database.py is the API the app uses; it delegates persistence to a Storage
+backend chosen with STORAGE_BACKEND:
+
+- dynamodb (default): the AWS deployment's DynamoDB tables
+- sqlite: a local SQLite file (SQLITE_PATH), for self-hosted single-node
+  deployments, development and benchmarks
+
+Item formats, message IDs, cursors and message content packing are shared
+by all backends and defined here.
+"""
+import base64
+import json
+import os
+import threading
+import zlib
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import Optional, List, Dict, Any, Tuple
+from uuid6 import UUID, uuid7
+
+from blob_store import get_blob_store
+
+try:
+    import zstandard
+except ImportError:  # Optional; only needed for MESSAGE_COMPRESSION=zstd
+    zstandard = None
+
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'dynamodb').lower()
+
+# Per-message usage, as stored on assistant messages
+USAGE_FIELDS = (
+    'input_tokens',
+    'output_tokens',
+    'cache_read_input_tokens',
+    'cache_creation_input_tokens',
+    'ttft_ms',
+    'latency_ms',
+)
+
+# Totals kept per usage bucket. Latencies are summed, and averaged on read.
+USAGE_TOTALS = (
+    'input_tokens',
+    'output_tokens',
+    'cache_read_input_tokens',
+    'cache_creation_input_tokens',
+    'ttft_ms_total',
+    'latency_ms_total',
+)
+
+USAGE_GROUPS = ('model', 'chat', 'day')
+
+# Token counts added to a chat's total_tokens
+CHAT_TOKEN_FIELDS = (
+    'input_tokens',
+    'output_tokens',
+    'cache_read_input_tokens',
+    'cache_creation_input_tokens',
+)
+
+# Characters of the last message kept on the chat for the chat list
+CHAT_PREVIEW_CHARS = 200
+
+# Reserved config ID for model config metadata (default pointer and version)
+MODEL_CONFIG_META_ID = '__meta__'
+
+# Message content above this many UTF-8 bytes is stored compressed
+MESSAGE_COMPRESS_THRESHOLD = int(os.environ.get('MESSAGE_COMPRESS_THRESHOLD', '4096'))
+
+# Compressed content above this many bytes is moved to the blob store, if
+# one is configured (see blob_store.py)
+MESSAGE_OFFLOAD_THRESHOLD = int(os.environ.get('MESSAGE_OFFLOAD_THRESHOLD', '65536'))
+
+# zlib, or zstd with the zstandard package installed. Stored items record
+# their encoding, so this can be changed at any time.
+MESSAGE_COMPRESSION = os.environ.get('MESSAGE_COMPRESSION', 'zlib').lower()
+
+# Attributes that stand in for `content` on a packed message
+PACKED_CONTENT_FIELDS = ('content_z', 'content_ref', 'content_encoding', 'content_length')
+
+
+# ============================================
+# Interface
+# ============================================
+
+class Storage(ABC):
+    """
+    Persistence operations behind database.py.
+
+    Methods are blocking; database_async runs them on worker threads, so
+    implementations must be safe to call from several threads at once.
+    """
+
+    # Chats
+
+    @abstractmethod
+    def create_chat(self, user_id: str, title: str) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    def get_chats(self, user_id: str) -> List[Dict[str, Any]]:
+        """Get a user's chats that aren't pending deletion, most recently updated first."""
+
+    @abstractmethod
+    def get_chats_page(
+        self,
+        user_id: str,
+        limit: int,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Get one page of get_chats, and the next page's cursor."""
+
+    @abstractmethod
+    def get_chat(self, user_id: str, chat_id: str) -> Optional[Dict[str, Any]]:
+        """Get a chat, including one pending deletion (with deleted_at set)."""
+
+    @abstractmethod
+    def update_chat_title(self, user_id: str, chat_id: str, title: str) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    def update_chat_summary(
+        self,
+        user_id: str,
+        chat_id: str,
+        summary: str,
+        summary_through: str,
+        previous_through: Optional[str] = None
+    ) -> bool:
+        """Store a summary if the stored one still ends at previous_through."""
+
+    @abstractmethod
+    def mark_chat_deleted(self, user_id: str, chat_id: str) -> None:
+        ...
+
+    @abstractmethod
+    def delete_chats(self, user_id: str, chat_ids: List[str]) -> int:
+        """Delete chats and their messages. Returns the number of messages deleted."""
+
+    @abstractmethod
+    def request_cancel(self, user_id: str, chat_id: str, generation_id: str) -> bool:
+        """
+        Set a chat's cancel_generation_id, for the instance running that
+        generation to pick up. Returns False if the chat doesn't exist.
+        """
+
+    # Messages
+
+    @abstractmethod
+    def save_exchange(
+        self,
+        user_id: str,
+        chat_id: str,
+        messages: List[Dict[str, Any]],
+        title: Optional[str] = None
+    ) -> bool:
+        """
+        Atomically write messages, update the chat's activity (see
+        chat_activity) and title, and add the messages' usage to the usage
+        totals.
+
+        Returns:
+            False if the chat doesn't exist or is pending deletion, in which
+            case nothing is written
+        """
+
+    @abstractmethod
+    def get_messages(
+        self,
+        chat_id: str,
+        limit: Optional[int] = None,
+        after_message_id: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Get messages in message ID order, optionally only the newest `limit`."""
+
+    @abstractmethod
+    def get_messages_page(
+        self,
+        chat_id: str,
+        limit: int,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Get one page of messages, newest page first, and the next page's cursor."""
+
+    # Usage
+
+    @abstractmethod
+    def get_usage_buckets(
+        self,
+        user_id: str,
+        group_by: str,
+        since: Optional[str] = None,
+        until: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Get raw usage buckets: the group value as 'bucket', 'messages' and
+        USAGE_TOTALS. since/until bound the days when grouping by day.
+        """
+
+    # Memories
+
+    @abstractmethod
+    def put_memory(self, item: Dict[str, Any]) -> None:
+        ...
+
+    @abstractmethod
+    def get_memories(self, user_id: str) -> List[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def get_memory(self, user_id: str, memory_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def update_memory(self, user_id: str, memory_id: str, updates: Dict[str, Any]) -> Dict[str, Any]:
+        """Set attributes on a memory and return the updated item."""
+
+    @abstractmethod
+    def delete_memory(self, user_id: str, memory_id: str) -> None:
+        ...
+
+    # Model configs
+
+    @abstractmethod
+    def get_model_config_version(self) -> Optional[int]:
+        """Get the version counter bumped by every model config write (a cheap read)."""
+
+    @abstractmethod
+    def load_model_configs(self) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """Get all model configs, with is_default resolved, and the current version."""
+
+    @abstractmethod
+    def put_model_config(self, item: Dict[str, Any]) -> None:
+        ...
+
+    @abstractmethod
+    def delete_model_config(self, config_id: str) -> None:
+        ...
+
+    @abstractmethod
+    def set_default_model_config(self, config_id: Optional[str], only_if: Optional[str] = None) -> None:
+        """
+        Point the default at a config (or at none) and bump the version.
+
+        With only_if, the pointer only moves if it currently points at
+        only_if; the version is bumped either way.
+        """
+
+    @abstractmethod
+    def bump_model_config_version(self) -> None:
+        ...
+
+
+_storage: Optional[Storage] = None
+_storage_lock = threading.Lock()
+
+
+def get_storage() -> Storage:
+    """Get the storage backend, creating the one selected by STORAGE_BACKEND."""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = _create_storage(STORAGE_BACKEND)
+    return _storage
+
+
+def set_storage(storage: Storage) -> None:
+    """Use a different storage backend, e.g. in benchmarks."""
+    global _storage
+    _storage = storage
+
+
+def _create_storage(backend: str) -> Storage:
+    # Imported here so a SQLite deployment never loads boto3
+    if backend == 'dynamodb':
+        from storage_dynamodb import DynamoDBStorage
+        return DynamoDBStorage()
+    if backend == 'sqlite':
+        from storage_sqlite import SQLiteStorage
+        return SQLiteStorage(os.environ.get('SQLITE_PATH', 'chatbot.db'))
+    raise ValueError(f"Unknown STORAGE_BACKEND '{backend}' (expected dynamodb or sqlite)")
+
+
+# ============================================
+# Shared Item Helpers
+# ============================================
+
+def utcnow() -> str:
+    """Current time as a naive UTC ISO timestamp, as stored on items."""
+    return datetime.utcnow().isoformat()
+
+
+def new_message_id() -> str:
+    """Generate a time-ordered (UUIDv7) message ID."""
+    return str(uuid7())
+
+
+def message_id_from_timestamp(created_at: str) -> str:
+    """Build a UUIDv7 message ID whose time prefix matches an ISO timestamp."""
+    # created_at is stored as naive UTC
+    moment = datetime.fromisoformat(created_at).replace(tzinfo=timezone.utc)
+    timestamp_ms = int(moment.timestamp() * 1000)
+    uuid_int = (timestamp_ms & 0xFFFFFFFFFFFF) << 80
+    uuid_int |= int.from_bytes(os.urandom(10), 'big') & ((1 << 76) - 1)
+    return str(UUID(int=uuid_int, version=7))
+
+
+def is_time_ordered_id(message_id: str) -> bool:
+    """Check whether a message ID is a UUIDv7 (sorts by creation time)."""
+    return len(message_id) == 36 and message_id[14] == '7'
+
+
+def usage_buckets(chat_id: str, message: Dict[str, Any]) -> List[str]:
+    """Get the usage buckets (group#value) a message's usage is added to."""
+    return [
+        f"model#{message.get('model_config_id', 'unknown')}",
+        f"chat#{chat_id}",
+        f"day#{message['created_at'][:10]}",
+    ]
+
+
+def usage_increments(message: Dict[str, Any]) -> Dict[str, int]:
+    """Get the amounts a message adds to each of its buckets' USAGE_TOTALS."""
+    usage = message['usage']
+    increments = {}
+    for field in USAGE_FIELDS:
+        total = field + '_total' if field.endswith('_ms') else field
+        increments[total] = int(usage.get(field) or 0)
+    return increments
+
+
+def chat_activity(messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Get what a list of new messages changes on their chat's item.
+
+    Returns:
+        updated_at, last_message_preview and last_message_role to set, and
+        message_count and total_tokens to add
+    """
+    last = messages[-1]
+    return {
+        'updated_at': last['created_at'],
+        'last_message_preview': last['content'][:CHAT_PREVIEW_CHARS],
+        'last_message_role': last['role'],
+        'message_count': len(messages),
+        'total_tokens': sum(
+            int(message.get('usage', {}).get(field) or 0)
+            for message in messages
+            for field in CHAT_TOKEN_FIELDS
+        ),
+    }
+
+
+def encode_cursor(key: Dict[str, Any]) -> str:
+    """Encode a backend's pagination key as an opaque cursor."""
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+
+def decode_cursor(
+    cursor: str,
+    fields: Tuple[str, ...],
+    expected: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    Decode a cursor from encode_cursor.
+
+    Args:
+        cursor: Cursor from a previous page
+        fields: Attribute names the key must have, all with string values
+        expected: Values the key must have, e.g. the chat being paged
+
+    Raises:
+        ValueError: If the cursor is malformed or is for another listing
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+    if (
+        not isinstance(key, dict)
+        or set(key) != set(fields)
+        or not all(isinstance(value, str) for value in key.values())
+        or any(key[name] != value for name, value in (expected or {}).items())
+    ):
+        raise ValueError("Invalid cursor")
+    return key
+
+
+
+# ============================================
+# Message Content Packing
+# ============================================
+
+def _compress(data: bytes, encoding: str) -> bytes:
+    if encoding == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("MESSAGE_COMPRESSION=zstd requires the zstandard package")
+        return zstandard.ZstdCompressor().compress(data)
+    if encoding == 'zlib':
+        return zlib.compress(data)
+    raise ValueError(f"Unknown message compression '{encoding}'")
+
+
+def _decompress(data: bytes, encoding: str) -> bytes:
+    if encoding == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("Reading zstd-compressed messages requires the zstandard package")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if encoding == 'zlib':
+        return zlib.decompress(data)
+    raise ValueError(f"Unknown message compression '{encoding}'")
+
+
+def content_blob_key(item: Dict[str, Any]) -> str:
+    return f"messages/{item['chat_id']}/{item['message_id']}"
+
+
+def pack_message(item: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Get a message item as stored, with large content compressed.
+
+    Content above MESSAGE_COMPRESS_THRESHOLD bytes is replaced by
+    content_z (compressed bytes), or by content_ref (a blob key) when the
+    compressed size is above MESSAGE_OFFLOAD_THRESHOLD and a blob store is
+    configured. content_length keeps the length in characters, so the
+    message can be measured without decoding it. The item passed in is not
+    changed.
+    """
+    raw = item['content'].encode('utf-8')
+    if len(raw) < MESSAGE_COMPRESS_THRESHOLD:
+        return item
+
+    data = _compress(raw, MESSAGE_COMPRESSION)
+    packed = {key: value for key, value in item.items() if key != 'content'}
+    packed['content_encoding'] = MESSAGE_COMPRESSION
+    packed['content_length'] = len(item['content'])
+
+    store = get_blob_store()
+    if store is not None and len(data) > MESSAGE_OFFLOAD_THRESHOLD:
+        packed['content_ref'] = content_blob_key(item)
+        store.put(packed['content_ref'], data)
+    else:
+        packed['content_z'] = data
+    return packed
+
+
+def unpack_content(item: Dict[str, Any]) -> str:
+    """Decode a stored message's content, fetching it from the blob store if needed."""
+    if 'content' in item:
+        return item['content']
+
+    if 'content_ref' in item:
+        store = get_blob_store()
+        if store is None:
+            raise RuntimeError("Message content is in the blob store, but BLOB_STORE isn't set")
+        data = store.get(item['content_ref'])
+    else:
+        # DynamoDB returns binary attributes wrapped in Binary
+        data = bytes(item['content_z'])
+    return _decompress(data, item['content_encoding']).decode('utf-8')
+
+
+def unpack_message(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Get a stored message item with its content decoded, as it was written."""
+    if 'content' in item and not any(field in item for field in PACKED_CONTENT_FIELDS):
+        return item
+    message = {key: value for key, value in item.items() if key not in PACKED_CONTENT_FIELDS}
+    message['content'] = unpack_content(item)
+    return message
+
+
+class LazyMessage(dict):
+    """
+    A stored message item whose content is only decoded when
+    item['content'] is first read.
+
+    content_length (and everything else) is available without decoding.
+    Note that item.get('content') and `'content' in item` don't decode.
+    """
+
+    def __missing__(self, key: str) -> Any:
+        if key != 'content':
+            raise KeyError(key)
+        content = unpack_content(self)
+        self['content'] = content
+        return content
@@ -0,0 +1,640 @@
+"""
+DynamoDB storage backend.
+
+Large message content is stored compressed, or in the blob store, to stay
+well under the 400 KB item limit and save read and write capacity (see
+storage.pack_message). Messages are returned as stored; database.py decodes
+them.
+
+Tables are accessed through the low-level client, which is much cheaper to
+create than a boto3 resource. The client is given the same handlers a
+boto3 resource installs, so items are passed and returned as plain Python
+values.
+"""
+import contextvars
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Optional, List, Dict, Any, Tuple
+from uuid import uuid4
+
+import aws
+import tracing
+from blob_store import get_blob_store
+from storage import (
+    MODEL_CONFIG_META_ID,
+    USAGE_TOTALS,
+    Storage,
+    chat_activity,
+    decode_cursor,
+    encode_cursor,
+    is_time_ordered_id,
+    pack_message,
+    usage_buckets,
+    usage_increments,
+    utcnow
+)
+
+_dynamodb = None
+_dynamodb_lock = threading.Lock()
+
+
+def get_dynamodb():
+    """Get the DynamoDB client, creating it on first use. Safe to share between threads."""
+    global _dynamodb
+    if _dynamodb is None:
+        with _dynamodb_lock:
+            if _dynamodb is None:
+                client = aws.get_client('dynamodb')
+                _register_item_transforms(client)
+                tracing.instrument_dynamodb(client)
+                _dynamodb = client
+    return _dynamodb
+
+
+def _register_item_transforms(client) -> None:
+    """Convert attribute values to and from Python types, as a boto3 resource does."""
+    from boto3.dynamodb.transform import TransformationInjector, copy_dynamodb_params
+
+    injector = TransformationInjector()
+    events = client.meta.events
+    # Serialize a copy, so callers' items are left untouched
+    events.register('provide-client-params.dynamodb', copy_dynamodb_params,
+                    unique_id='dynamodb-create-params-copy')
+    events.register('before-parameter-build.dynamodb', injector.inject_attribute_value_input,
+                    unique_id='dynamodb-attr-value-input')
+    events.register('after-call.dynamodb', injector.inject_attribute_value_output,
+                    unique_id='dynamodb-attr-value-output')
+
+
+class Table:
+    """The subset of a boto3 Table resource used here, on the shared client."""
+
+    def __init__(self, client, name: str):
+        self.name = name
+        self.meta = SimpleNamespace(client=client)
+
+    def get_item(self, **kwargs) -> Dict[str, Any]:
+        return self.meta.client.get_item(TableName=self.name, **kwargs)
+
+    def put_item(self, **kwargs) -> Dict[str, Any]:
+        return self.meta.client.put_item(TableName=self.name, **kwargs)
+
+    def update_item(self, **kwargs) -> Dict[str, Any]:
+        return self.meta.client.update_item(TableName=self.name, **kwargs)
+
+    def delete_item(self, **kwargs) -> Dict[str, Any]:
+        return self.meta.client.delete_item(TableName=self.name, **kwargs)
+
+    def query(self, **kwargs) -> Dict[str, Any]:
+        return self.meta.client.query(TableName=self.name, **kwargs)
+
+    def scan(self, **kwargs) -> Dict[str, Any]:
+        return self.meta.client.scan(TableName=self.name, **kwargs)
+
+
+# Table references
+def get_chats_table():
+    return Table(get_dynamodb(), os.environ.get('CHATS_TABLE', 'mychatgpt-chats'))
+
+# Chats table index on user_id + updated_at
+CHATS_UPDATED_INDEX = os.environ.get('CHATS_UPDATED_INDEX', 'user-updated-index')
+
+def get_messages_table():
+    return Table(get_dynamodb(), os.environ.get('MESSAGES_TABLE', 'mychatgpt-messages'))
+
+def get_memories_table():
+    return Table(get_dynamodb(), os.environ.get('MEMORIES_TABLE', 'mychatgpt-memories'))
+
+def get_model_config_table():
+    return Table(get_dynamodb(), os.environ.get('MODEL_CONFIG_TABLE', 'mychatgpt-model-config'))
+
+def get_usage_table():
+    return Table(get_dynamodb(), os.environ.get('USAGE_TABLE', 'mychatgpt-usage'))
+
+
+# ============================================
+# Pagination Helpers
+# ============================================
+
+def _query_all(table, max_items: Optional[int] = None, **query_kwargs) -> List[Dict[str, Any]]:
+    """Run a query, following LastEvaluatedKey until exhausted or max_items is reached."""
+    items = []
+
+    while True:
+        if max_items:
+            query_kwargs['Limit'] = max_items - len(items)
+        response = table.query(**query_kwargs)
+        items.extend(response.get('Items', []))
+
+        if 'LastEvaluatedKey' not in response or (max_items and len(items) >= max_items):
+            return items
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def _scan_all(table, **scan_kwargs) -> List[Dict[str, Any]]:
+    """Run a scan, following LastEvaluatedKey until exhausted."""
+    items = []
+
+    while True:
+        response = table.scan(**scan_kwargs)
+        items.extend(response.get('Items', []))
+
+        if 'LastEvaluatedKey' not in response:
+            return items
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+# BatchWriteItem accepts at most 25 requests per call
+BATCH_WRITE_SIZE = 25
+
+# Batches written in parallel by bulk deletes
+BATCH_WRITE_WORKERS = int(os.environ.get('BATCH_WRITE_WORKERS', '4'))
+
+BATCH_WRITE_MAX_ATTEMPTS = 8
+
+
+def _write_batch(table, requests: List[Dict[str, Any]]) -> None:
+    """Send one BatchWriteItem call, retrying unprocessed items with jittered backoff."""
+    client = table.meta.client
+    request_items = {table.name: requests}
+
+    for attempt in range(BATCH_WRITE_MAX_ATTEMPTS):
+        response = client.batch_write_item(RequestItems=request_items)
+        request_items = response.get('UnprocessedItems') or {}
+        if not request_items:
+            return
+        time.sleep(random.uniform(0, min(0.05 * 2 ** attempt, 2.0)))
+
+    remaining = sum(len(r) for r in request_items.values())
+    raise RuntimeError(f"{remaining} batch write requests still unprocessed after retries")
+
+
+def _batch_delete(table, keys: List[Dict[str, Any]]) -> None:
+    """Delete items by key in 25-item batches, written in parallel."""
+    requests = [{'DeleteRequest': {'Key': key}} for key in keys]
+    batches = [requests[i:i + BATCH_WRITE_SIZE] for i in range(0, len(requests), BATCH_WRITE_SIZE)]
+
+    if len(batches) <= 1:
+        for batch in batches:
+            _write_batch(table, batch)
+        return
+
+    # Each batch runs in its own copy of the caller's context, so its calls
+    # are traced with the request
+    ctx = contextvars.copy_context()
+    with ThreadPoolExecutor(max_workers=BATCH_WRITE_WORKERS) as pool:
+        # list() re-raises the first failure
+        list(pool.map(lambda batch: ctx.copy().run(_write_batch, table, batch), batches))
+
+
+class DynamoDBStorage(Storage):
+    """Storage in the DynamoDB tables named by the *_TABLE environment variables."""
+
+    # ============================================
+    # Chat Operations
+    # ============================================
+
+    def create_chat(self, user_id: str, title: str) -> Dict[str, Any]:
+        table = get_chats_table()
+        now = utcnow()
+
+        item = {
+            'user_id': user_id,
+            'chat_id': str(uuid4()),
+            'title': title,
+            'created_at': now,
+            'updated_at': now,
+            'message_count': 0,
+            'total_tokens': 0
+        }
+
+        table.put_item(Item=item)
+        return item
+
+    def get_chats(self, user_id: str) -> List[Dict[str, Any]]:
+        return _query_all(get_chats_table(), **_chats_query(user_id))
+
+    def get_chats_page(
+        self,
+        user_id: str,
+        limit: int,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        table = get_chats_table()
+        query_kwargs = _chats_query(user_id)
+        if cursor:
+            # Keys of the updated_at index: its own and the table's
+            query_kwargs['ExclusiveStartKey'] = decode_cursor(
+                cursor, ('user_id', 'updated_at', 'chat_id'), expected={'user_id': user_id}
+            )
+
+        # Limit counts items before the deleted_at filter, so a page with
+        # chats pending deletion is topped up from where it stopped
+        items = []
+        while True:
+            query_kwargs['Limit'] = limit - len(items)
+            response = table.query(**query_kwargs)
+            items.extend(response.get('Items', []))
+
+            last_key = response.get('LastEvaluatedKey')
+            if not last_key or len(items) >= limit:
+                return items, encode_cursor(last_key) if last_key else None
+            query_kwargs['ExclusiveStartKey'] = last_key
+
+    def get_chat(self, user_id: str, chat_id: str) -> Optional[Dict[str, Any]]:
+        response = get_chats_table().get_item(
+            Key={'user_id': user_id, 'chat_id': chat_id}
+        )
+        return response.get('Item')
+
+    def update_chat_title(self, user_id: str, chat_id: str, title: str) -> Dict[str, Any]:
+        response = get_chats_table().update_item(
+            Key={'user_id': user_id, 'chat_id': chat_id},
+            UpdateExpression='SET title = :title, updated_at = :updated_at',
+            ExpressionAttributeValues={
+                ':title': title,
+                ':updated_at': utcnow()
+            },
+            ReturnValues='ALL_NEW'
+        )
+        return response.get('Attributes', {})
+
+    def update_chat_summary(
+        self,
+        user_id: str,
+        chat_id: str,
+        summary: str,
+        summary_through: str,
+        previous_through: Optional[str] = None
+    ) -> bool:
+        table = get_chats_table()
+
+        if previous_through:
+            condition = 'summary_through = :prev'
+            expr_values = {':prev': previous_through}
+        else:
+            condition = 'attribute_exists(chat_id) AND attribute_not_exists(summary_through)'
+            expr_values = {}
+
+        try:
+            table.update_item(
+                Key={'user_id': user_id, 'chat_id': chat_id},
+                UpdateExpression='SET summary = :summary, summary_through = :through',
+                ConditionExpression=condition,
+                ExpressionAttributeValues={
+                    ':summary': summary,
+                    ':through': summary_through,
+                    **expr_values
+                }
+            )
+        except table.meta.client.exceptions.ConditionalCheckFailedException:
+            return False
+
+        return True
+
+    def mark_chat_deleted(self, user_id: str, chat_id: str) -> None:
+        get_chats_table().update_item(
+            Key={'user_id': user_id, 'chat_id': chat_id},
+            UpdateExpression='SET deleted_at = :now',
+            ConditionExpression='attribute_exists(chat_id)',
+            ExpressionAttributeValues={':now': utcnow()}
+        )
+
+    def request_cancel(self, user_id: str, chat_id: str, generation_id: str) -> bool:
+        table = get_chats_table()
+        client = table.meta.client
+        try:
+            table.update_item(
+                Key={'user_id': user_id, 'chat_id': chat_id},
+                UpdateExpression='SET cancel_generation_id = :gid',
+                ConditionExpression='attribute_exists(chat_id)',
+                ExpressionAttributeValues={':gid': generation_id}
+            )
+        except client.exceptions.ConditionalCheckFailedException:
+            return False
+        return True
+
+    def delete_chats(self, user_id: str, chat_ids: List[str]) -> int:
+        # Message keys (and blob references) are read with a projection,
+        # then deleted with parallel BatchWriteItem calls
+        messages_table = get_messages_table()
+
+        items = []
+        for chat_id in chat_ids:
+            items.extend(_query_all(
+                messages_table,
+                KeyConditionExpression='chat_id = :cid',
+                ExpressionAttributeValues={':cid': chat_id},
+                ProjectionExpression='chat_id, message_id, content_ref'
+            ))
+        message_keys = [{'chat_id': i['chat_id'], 'message_id': i['message_id']} for i in items]
+
+        # Delete the messages first, so a failure never leaves orphaned
+        # messages, and their blobs once nothing references them
+        _batch_delete(messages_table, message_keys)
+        _delete_blobs(items)
+        _batch_delete(
+            get_chats_table(),
+            [{'user_id': user_id, 'chat_id': chat_id} for chat_id in chat_ids]
+        )
+
+        return len(message_keys)
+
+    # ============================================
+    # Message Operations
+    # ============================================
+
+    def save_exchange(
+        self,
+        user_id: str,
+        chat_id: str,
+        messages: List[Dict[str, Any]],
+        title: Optional[str] = None
+    ) -> bool:
+        messages_table = get_messages_table()
+        chats_table = get_chats_table()
+        client = chats_table.meta.client
+
+        activity = chat_activity(messages)
+        update_expr = (
+            'SET updated_at = :updated_at, last_message_preview = :preview, '
+            'last_message_role = :role'
+        )
+        expr_values = {
+            ':updated_at': activity['updated_at'],
+            ':preview': activity['last_message_preview'],
+            ':role': activity['last_message_role'],
+            ':count': activity['message_count'],
+            ':tokens': activity['total_tokens']
+        }
+        if title:
+            update_expr += ', title = :title'
+            expr_values[':title'] = title
+        update_expr += ' ADD message_count :count, total_tokens :tokens'
+
+        packed = [pack_message(item) for item in messages]
+        transact_items = [
+            {'Put': {'TableName': messages_table.name, 'Item': item}}
+            for item in packed
+        ]
+        transact_items.append({
+            'Update': {
+                'TableName': chats_table.name,
+                'Key': {'user_id': user_id, 'chat_id': chat_id},
+                'UpdateExpression': update_expr,
+                'ConditionExpression': 'attribute_exists(chat_id) AND attribute_not_exists(deleted_at)',
+                'ExpressionAttributeValues': expr_values
+            }
+        })
+        for item in messages:
+            if item.get('usage'):
+                transact_items.extend(_usage_updates(chat_id, user_id, item))
+
+        try:
+            # The counters are ADDed, so a retry of a transaction that was
+            # committed (e.g. after a timeout) must not apply it again; within
+            # 10 minutes DynamoDB treats a repeated token as a no-op
+            client.transact_write_items(
+                TransactItems=transact_items,
+                ClientRequestToken=messages[-1]['message_id']
+            )
+        except client.exceptions.TransactionCanceledException as e:
+            reasons = e.response.get('CancellationReasons', [])
+            if any(r.get('Code') == 'ConditionalCheckFailed' for r in reasons):
+                _delete_blobs(packed)
+                return False
+            raise
+
+        return True
+
+    def get_messages(
+        self,
+        chat_id: str,
+        limit: Optional[int] = None,
+        after_message_id: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        # Message IDs are UUIDv7, so DynamoDB returns them already sorted by
+        # creation time and range queries can be served by the key
+        key_condition = 'chat_id = :cid'
+        expr_values = {':cid': chat_id}
+        if after_message_id:
+            key_condition += ' AND message_id > :after'
+            expr_values[':after'] = after_message_id
+
+        # With a limit, read newest first so Limit keeps the latest messages
+        items = _query_all(
+            get_messages_table(),
+            max_items=limit,
+            KeyConditionExpression=key_condition,
+            ExpressionAttributeValues=expr_values,
+            ScanIndexForward=not limit
+        )
+        legacy = not all(is_time_ordered_id(item['message_id']) for item in items)
+        if limit:
+            items.reverse()
+            if legacy:
+                # Rows written before UUIDv7 IDs (see migrate_message_ids.py)
+                # have random keys, so the last keys may not be the latest
+                # messages. Legacy rows are older than every UUIDv7 row, so
+                # this only matters if one was returned; read the whole chat.
+                return self.get_messages(chat_id, after_message_id=after_message_id)[-limit:]
+
+        # Legacy rows also need sorting by timestamp
+        if legacy:
+            items.sort(key=lambda x: x.get('created_at', ''))
+
+        return items
+
+    def get_messages_page(
+        self,
+        chat_id: str,
+        limit: int,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        query_kwargs = {
+            'KeyConditionExpression': 'chat_id = :cid',
+            'ExpressionAttributeValues': {':cid': chat_id},
+            'ScanIndexForward': False,
+            'Limit': limit
+        }
+        if cursor:
+            query_kwargs['ExclusiveStartKey'] = decode_cursor(
+                cursor, ('chat_id', 'message_id'), expected={'chat_id': chat_id}
+            )
+
+        response = get_messages_table().query(**query_kwargs)
+        items = response.get('Items', [])
+        items.reverse()
+
+        last_key = response.get('LastEvaluatedKey')
+        return items, encode_cursor(last_key) if last_key else None
+
+    # ============================================
+    # Usage Operations
+    # ============================================
+
+    def get_usage_buckets(
+        self,
+        user_id: str,
+        group_by: str,
+        since: Optional[str] = None,
+        until: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        prefix = f"{group_by}#"
+        values = {':uid': user_id}
+        if group_by == 'day' and (since or until):
+            key_condition = 'user_id = :uid AND bucket BETWEEN :from AND :to'
+            values[':from'] = prefix + (since or '')
+            values[':to'] = prefix + (until or '9999-12-31')
+        else:
+            key_condition = 'user_id = :uid AND begins_with(bucket, :prefix)'
+            values[':prefix'] = prefix
+
+        items = _query_all(
+            get_usage_table(),
+            KeyConditionExpression=key_condition,
+            ExpressionAttributeValues=values
+        )
+
+        return [{
+            'bucket': item['bucket'][len(prefix):],
+            'messages': int(item.get('messages', 0)),
+            **{total: int(item.get(total, 0)) for total in USAGE_TOTALS}
+        } for item in items]
+
+    # ============================================
+    # Memory Operations
+    # ============================================
+
+    def put_memory(self, item: Dict[str, Any]) -> None:
+        get_memories_table().put_item(Item=item)
+
+    def get_memories(self, user_id: str) -> List[Dict[str, Any]]:
+        return _query_all(
+            get_memories_table(),
+            KeyConditionExpression='user_id = :uid',
+            ExpressionAttributeValues={':uid': user_id}
+        )
+
+    def get_memory(self, user_id: str, memory_id: str) -> Optional[Dict[str, Any]]:
+        response = get_memories_table().get_item(
+            Key={'user_id': user_id, 'memory_id': memory_id}
+        )
+        return response.get('Item')
+
+    def update_memory(self, user_id: str, memory_id: str, updates: Dict[str, Any]) -> Dict[str, Any]:
+        response = get_memories_table().update_item(
+            Key={'user_id': user_id, 'memory_id': memory_id},
+            UpdateExpression='SET ' + ', '.join(f'{name} = :{name}' for name in updates),
+            ExpressionAttributeValues={f':{name}': value for name, value in updates.items()},
+            ReturnValues='ALL_NEW'
+        )
+        return response.get('Attributes', {})
+
+    def delete_memory(self, user_id: str, memory_id: str) -> None:
+        get_memories_table().delete_item(
+            Key={'user_id': user_id, 'memory_id': memory_id}
+        )
+
+    # ============================================
+    # Model Config Operations
+    # ============================================
+
+    # The reserved meta item holds the default config pointer and a version
+    # counter that is bumped on every config write
+
+    def get_model_config_version(self) -> Optional[int]:
+        response = get_model_config_table().get_item(
+            Key={'config_id': MODEL_CONFIG_META_ID},
+            ConsistentRead=True
+        )
+        return response.get('Item', {}).get('version')
+
+    def load_model_configs(self) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        items = _scan_all(get_model_config_table())
+        meta = next((i for i in items if i['config_id'] == MODEL_CONFIG_META_ID), {})
+        configs = [i for i in items if i['config_id'] != MODEL_CONFIG_META_ID]
+
+        # The meta item's pointer decides the default. Tables written before it
+        # existed fall back to the per-item is_default flags.
+        if 'default_config_id' in meta:
+            for config in configs:
+                config['is_default'] = config['config_id'] == meta['default_config_id']
+
+        return configs, meta.get('version')
+
+    def put_model_config(self, item: Dict[str, Any]) -> None:
+        get_model_config_table().put_item(Item=item)
+
+    def delete_model_config(self, config_id: str) -> None:
+        get_model_config_table().delete_item(
+            Key={'config_id': config_id}
+        )
+        self.bump_model_config_version()
+
+    def set_default_model_config(self, config_id: Optional[str], only_if: Optional[str] = None) -> None:
+        if only_if is None:
+            _update_model_config_meta(', default_config_id = :default', {':default': config_id or ''})
+            return
+
+        try:
+            _update_model_config_meta(
+                ', default_config_id = :default',
+                {':default': config_id or '', ':cid': only_if},
+                ConditionExpression='default_config_id = :cid'
+            )
+        except get_model_config_table().meta.client.exceptions.ConditionalCheckFailedException:
+            self.bump_model_config_version()
+
+    def bump_model_config_version(self) -> None:
+        _update_model_config_meta()
+
+
+def _delete_blobs(items: List[Dict[str, Any]]) -> None:
+    """Delete the blobs referenced by message items."""
+    blob_keys = [item['content_ref'] for item in items if 'content_ref' in item]
+    if blob_keys:
+        get_blob_store().delete(blob_keys)
+
+
+def _chats_query(user_id: str) -> Dict[str, Any]:
+    """Query arguments for a user's chats, most recently updated first."""
+    return {
+        'IndexName': CHATS_UPDATED_INDEX,
+        'KeyConditionExpression': 'user_id = :uid',
+        'FilterExpression': 'attribute_not_exists(deleted_at)',
+        'ExpressionAttributeValues': {':uid': user_id},
+        'ScanIndexForward': False
+    }
+
+
+def _usage_updates(chat_id: str, user_id: str, message: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Build transaction updates adding a message's usage to its buckets."""
+    values = {':one': 1, ':now': message['created_at']}
+    counters = ['messages :one']
+    for total, amount in usage_increments(message).items():
+        values[f':{total}'] = amount
+        counters.append(f'{total} :{total}')
+
+    return [{
+        'Update': {
+            'TableName': get_usage_table().name,
+            'Key': {'user_id': user_id, 'bucket': bucket},
+            'UpdateExpression': f"SET updated_at = :now ADD {', '.join(counters)}",
+            'ExpressionAttributeValues': values
+        }
+    } for bucket in usage_buckets(chat_id, message)]
+
+
+def _update_model_config_meta(update_expr: str = '', expr_values: Optional[Dict[str, Any]] = None, **kwargs):
+    """Bump the meta item's version, plus any extra SET clauses."""
+    get_model_config_table().update_item(
+        Key={'config_id': MODEL_CONFIG_META_ID},
+        UpdateExpression='SET version = if_not_exists(version, :zero) + :one' + update_expr,
+        ExpressionAttributeValues={':zero': 0, ':one': 1, **(expr_values or {})},
+        **kwargs
+    )
@@ -0,0 +1,565 @@
+"""
+SQLite storage backend, for self-hosted single-node deployments.
+
+The database runs in WAL mode, so readers never block the writer. Each
+thread gets its own connection. Writes that span several rows run in one
+BEGIN IMMEDIATE transaction.
+
+Chats and messages are stored in columns, with indexes that serve the
+app's queries. Messages also keep their optional attributes (usage, model,
+truncated) in a JSON column. Message content is stored uncompressed, since
+a local file has no item size limit or capacity cost. Memories and model
+configs are small and are stored as JSON documents.
+"""
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Optional, List, Dict, Any, Iterator, Tuple
+from uuid import uuid4
+
+from storage import (
+    CHAT_PREVIEW_CHARS,
+    CHAT_TOKEN_FIELDS,
+    MODEL_CONFIG_META_ID,
+    USAGE_TOTALS,
+    Storage,
+    chat_activity,
+    decode_cursor,
+    encode_cursor,
+    usage_buckets,
+    usage_increments,
+    utcnow
+)
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS chats (
+    user_id TEXT NOT NULL,
+    chat_id TEXT NOT NULL,
+    title TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    deleted_at TEXT,
+    summary TEXT,
+    summary_through TEXT,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    total_tokens INTEGER NOT NULL DEFAULT 0,
+    last_message_preview TEXT,
+    last_message_role TEXT,
+    cancel_generation_id TEXT,
+    PRIMARY KEY (user_id, chat_id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS chats_by_updated ON chats (user_id, updated_at);
+
+CREATE TABLE IF NOT EXISTS messages (
+    chat_id TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    attributes TEXT,
+    PRIMARY KEY (chat_id, message_id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS messages_by_created ON messages (chat_id, created_at, message_id);
+
+CREATE TABLE IF NOT EXISTS usage (
+    user_id TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    messages INTEGER NOT NULL DEFAULT 0,
+    {', '.join(f'{total} INTEGER NOT NULL DEFAULT 0' for total in USAGE_TOTALS)},
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (user_id, bucket)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS memories (
+    user_id TEXT NOT NULL,
+    memory_id TEXT NOT NULL,
+    item TEXT NOT NULL,
+    PRIMARY KEY (user_id, memory_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS model_configs (
+    config_id TEXT PRIMARY KEY,
+    item TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+# Chat columns added after the first release, created on existing databases
+CHAT_ACTIVITY_COLUMNS = {
+    'message_count': 'INTEGER NOT NULL DEFAULT 0',
+    'total_tokens': 'INTEGER NOT NULL DEFAULT 0',
+    'last_message_preview': 'TEXT',
+    'last_message_role': 'TEXT',
+}
+
+# Other chat columns added after the first release
+CHAT_CONTROL_COLUMNS = {
+    'cancel_generation_id': 'TEXT',
+}
+
+# Message columns; every other attribute goes in the JSON column
+MESSAGE_COLUMNS = ('chat_id', 'message_id', 'role', 'content', 'created_at')
+
+# Seconds a connection waits for another process's write lock
+SQLITE_BUSY_TIMEOUT = 5.0
+
+
+def _chat(row: sqlite3.Row) -> Dict[str, Any]:
+    # Unset columns are left out, like missing attributes in DynamoDB
+    return {key: row[key] for key in row.keys() if row[key] is not None}
+
+
+def _message(row: sqlite3.Row) -> Dict[str, Any]:
+    item = {key: row[key] for key in MESSAGE_COLUMNS}
+    if row['attributes']:
+        item.update(json.loads(row['attributes']))
+    return item
+
+
+class SQLiteStorage(Storage):
+    """Storage in a local SQLite database file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connection()
+        conn.executescript(SCHEMA)
+        existing = {row['name'] for row in conn.execute("PRAGMA table_info(chats)")}
+        if not set(CHAT_ACTIVITY_COLUMNS) <= existing:
+            with self._transaction() as tx:
+                # Check again under the write lock, in case another process added them
+                existing = {row['name'] for row in tx.execute("PRAGMA table_info(chats)")}
+                for column, definition in CHAT_ACTIVITY_COLUMNS.items():
+                    if column not in existing:
+                        tx.execute(f"ALTER TABLE chats ADD COLUMN {column} {definition}")
+                if not set(CHAT_ACTIVITY_COLUMNS) <= existing:
+                    self._backfill_chat_activity(tx)
+        if not set(CHAT_CONTROL_COLUMNS) <= existing:
+            with self._transaction() as tx:
+                existing = {row['name'] for row in tx.execute("PRAGMA table_info(chats)")}
+                for column, definition in CHAT_CONTROL_COLUMNS.items():
+                    if column not in existing:
+                        tx.execute(f"ALTER TABLE chats ADD COLUMN {column} {definition}")
+        conn.execute(
+            "INSERT OR IGNORE INTO model_configs (config_id, item) VALUES (?, ?)",
+            (MODEL_CONFIG_META_ID, json.dumps({'config_id': MODEL_CONFIG_META_ID, 'version': 0}))
+        )
+
+    def _backfill_chat_activity(self, conn: sqlite3.Connection) -> None:
+        """Compute the activity columns of chats created before they existed."""
+        tokens = ' + '.join(
+            f"COALESCE(json_extract(attributes, '$.usage.{field}'), 0)" for field in CHAT_TOKEN_FIELDS
+        )
+        conn.execute(
+            "UPDATE chats SET "
+            "message_count = (SELECT COUNT(*) FROM messages m WHERE m.chat_id = chats.chat_id), "
+            f"total_tokens = (SELECT COALESCE(SUM({tokens}), 0) FROM messages m WHERE m.chat_id = chats.chat_id), "
+            "last_message_preview = (SELECT substr(content, 1, :chars) FROM messages m "
+            "WHERE m.chat_id = chats.chat_id ORDER BY message_id DESC LIMIT 1), "
+            "last_message_role = (SELECT role FROM messages m "
+            "WHERE m.chat_id = chats.chat_id ORDER BY message_id DESC LIMIT 1)",
+            {'chars': CHAT_PREVIEW_CHARS}
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Autocommit mode; multi-statement writes use _transaction
+            conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Run statements in one write transaction, rolled back on error."""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    # ============================================
+    # Chat Operations
+    # ============================================
+
+    def create_chat(self, user_id: str, title: str) -> Dict[str, Any]:
+        now = utcnow()
+        item = {
+            'user_id': user_id,
+            'chat_id': str(uuid4()),
+            'title': title,
+            'created_at': now,
+            'updated_at': now,
+            'message_count': 0,
+            'total_tokens': 0
+        }
+
+        self._connection().execute(
+            "INSERT INTO chats (user_id, chat_id, title, created_at, updated_at) "
+            "VALUES (:user_id, :chat_id, :title, :created_at, :updated_at)",
+            item
+        )
+        return item
+
+    def get_chats(self, user_id: str) -> List[Dict[str, Any]]:
+        rows = self._connection().execute(
+            "SELECT * FROM chats WHERE user_id = ? AND deleted_at IS NULL "
+            "ORDER BY updated_at DESC, chat_id DESC",
+            (user_id,)
+        )
+        return [_chat(row) for row in rows]
+
+    def get_chats_page(
+        self,
+        user_id: str,
+        limit: int,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        query = "SELECT * FROM chats WHERE user_id = ? AND deleted_at IS NULL"
+        params: List[Any] = [user_id]
+        if cursor:
+            key = decode_cursor(cursor, ('user_id', 'updated_at', 'chat_id'), expected={'user_id': user_id})
+            query += " AND (updated_at, chat_id) < (?, ?)"
+            params.extend([key['updated_at'], key['chat_id']])
+
+        # One extra row tells whether there is another page
+        query += " ORDER BY updated_at DESC, chat_id DESC LIMIT ?"
+        params.append(limit + 1)
+        rows = self._connection().execute(query, params).fetchall()
+
+        items = [_chat(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = items[-1]
+            next_cursor = encode_cursor({
+                'user_id': user_id,
+                'updated_at': last['updated_at'],
+                'chat_id': last['chat_id']
+            })
+        return items, next_cursor
+
+    def get_chat(self, user_id: str, chat_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connection().execute(
+            "SELECT * FROM chats WHERE user_id = ? AND chat_id = ?",
+            (user_id, chat_id)
+        ).fetchone()
+        return _chat(row) if row else None
+
+    def update_chat_title(self, user_id: str, chat_id: str, title: str) -> Dict[str, Any]:
+        row = self._connection().execute(
+            "UPDATE chats SET title = ?, updated_at = ? WHERE user_id = ? AND chat_id = ? "
+            "RETURNING *",
+            (title, utcnow(), user_id, chat_id)
+        ).fetchone()
+        return _chat(row) if row else {}
+
+    def update_chat_summary(
+        self,
+        user_id: str,
+        chat_id: str,
+        summary: str,
+        summary_through: str,
+        previous_through: Optional[str] = None
+    ) -> bool:
+        if previous_through:
+            condition, params = "summary_through = ?", (previous_through,)
+        else:
+            condition, params = "summary_through IS NULL", ()
+
+        cursor = self._connection().execute(
+            "UPDATE chats SET summary = ?, summary_through = ? "
+            f"WHERE user_id = ? AND chat_id = ? AND {condition}",
+            (summary, summary_through, user_id, chat_id, *params)
+        )
+        return cursor.rowcount > 0
+
+    def mark_chat_deleted(self, user_id: str, chat_id: str) -> None:
+        self._connection().execute(
+            "UPDATE chats SET deleted_at = ? WHERE user_id = ? AND chat_id = ?",
+            (utcnow(), user_id, chat_id)
+        )
+
+    def request_cancel(self, user_id: str, chat_id: str, generation_id: str) -> bool:
+        cursor = self._connection().execute(
+            "UPDATE chats SET cancel_generation_id = ? WHERE user_id = ? AND chat_id = ?",
+            (generation_id, user_id, chat_id)
+        )
+        return cursor.rowcount > 0
+
+    def delete_chats(self, user_id: str, chat_ids: List[str]) -> int:
+        placeholders = ', '.join('?' for _ in chat_ids)
+        with self._transaction() as conn:
+            # Only delete messages of chats the user owns
+            owned = [row[0] for row in conn.execute(
+                f"SELECT chat_id FROM chats WHERE user_id = ? AND chat_id IN ({placeholders})",
+                (user_id, *chat_ids)
+            )]
+            deleted = 0
+            if owned:
+                owned_placeholders = ', '.join('?' for _ in owned)
+                deleted = conn.execute(
+                    f"DELETE FROM messages WHERE chat_id IN ({owned_placeholders})",
+                    owned
+                ).rowcount
+            conn.execute(
+                f"DELETE FROM chats WHERE user_id = ? AND chat_id IN ({placeholders})",
+                (user_id, *chat_ids)
+            )
+        return deleted
+
+    # ============================================
+    # Message Operations
+    # ============================================
+
+    def _insert_messages(self, conn: sqlite3.Connection, items: List[Dict[str, Any]]) -> None:
+        rows = []
+        for item in items:
+            attributes = {k: v for k, v in item.items() if k not in MESSAGE_COLUMNS}
+            rows.append((
+                *(item[key] for key in MESSAGE_COLUMNS),
+                json.dumps(attributes) if attributes else None
+            ))
+        conn.executemany(
+            "INSERT OR REPLACE INTO messages "
+            "(chat_id, message_id, role, content, created_at, attributes) VALUES (?, ?, ?, ?, ?, ?)",
+            rows
+        )
+
+    def save_exchange(
+        self,
+        user_id: str,
+        chat_id: str,
+        messages: List[Dict[str, Any]],
+        title: Optional[str] = None
+    ) -> bool:
+        activity = chat_activity(messages)
+        with self._transaction() as conn:
+            touched = conn.execute(
+                "UPDATE chats SET updated_at = :updated_at, title = COALESCE(:title, title), "
+                "last_message_preview = :last_message_preview, last_message_role = :last_message_role, "
+                "message_count = message_count + :message_count, total_tokens = total_tokens + :total_tokens "
+                "WHERE user_id = :user_id AND chat_id = :chat_id AND deleted_at IS NULL",
+                {**activity, 'title': title or None, 'user_id': user_id, 'chat_id': chat_id}
+            ).rowcount
+            if not touched:
+                return False
+
+            self._insert_messages(conn, messages)
+            for item in messages:
+                if item.get('usage'):
+                    self._add_usage(conn, user_id, chat_id, item)
+        return True
+
+    def get_messages(
+        self,
+        chat_id: str,
+        limit: Optional[int] = None,
+        after_message_id: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        query = "SELECT * FROM messages WHERE chat_id = ?"
+        params: List[Any] = [chat_id]
+        if after_message_id:
+            query += " AND message_id > ?"
+            params.append(after_message_id)
+
+        if limit:
+            # Newest first so the limit keeps the latest messages
+            query += " ORDER BY created_at DESC, message_id DESC LIMIT ?"
+            params.append(limit)
+            rows = self._connection().execute(query, params).fetchall()
+            rows.reverse()
+        else:
+            query += " ORDER BY created_at, message_id"
+            rows = self._connection().execute(query, params).fetchall()
+
+        return [_message(row) for row in rows]
+
+    def get_messages_page(
+        self,
+        chat_id: str,
+        limit: int,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        query = "SELECT * FROM messages WHERE chat_id = ?"
+        params: List[Any] = [chat_id]
+        if cursor:
+            key = decode_cursor(
+                cursor, ('chat_id', 'created_at', 'message_id'), expected={'chat_id': chat_id}
+            )
+            query += " AND (created_at, message_id) < (?, ?)"
+            params.extend([key['created_at'], key['message_id']])
+
+        # One extra row tells whether there is an older page
+        query += " ORDER BY created_at DESC, message_id DESC LIMIT ?"
+        params.append(limit + 1)
+        rows = self._connection().execute(query, params).fetchall()
+
+        has_more = len(rows) > limit
+        items = [_message(row) for row in rows[:limit]]
+        items.reverse()
+
+        next_cursor = None
+        if has_more:
+            oldest = items[0]
+            next_cursor = encode_cursor({
+                'chat_id': chat_id,
+                'created_at': oldest['created_at'],
+                'message_id': oldest['message_id']
+            })
+        return items, next_cursor
+
+    # ============================================
+    # Usage Operations
+    # ============================================
+
+    def _add_usage(self, conn: sqlite3.Connection, user_id: str, chat_id: str, message: Dict[str, Any]) -> None:
+        increments = usage_increments(message)
+        columns = ['messages', *increments]
+        values = [1, *increments.values()]
+        conn.executemany(
+            f"INSERT INTO usage (user_id, bucket, updated_at, {', '.join(columns)}) "
+            f"VALUES (?, ?, ?, {', '.join('?' for _ in columns)}) "
+            "ON CONFLICT (user_id, bucket) DO UPDATE SET updated_at = excluded.updated_at, "
+            + ', '.join(f'{c} = {c} + excluded.{c}' for c in columns),
+            [(user_id, bucket, message['created_at'], *values) for bucket in usage_buckets(chat_id, message)]
+        )
+
+    def get_usage_buckets(
+        self,
+        user_id: str,
+        group_by: str,
+        since: Optional[str] = None,
+        until: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        prefix = f"{group_by}#"
+        if group_by == 'day' and (since or until):
+            condition = "bucket BETWEEN ? AND ?"
+            params = (prefix + (since or ''), prefix + (until or '9999-12-31'))
+        else:
+            # Prefix match that can use the primary key
+            condition = "bucket >= ? AND bucket < ?"
+            params = (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1))
+
+        rows = self._connection().execute(
+            f"SELECT * FROM usage WHERE user_id = ? AND {condition} ORDER BY bucket",
+            (user_id, *params)
+        )
+        return [{
+            'bucket': row['bucket'][len(prefix):],
+            'messages': row['messages'],
+            **{total: row[total] for total in USAGE_TOTALS}
+        } for row in rows]
+
+    # ============================================
+    # Memory Operations
+    # ============================================
+
+    def put_memory(self, item: Dict[str, Any]) -> None:
+        self._connection().execute(
+            "INSERT OR REPLACE INTO memories (user_id, memory_id, item) VALUES (?, ?, ?)",
+            (item['user_id'], item['memory_id'], json.dumps(item))
+        )
+
+    def get_memories(self, user_id: str) -> List[Dict[str, Any]]:
+        rows = self._connection().execute(
+            "SELECT item FROM memories WHERE user_id = ?",
+            (user_id,)
+        )
+        return [json.loads(row['item']) for row in rows]
+
+    def get_memory(self, user_id: str, memory_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connection().execute(
+            "SELECT item FROM memories WHERE user_id = ? AND memory_id = ?",
+            (user_id, memory_id)
+        ).fetchone()
+        return json.loads(row['item']) if row else None
+
+    def update_memory(self, user_id: str, memory_id: str, updates: Dict[str, Any]) -> Dict[str, Any]:
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT item FROM memories WHERE user_id = ? AND memory_id = ?",
+                (user_id, memory_id)
+            ).fetchone()
+            # Like a DynamoDB update, a missing memory is created
+            item = json.loads(row['item']) if row else {'user_id': user_id, 'memory_id': memory_id}
+            item.update(updates)
+            conn.execute(
+                "INSERT OR REPLACE INTO memories (user_id, memory_id, item) VALUES (?, ?, ?)",
+                (user_id, memory_id, json.dumps(item))
+            )
+        return item
+
+    def delete_memory(self, user_id: str, memory_id: str) -> None:
+        self._connection().execute(
+            "DELETE FROM memories WHERE user_id = ? AND memory_id = ?",
+            (user_id, memory_id)
+        )
+
+    # ============================================
+    # Model Config Operations
+    # ============================================
+
+    # As in DynamoDB, a reserved meta row holds the default config pointer
+    # and a version counter, so processes sharing the file can revalidate
+    # their caches with one read
+
+    def _get_meta(self, conn: sqlite3.Connection) -> Dict[str, Any]:
+        row = conn.execute(
+            "SELECT item FROM model_configs WHERE config_id = ?",
+            (MODEL_CONFIG_META_ID,)
+        ).fetchone()
+        return json.loads(row['item']) if row else {}
+
+    def _bump_meta(self, conn: sqlite3.Connection, **changes) -> None:
+        """Bump the meta row's version, and set any other attributes given."""
+        meta = self._get_meta(conn)
+        meta.update(changes, config_id=MODEL_CONFIG_META_ID, version=meta.get('version', 0) + 1)
+        conn.execute(
+            "INSERT OR REPLACE INTO model_configs (config_id, item) VALUES (?, ?)",
+            (MODEL_CONFIG_META_ID, json.dumps(meta))
+        )
+
+    def get_model_config_version(self) -> Optional[int]:
+        return self._get_meta(self._connection()).get('version')
+
+    def load_model_configs(self) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        rows = self._connection().execute("SELECT item FROM model_configs")
+        items = [json.loads(row['item']) for row in rows]
+
+        meta = next((i for i in items if i['config_id'] == MODEL_CONFIG_META_ID), {})
+        configs = [i for i in items if i['config_id'] != MODEL_CONFIG_META_ID]
+        if 'default_config_id' in meta:
+            for config in configs:
+                config['is_default'] = config['config_id'] == meta['default_config_id']
+
+        return configs, meta.get('version')
+
+    def put_model_config(self, item: Dict[str, Any]) -> None:
+        self._connection().execute(
+            "INSERT OR REPLACE INTO model_configs (config_id, item) VALUES (?, ?)",
+            (item['config_id'], json.dumps(item))
+        )
+
+    def delete_model_config(self, config_id: str) -> None:
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM model_configs WHERE config_id = ?", (config_id,))
+            self._bump_meta(conn)
+
+    def set_default_model_config(self, config_id: Optional[str], only_if: Optional[str] = None) -> None:
+        with self._transaction() as conn:
+            if only_if is None or self._get_meta(conn).get('default_config_id') == only_if:
+                self._bump_meta(conn, default_config_id=config_id or '')
+            else:
+                self._bump_meta(conn)
+
+    def bump_model_config_version(self) -> None:
+        with self._transaction() as conn:
+            self._bump_meta(conn)
@@ -0,0 +1,321 @@
+"""
+Resumable completion streams.
+
+A completion runs as a background task that checkpoints each encoded SSE
+frame to a stream store, keyed by a generation ID. Clients read from the
+store rather than from the model, so a client that drops can reconnect with
+Last-Event-ID, replay the frames it missed and follow the rest of the live
+stream without a new model call.
+
+Frames are kept in the memory of the process running the generation, so
+a client can only resume if its reconnect reaches that process. That
+always holds for a single uvicorn process, but on Lambda a reconnect
+usually reaches another instance and gets a 404. Set a durable StreamStore
+with set_store() to resume across instances; none is provided yet.
+
+Running generations are registered so they can be cancelled, either
+explicitly or once no client has followed them for a grace period.
+"""
+import asyncio
+import logging
+import os
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import AsyncGenerator, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import sse
+
+logger = logging.getLogger(__name__)
+
+# Seconds a finished stream stays available for replay
+STREAM_BUFFER_TTL = float(os.environ.get('STREAM_BUFFER_TTL', '300'))
+
+# Seconds between reads while following a stream with no new frames
+STREAM_POLL_INTERVAL = 0.25
+
+# Seconds a generation keeps running with no client following it, to give
+# a dropped client time to resume (0 cancels on disconnect)
+STREAM_DISCONNECT_GRACE = float(os.environ.get('STREAM_DISCONNECT_GRACE', '15'))
+
+# Seconds between checks for a cancel requested through another instance
+# (0 only honours cancels that reach this process; see cancel_when)
+GENERATION_CANCEL_POLL_INTERVAL = float(os.environ.get('GENERATION_CANCEL_POLL_INTERVAL', '1'))
+
+# Generations running in this process, by generation ID
+_running: Dict[str, Tuple['Generation', asyncio.Task]] = {}
+
+
+# ============================================
+# Stores
+# ============================================
+
+class StreamStore(ABC):
+    """
+    Storage for checkpointed stream frames.
+
+    Frames are appended in event ID order. Subclasses only need append, read,
+    close and exists; wait falls back to polling.
+    """
+
+    @abstractmethod
+    async def append(self, generation_id: str, event_id: int, frame: str) -> None:
+        ...
+
+    @abstractmethod
+    async def read(self, generation_id: str, after_id: int = 0) -> Tuple[List[Tuple[int, str]], bool]:
+        """Get the frames after an event ID, and whether the stream is closed."""
+
+    @abstractmethod
+    async def close(self, generation_id: str) -> None:
+        ...
+
+    @abstractmethod
+    async def exists(self, generation_id: str) -> bool:
+        ...
+
+    async def wait(self, generation_id: str, after_id: int, timeout: float) -> None:
+        """Wait until frames after after_id may be available."""
+        await asyncio.sleep(timeout)
+
+
+class _Stream:
+    def __init__(self):
+        self.frames: List[Tuple[int, str]] = []
+        self.closed = False
+        self.updated_at = time.monotonic()
+        self.changed = asyncio.Event()
+
+    def notify(self) -> None:
+        self.updated_at = time.monotonic()
+        # Wake current waiters; later waiters get a fresh event
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+
+class MemoryStreamStore(StreamStore):
+    """In-process stream store. Finished streams expire after ttl seconds."""
+
+    def __init__(self, ttl: float = STREAM_BUFFER_TTL):
+        self.ttl = ttl
+        self._streams: Dict[str, _Stream] = {}
+
+    def _expire(self) -> None:
+        cutoff = time.monotonic() - self.ttl
+        for generation_id in [
+            gid for gid, s in self._streams.items() if s.closed and s.updated_at < cutoff
+        ]:
+            del self._streams[generation_id]
+
+    async def append(self, generation_id: str, event_id: int, frame: str) -> None:
+        stream = self._streams.get(generation_id)
+        if stream is None:
+            self._expire()
+            stream = self._streams[generation_id] = _Stream()
+        stream.frames.append((event_id, frame))
+        stream.notify()
+
+    async def read(self, generation_id: str, after_id: int = 0) -> Tuple[List[Tuple[int, str]], bool]:
+        stream = self._streams.get(generation_id)
+        if stream is None:
+            return [], True
+        return [f for f in stream.frames if f[0] > after_id], stream.closed
+
+    async def close(self, generation_id: str) -> None:
+        stream = self._streams.get(generation_id)
+        if stream is not None:
+            stream.closed = True
+            stream.notify()
+
+    async def exists(self, generation_id: str) -> bool:
+        return generation_id in self._streams
+
+    async def wait(self, generation_id: str, after_id: int, timeout: float) -> None:
+        stream = self._streams.get(generation_id)
+        if stream is None or stream.closed:
+            return
+        if stream.frames and stream.frames[-1][0] > after_id:
+            return
+        try:
+            await asyncio.wait_for(stream.changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+_store: StreamStore = MemoryStreamStore()
+
+
+def get_store() -> StreamStore:
+    return _store
+
+
+def set_store(store: StreamStore) -> None:
+    """Use a different stream store, e.g. a durable one shared by instances."""
+    global _store
+    _store = store
+
+
+# ============================================
+# Producing and following streams
+# ============================================
+
+class Generation:
+    """Writer for one generation's stream."""
+
+    def __init__(self, generation_id: Optional[str] = None):
+        self.generation_id = generation_id or str(uuid.uuid4())
+        self.events = sse.EventEncoder()
+        self.store = get_store()
+        self.closed = False
+        self.followers = 0
+        self._cancelled = asyncio.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self) -> None:
+        """Ask the producer to stop; see until_cancelled."""
+        self._cancelled.set()
+
+    async def cancel_when(self, requested: Callable[[], Awaitable[bool]]) -> None:
+        """
+        Poll a shared cancel flag and cancel the generation once it is set.
+
+        A cancel request can reach an instance other than the one running the
+        generation; that instance records it in storage for this one to find.
+        Run as a task for the length of the generation and cancel it after.
+        """
+        if GENERATION_CANCEL_POLL_INTERVAL <= 0:
+            return
+        while not self.cancelled:
+            await asyncio.sleep(GENERATION_CANCEL_POLL_INTERVAL)
+            try:
+                if await requested():
+                    logger.info("Cancelling generation %s on request", self.generation_id)
+                    self.cancel()
+            except Exception:
+                # A failed check only delays the cancel until the next one
+                logger.warning("Cancel check for generation %s failed", self.generation_id, exc_info=True)
+
+    async def emit(self, event: str, data) -> None:
+        """Encode an event and checkpoint it to the store."""
+        frame = self.events.encode(event, data)
+        await self.store.append(self.generation_id, self.events.last_id, frame)
+
+    async def close(self) -> None:
+        """Mark the stream finished, ending every follower."""
+        if not self.closed:
+            self.closed = True
+            await self.store.close(self.generation_id)
+
+    async def until_cancelled(self, chunks: AsyncIterator) -> AsyncGenerator:
+        """
+        Iterate chunks until the generation is cancelled.
+
+        A read in progress is cancelled too, and the source is closed, so a
+        model stream stops without waiting for its next chunk.
+        """
+        iterator = chunks.__aiter__()
+        cancelled = asyncio.ensure_future(self._cancelled.wait())
+        try:
+            while not self.cancelled:
+                pending = asyncio.ensure_future(iterator.__anext__())
+                await asyncio.wait({pending, cancelled}, return_when=asyncio.FIRST_COMPLETED)
+
+                if not pending.done():
+                    pending.cancel()
+                    await asyncio.wait({pending})
+                    # A source may finish the read with what it had buffered
+                    # (see sse.coalesce)
+                    if not pending.cancelled() and pending.exception() is None:
+                        yield pending.result()
+                    return
+
+                try:
+                    chunk = pending.result()
+                except StopAsyncIteration:
+                    return
+                yield chunk
+        finally:
+            cancelled.cancel()
+            if hasattr(iterator, 'aclose'):
+                await iterator.aclose()
+
+    def _attach(self) -> None:
+        self.followers += 1
+
+    def _detach(self) -> None:
+        self.followers -= 1
+        if self.followers == 0 and not self.closed:
+            asyncio.get_running_loop().call_later(STREAM_DISCONNECT_GRACE, self._cancel_if_abandoned)
+
+    def _cancel_if_abandoned(self) -> None:
+        if self.followers == 0 and not self.closed:
+            logger.info("Cancelling generation %s with no clients", self.generation_id)
+            self.cancel()
+
+
+def start(generation: Generation, producer: Awaitable[None]) -> asyncio.Task:
+    """
+    Run a producer in the background, independent of any client connection.
+
+    The generation is closed when the producer returns or fails; a failure
+    is logged and reported to followers as an error event.
+    """
+    async def run():
+        try:
+            await producer
+        except Exception:
+            logger.exception("Generation %s failed", generation.generation_id)
+            if not generation.closed:
+                await generation.emit(sse.ERROR, {'message': 'Generation failed'})
+        finally:
+            await generation.close()
+
+    task = asyncio.get_running_loop().create_task(run())
+    _running[generation.generation_id] = (generation, task)
+    task.add_done_callback(lambda _: _running.pop(generation.generation_id, None))
+    return task
+
+
+def cancel(generation_id: str) -> bool:
+    """Cancel a generation running in this process. Returns whether it was found."""
+    entry = _running.get(generation_id)
+    if entry is None or entry[0].closed:
+        return False
+    entry[0].cancel()
+    return True
+
+
+async def exists(generation_id: str) -> bool:
+    return await get_store().exists(generation_id)
+
+
+async def follow(generation_id: str, after_id: int = 0) -> AsyncGenerator[str, None]:
+    """Replay a stream's frames after an event ID, then follow it until it closes."""
+    store = get_store()
+    entry = _running.get(generation_id)
+    generation = entry[0] if entry else None
+    if generation:
+        generation._attach()
+    try:
+        while True:
+            frames, closed = await store.read(generation_id, after_id)
+            for event_id, frame in frames:
+                after_id = event_id
+                yield frame
+            if closed:
+                return
+            await store.wait(generation_id, after_id, STREAM_POLL_INTERVAL)
+    finally:
+        # A client that disconnects leaves the generation running for the
+        # grace period, in case it resumes
+        if generation:
+            generation._detach()
+
+
+async def flush(timeout: Optional[float] = None) -> None:
+    """Wait for all running generations."""
+    if _running:
+        await asyncio.wait({task for _, task in _running.values()}, timeout=timeout)
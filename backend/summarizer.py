@@ -0,0 +1,124 @@
+"""
+Rolling summarization of long chats.
+
+Once the unsummarized part of a chat's history grows past a threshold, its
+older turns are folded into a running summary with a cheap model. The
+summary is stored on the chat item and sent in place of those turns. Each
+compaction only processes turns added since the previous summary.
+"""
+import asyncio
+import logging
+import os
+from typing import Dict, List, Optional, Tuple, Any
+
+import bedrock_client as bedrock
+import database_async as db
+from context_window import estimate_message_tokens
+
+logger = logging.getLogger(__name__)
+
+# Cheap model used to write summaries
+SUMMARY_MODEL_ID = os.environ.get('SUMMARY_MODEL_ID', 'us.anthropic.claude-3-5-haiku-20241022-v1:0')
+
+# Compact once the unsummarized history exceeds this many tokens
+COMPACT_THRESHOLD_TOKENS = int(os.environ.get('COMPACT_THRESHOLD_TOKENS', '12000'))
+
+# Newest messages always kept verbatim
+KEEP_RECENT_MESSAGES = int(os.environ.get('COMPACT_KEEP_RECENT', '6'))
+
+# Upper bound on the turns folded in by a single compaction
+SUMMARY_INPUT_BUDGET_TOKENS = 50000
+
+SUMMARY_MAX_TOKENS = 1024
+
+SUMMARY_SYSTEM_PROMPT = """You maintain a running summary of a conversation between a user and an AI assistant.
+Merge the new turns into the existing summary. Keep facts, decisions, code names, open questions and anything the user asked to remember.
+Drop pleasantries and repetition. Write compact prose or bullet points, at most about 400 words.
+Respond with ONLY the updated summary."""
+
+
+def needs_compaction(messages: List[Dict[str, Any]]) -> bool:
+    """Check whether the unsummarized history is long enough to compact."""
+    if len(messages) <= KEEP_RECENT_MESSAGES:
+        return False
+    return sum(estimate_message_tokens(m) for m in messages) > COMPACT_THRESHOLD_TOKENS
+
+
+def select_turns_to_fold(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Pick the oldest unsummarized turns to fold into the summary.
+
+    The newest KEEP_RECENT_MESSAGES are kept, the kept part starts with a
+    user turn, and a single compaction folds at most
+    SUMMARY_INPUT_BUDGET_TOKENS worth of turns.
+    """
+    cut = len(messages) - KEEP_RECENT_MESSAGES
+    while cut > 0 and messages[cut]['role'] != 'user':
+        cut -= 1
+
+    used = 0
+    for index in range(cut):
+        used += estimate_message_tokens(messages[index])
+        if used > SUMMARY_INPUT_BUDGET_TOKENS and index > 0:
+            return messages[:index]
+
+    return messages[:cut]
+
+
+def summarize(previous_summary: Optional[str], messages: List[Dict[str, Any]]) -> str:
+    """Fold new turns into the previous summary with the summary model."""
+    transcript = "\n\n".join(f"{m['role'].upper()}: {m['content']}" for m in messages)
+
+    prompt = f"""Existing summary:
+{previous_summary or '(none yet)'}
+
+New turns:
+{transcript}"""
+
+    summary = bedrock.invoke_model(
+        messages=[{'role': 'user', 'content': prompt}],
+        model_id=SUMMARY_MODEL_ID,
+        max_tokens=SUMMARY_MAX_TOKENS,
+        temperature=0.2,
+        system_prompt=SUMMARY_SYSTEM_PROMPT,
+        raise_on_error=True
+    )
+    return summary.strip()
+
+
+async def compact_chat(
+    user_id: str,
+    chat_id: str,
+    previous_summary: Optional[str],
+    previous_through: Optional[str],
+    messages: List[Dict[str, Any]]
+) -> Tuple[bool, Optional[str]]:
+    """
+    Fold the older unsummarized turns of a chat into its stored summary.
+
+    Args:
+        previous_summary: The chat's current summary, if any
+        previous_through: Message ID the current summary ends at
+        messages: Messages after previous_through, in chronological order
+
+    Returns:
+        Whether a new summary was stored, and the new summary
+    """
+    to_fold = select_turns_to_fold(messages)
+    if not to_fold:
+        return False, None
+
+    try:
+        summary = await asyncio.to_thread(summarize, previous_summary, to_fold)
+    except Exception:
+        logger.exception("Failed to summarize chat %s", chat_id)
+        return False, None
+
+    stored = await db.update_chat_summary(
+        user_id,
+        chat_id,
+        summary,
+        to_fold[-1]['message_id'],
+        previous_through=previous_through
+    )
+    return stored, summary
@@ -0,0 +1,241 @@
+import io
+import json
+import threading
+import time
+
+import pytest
+from botocore.exceptions import ClientError
+
+import bedrock_client
+from bedrock_client import BedrockBusyError, BedrockScheduler, TokenBucket
+
+
+def client_error(code: str) -> ClientError:
+    return ClientError({'Error': {'Code': code, 'Message': code}}, 'InvokeModel')
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeClient:
+    """Bedrock runtime stand-in that raises the queued errors, then answers."""
+
+    def __init__(self, errors=(), hold: threading.Event = None):
+        self.errors = list(errors)
+        self.hold = hold
+        self.calls = 0
+        self.in_flight = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def invoke_model(self, **kwargs):
+        with self.lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        try:
+            if self.hold is not None:
+                self.hold.wait(5)
+            if self.errors:
+                raise self.errors.pop(0)
+            return {'body': io.BytesIO(json.dumps({'content': [{'text': 'ok'}]}).encode())}
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def invoke_model_with_response_stream(self, **kwargs):
+        with self.lock:
+            self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return {'body': FakeEventStream()}
+
+
+class FakeEventStream:
+    def __init__(self, fail_after: int = None):
+        self.fail_after = fail_after
+
+    def __iter__(self):
+        for i, event_type in enumerate(('message_start', 'message_stop')):
+            if i == self.fail_after:
+                raise client_error('ThrottlingException')
+            yield {'chunk': {'bytes': json.dumps({'type': event_type}).encode()}}
+
+    def close(self):
+        pass
+
+
+# ============================================
+# TokenBucket
+# ============================================
+
+def test_bucket_allows_burst_then_waits_for_refill():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, burst=2, clock=clock)
+
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    # Empty: the next token arrives after 1 / rate seconds
+    assert bucket.reserve() == pytest.approx(0.5)
+
+    clock.now += 1.0
+    # Refilled by 2 tokens, one of which paid back the reservation
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.5)
+
+
+def test_bucket_refill_is_capped_at_burst():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=10, burst=3, clock=clock)
+    clock.now += 60
+    for _ in range(3):
+        assert bucket.reserve() == 0
+    assert bucket.reserve() > 0
+
+
+def test_bucket_backs_off_on_throttle_and_recovers():
+    bucket = TokenBucket(rate=10, burst=1, clock=FakeClock())
+
+    bucket.on_throttle()
+    assert bucket.rate == 5
+    for _ in range(10):
+        bucket.on_throttle()
+    assert bucket.rate == pytest.approx(10 * bedrock_client.MIN_RATE_FRACTION)
+
+    bucket.on_success()
+    assert bucket.rate == pytest.approx(1.5)
+    for _ in range(100):
+        bucket.on_success()
+    assert bucket.rate == 10
+
+
+def test_bucket_with_zero_rate_is_unlimited():
+    bucket = TokenBucket(rate=0, burst=1, clock=FakeClock())
+    assert all(bucket.reserve() == 0 for _ in range(100))
+
+
+# ============================================
+# BedrockScheduler
+# ============================================
+
+def make_scheduler(client, **kwargs) -> BedrockScheduler:
+    options = {'rate': 0, 'burst': 1, 'max_attempts': 4, 'queue_timeout': 5, 'sleep': lambda _: None}
+    options.update(kwargs)
+    return BedrockScheduler(client=client, **options)
+
+
+def test_concurrency_is_limited_per_model():
+    hold = threading.Event()
+    client = FakeClient(hold=hold)
+    scheduler = make_scheduler(client, max_concurrency=2)
+
+    threads = [threading.Thread(target=scheduler.invoke, args=('model-a', {})) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    assert client.in_flight == 2
+
+    hold.set()
+    for thread in threads:
+        thread.join(5)
+    assert client.calls == 5
+    assert client.peak == 2
+    assert scheduler.stats()['model-a']['in_flight'] == 0
+
+
+def test_busy_model_times_out_in_queue():
+    hold = threading.Event()
+    scheduler = make_scheduler(FakeClient(hold=hold), max_concurrency=1, queue_timeout=0.05)
+    holder = threading.Thread(target=scheduler.invoke, args=('model-a', {}))
+    holder.start()
+    time.sleep(0.02)
+    try:
+        with pytest.raises(BedrockBusyError):
+            scheduler.invoke('model-a', {})
+    finally:
+        hold.set()
+        holder.join(5)
+
+
+def test_rate_limit_waits_for_a_token():
+    clock = FakeClock()
+    sleeps = []
+    scheduler = make_scheduler(FakeClient(), rate=2, burst=1, sleep=sleeps.append, clock=clock)
+
+    scheduler.invoke('model-a', {})
+    scheduler.invoke('model-a', {})
+    assert sleeps == [pytest.approx(0.5)]
+
+
+def test_throttles_are_retried_with_jittered_backoff(monkeypatch):
+    bounds = []
+
+    def uniform(low, high):
+        bounds.append((low, high))
+        return high / 2
+
+    monkeypatch.setattr(bedrock_client.random, 'uniform', uniform)
+    sleeps = []
+    client = FakeClient(errors=[client_error('ThrottlingException')] * 2)
+    scheduler = make_scheduler(client, rate=10, burst=10, sleep=sleeps.append, clock=FakeClock())
+
+    assert scheduler.invoke('model-a', {}) == {'content': [{'text': 'ok'}]}
+    assert client.calls == 3
+    # Full jitter over an exponentially growing window
+    base = bedrock_client.RETRY_BASE_DELAY
+    assert bounds == [(0, base), (0, base * 2)]
+    assert sleeps == [base / 2, base]
+
+    stats = scheduler.stats()['model-a']
+    assert stats['throttles'] == 2
+    assert stats['retries'] == 2
+    # Halved twice, then recovered a step on success
+    assert stats['rate'] == pytest.approx(10 / 4 + 0.5)
+
+
+def test_retries_stop_at_max_attempts():
+    sleeps = []
+    client = FakeClient(errors=[client_error('ThrottlingException')] * 10)
+    scheduler = make_scheduler(client, max_attempts=3, sleep=sleeps.append)
+
+    with pytest.raises(ClientError):
+        scheduler.invoke('model-a', {})
+    assert client.calls == 3
+    assert len(sleeps) == 2
+    assert all(0 <= delay <= bedrock_client.RETRY_MAX_DELAY for delay in sleeps)
+    assert scheduler.stats()['model-a']['errors'] == 1
+
+
+def test_non_retryable_errors_are_not_retried():
+    client = FakeClient(errors=[client_error('ValidationException')])
+    scheduler = make_scheduler(client)
+
+    with pytest.raises(ClientError):
+        scheduler.invoke('model-a', {})
+    assert client.calls == 1
+
+
+def test_stream_is_retried_before_its_first_event():
+    client = FakeClient(errors=[client_error('ServiceUnavailableException')])
+    scheduler = make_scheduler(client)
+
+    events = [chunk['type'] for chunk in scheduler.stream('model-a', {})]
+    assert events == ['message_start', 'message_stop']
+    assert client.calls == 2
+
+
+def test_stream_is_not_retried_after_its_first_event():
+    client = FakeClient()
+    client.invoke_model_with_response_stream = lambda **kwargs: {'body': FakeEventStream(fail_after=1)}
+    scheduler = make_scheduler(client)
+
+    events = []
+    with pytest.raises(ClientError):
+        for chunk in scheduler.stream('model-a', {}):
+            events.append(chunk['type'])
+    assert events == ['message_start']
@@ -0,0 +1,88 @@
+import bedrock_client
+import context_window
+from context_window import (
+    MESSAGE_OVERHEAD_TOKENS,
+    SAFETY_MARGIN_TOKENS,
+    estimate_message_tokens,
+    fit_conversation,
+    get_chain_budget,
+    get_history_budget,
+)
+
+
+def message(role: str, tokens: int) -> dict:
+    """A message estimated at the given number of tokens, overhead included."""
+    chars = int((tokens - MESSAGE_OVERHEAD_TOKENS) * context_window.CHARS_PER_TOKEN)
+    return {'role': role, 'content': 'x' * chars}
+
+
+def turns(count: int, tokens: int) -> list:
+    return [message('user' if i % 2 == 0 else 'assistant', tokens) for i in range(count)]
+
+
+def total_tokens(messages: list) -> int:
+    return sum(estimate_message_tokens(msg) for msg in messages)
+
+
+def test_everything_is_kept_within_budget():
+    conversation = turns(5, 100)
+    kept, dropped = fit_conversation(conversation, 1000)
+    assert kept == conversation
+    assert dropped == 0
+
+
+def test_oldest_turns_are_dropped_first():
+    conversation = turns(9, 100)
+    kept, dropped = fit_conversation(conversation, 350)
+
+    assert kept == conversation[dropped:]
+    assert kept[-1] is conversation[-1]
+    assert total_tokens(kept) <= 350
+    # Adding back the next older message would not fit
+    assert total_tokens(conversation[dropped - 1:]) > 350
+
+
+def test_kept_history_starts_with_a_user_turn():
+    conversation = turns(9, 100)
+    # Room for 4 messages, which would start with an assistant turn
+    kept, dropped = fit_conversation(conversation, 400)
+    assert kept[0]['role'] == 'user'
+    assert len(kept) == 3
+    assert dropped == 6
+
+
+def test_single_message_over_budget_is_kept_alone():
+    conversation = turns(4, 100) + [message('user', 5000)]
+    kept, dropped = fit_conversation(conversation, 1000)
+    assert kept == [conversation[-1]]
+    assert dropped == 4
+
+
+def test_packed_messages_are_measured_by_content_length():
+    packed = {'role': 'user', 'content_length': 350}
+    assert estimate_message_tokens(packed) == 100 + MESSAGE_OVERHEAD_TOKENS
+
+
+def test_budget_leaves_room_for_system_prompt_and_summary():
+    config = {'context_window': 10000, 'max_tokens': 1000}
+    bare = get_history_budget(config, '')
+    assert bare == 10000 - 1000 - SAFETY_MARGIN_TOKENS
+
+    summary = 'y' * 3500
+    system = bedrock_client.build_system_prompt([], summary=summary)
+    assert get_history_budget(config, system) <= bare - 1000
+
+
+def test_chain_budget_is_the_smallest_in_the_chain():
+    chain = [
+        {'context_window': 200000, 'max_tokens': 4096},
+        {'context_window': 8000, 'max_tokens': 1000},
+        {'max_tokens': 4096},
+    ]
+    system = 'You are a helpful AI assistant.'
+    budget = get_chain_budget(chain, system)
+    assert budget == get_history_budget(chain[1], system)
+
+    conversation = turns(40, 500)
+    kept, _ = fit_conversation(conversation, budget)
+    assert total_tokens(kept) <= get_history_budget(chain[1], system)
@@ -0,0 +1,138 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import database as db
+import main
+import storage
+from storage import decode_cursor, encode_cursor
+from storage_sqlite import SQLiteStorage
+
+MESSAGE_FIELDS = ('chat_id', 'created_at', 'message_id')
+
+
+@pytest.fixture
+def sqlite_storage(tmp_path):
+    backend = SQLiteStorage(str(tmp_path / 'chatbot.db'))
+    storage.set_storage(backend)
+    yield backend
+    storage.set_storage(None)
+
+
+def add_messages(chat_id: str, created_at: list) -> list:
+    messages = []
+    for i, timestamp in enumerate(created_at):
+        item = db.build_message_item(chat_id, 'user' if i % 2 == 0 else 'assistant', f'message {i}')
+        item['created_at'] = timestamp
+        messages.append(item)
+    assert db.save_exchange(main.DEFAULT_USER_ID, chat_id, messages)
+    return messages
+
+
+# ============================================
+# decode_cursor
+# ============================================
+
+def test_cursor_round_trip():
+    key = {'chat_id': 'c1', 'created_at': '2024-01-01T00:00:00', 'message_id': 'm1'}
+    assert decode_cursor(encode_cursor(key), MESSAGE_FIELDS, expected={'chat_id': 'c1'}) == key
+
+
+@pytest.mark.parametrize('cursor', [
+    'not a cursor',
+    '!!!!',
+    encode_cursor(['c1', '2024-01-01', 'm1'])[:-2],
+    'bm90IGpzb24',  # "not json"
+    encode_cursor(['c1', '2024-01-01', 'm1']),
+])
+def test_malformed_cursor_is_rejected(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor, MESSAGE_FIELDS)
+
+
+@pytest.mark.parametrize('key', [
+    {'chat_id': 'c1', 'created_at': '2024-01-01'},
+    {'chat_id': 'c1', 'created_at': '2024-01-01', 'message_id': 'm1', 'extra': 'x'},
+    {'chat_id': 'c1', 'created_at': 0, 'message_id': 'm1'},
+    {'chat_id': 'c1', 'created_at': {'$gt': ''}, 'message_id': 'm1'},
+])
+def test_tampered_cursor_is_rejected(key):
+    with pytest.raises(ValueError):
+        decode_cursor(encode_cursor(key), MESSAGE_FIELDS)
+
+
+def test_cursor_for_another_chat_is_rejected():
+    cursor = encode_cursor({'chat_id': 'c2', 'created_at': '2024-01-01', 'message_id': 'm1'})
+    with pytest.raises(ValueError):
+        decode_cursor(cursor, MESSAGE_FIELDS, expected={'chat_id': 'c1'})
+
+
+# ============================================
+# Endpoints
+# ============================================
+
+def test_message_cursor_from_another_chat_is_a_400(sqlite_storage):
+    chat = db.create_chat(main.DEFAULT_USER_ID)
+    other = db.create_chat(main.DEFAULT_USER_ID)
+    add_messages(other['chat_id'], ['2024-01-01T00:00:00'] * 3)
+    _, cursor = db.get_messages_page(other['chat_id'], limit=1)
+    assert cursor
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(main.get_chat(chat['chat_id'], limit=1, cursor=cursor))
+    assert error.value.status_code == 400
+
+
+@pytest.mark.parametrize('cursor', ['garbage', encode_cursor({'chat_id': 'x'})])
+def test_malformed_message_cursor_is_a_400(sqlite_storage, cursor):
+    chat = db.create_chat(main.DEFAULT_USER_ID)
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(main.get_chat(chat['chat_id'], limit=1, cursor=cursor))
+    assert error.value.status_code == 400
+
+
+def test_chat_cursor_from_another_user_is_a_400(sqlite_storage):
+    cursor = encode_cursor({'user_id': 'someone-else', 'updated_at': '2024-01-01', 'chat_id': 'c1'})
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(main.list_chats(limit=1, cursor=cursor))
+    assert error.value.status_code == 400
+
+
+# ============================================
+# SQLite pagination
+# ============================================
+
+def test_message_pages_with_equal_timestamps(sqlite_storage):
+    chat_id = db.create_chat(main.DEFAULT_USER_ID)['chat_id']
+    created_at = ['2024-01-01T00:00:00'] * 2 + ['2024-01-01T00:00:01'] * 7 + ['2024-01-01T00:00:02']
+    add_messages(chat_id, created_at)
+    expected = sorted(db.get_messages(chat_id), key=lambda msg: (msg['created_at'], msg['message_id']))
+
+    pages = []
+    cursor = None
+    while True:
+        page, cursor = db.get_messages_page(chat_id, limit=3, cursor=cursor)
+        pages.append(page)
+        if cursor is None:
+            break
+
+    # Newest page first; each page is in chronological order
+    seen = [msg['message_id'] for page in reversed(pages) for msg in page]
+    assert seen == [msg['message_id'] for msg in expected]
+    assert [len(page) for page in pages] == [3, 3, 3, 1]
+
+
+def test_chat_pages_with_equal_timestamps(sqlite_storage):
+    chat_ids = {db.create_chat(main.DEFAULT_USER_ID)['chat_id'] for _ in range(5)}
+    sqlite_storage._connection().execute("UPDATE chats SET updated_at = '2024-01-01T00:00:00'")
+
+    seen = []
+    cursor = None
+    while True:
+        page, cursor = db.get_chats_page(main.DEFAULT_USER_ID, limit=2, cursor=cursor)
+        seen.extend(chat['chat_id'] for chat in page)
+        if cursor is None:
+            break
+    assert sorted(seen) == sorted(chat_ids)
+    assert len(seen) == len(chat_ids)
@@ -0,0 +1,94 @@
+import asyncio
+import time
+
+import sse
+import stream_buffer
+
+
+async def deltas(texts, delay: float = 0.0, then_wait: float = 0.0):
+    for text in texts:
+        yield text
+        await asyncio.sleep(delay)
+    await asyncio.sleep(then_wait)
+
+
+async def collect(chunks):
+    return [chunk async for chunk in chunks]
+
+
+def test_fast_deltas_are_merged():
+    chunks = asyncio.run(collect(sse.coalesce(deltas(['a', 'b', 'c']), max_delay_ms=50)))
+    assert chunks == ['abc']
+
+
+def test_buffer_is_flushed_at_max_bytes():
+    chunks = asyncio.run(collect(sse.coalesce(deltas(['ab', 'cd', 'ef', 'g']), max_delay_ms=1000, max_bytes=4)))
+    assert chunks == ['abcd', 'efg']
+
+
+def test_buffer_is_flushed_after_max_delay():
+    async def run():
+        started = time.monotonic()
+        times = []
+        async for chunk in sse.coalesce(deltas(['a', 'b'], delay=0.01, then_wait=0.5), max_delay_ms=50):
+            times.append((chunk, time.monotonic() - started))
+        return times
+
+    (chunk, elapsed), = asyncio.run(run())
+    assert chunk == 'ab'
+    # Sent once the first delta has waited max_delay_ms, not when the
+    # source stalls or ends
+    assert 0.04 <= elapsed < 0.3
+
+
+def test_zero_delay_passes_deltas_through():
+    chunks = asyncio.run(collect(sse.coalesce(deltas(['a', 'b', 'c']), max_delay_ms=0)))
+    assert chunks == ['a', 'b', 'c']
+
+
+def test_buffered_text_is_flushed_on_cancel():
+    async def run():
+        generation = stream_buffer.Generation()
+        stalled = asyncio.Event()
+        received = []
+
+        async def source():
+            for i in range(3):
+                yield f'{i} '
+            # The model goes quiet with the deltas still buffered
+            stalled.set()
+            await asyncio.Event().wait()
+
+        async def consume():
+            chunks = sse.coalesce(source(), max_delay_ms=10000, max_bytes=10**6)
+            async for chunk in generation.until_cancelled(chunks):
+                received.append(chunk)
+
+        task = asyncio.create_task(consume())
+        await asyncio.wait_for(stalled.wait(), 1)
+        generation.cancel()
+        await asyncio.wait_for(task, 1)
+        return received
+
+    # Nothing was due to be sent before the cancel; the held-back deltas
+    # are returned instead of dropped
+    assert asyncio.run(run()) == ['0 1 2 ']
+
+
+def test_cancel_with_empty_buffer_ends_the_stream():
+    async def run():
+        generation = stream_buffer.Generation()
+        received = []
+
+        async def consume():
+            source = deltas(['a'], then_wait=10)
+            async for chunk in generation.until_cancelled(sse.coalesce(source, max_delay_ms=10)):
+                received.append(chunk)
+
+        task = asyncio.create_task(consume())
+        await asyncio.sleep(0.05)
+        generation.cancel()
+        await asyncio.wait_for(task, 1)
+        return received
+
+    assert asyncio.run(run()) == ['a']
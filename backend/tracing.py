@@ -0,0 +1,270 @@
+"""
+Lightweight request tracing and metrics.
+
+With TRACING_ENABLED set, every request gets a trace that collects spans
+for its DynamoDB calls (recorded by botocore event hooks, with consumed
+capacity), its Bedrock calls (queue wait, time to first token, tokens per
+second) and the handler as a whole. A finished trace is:
+
+- summarized in a Server-Timing header. Headers go out before a streamed
+  body, so a completion's header covers the work done before streaming
+  started; its full trace is in the log line.
+- logged as one structured JSON line
+
+With METRICS_ENABLED set, spans are also added to in-process counters,
+served in Prometheus text format at /api/metrics. This is meant for a
+long-running server such as uvicorn; each Lambda instance would only
+report its own counts.
+
+With both disabled nothing is registered and span() is a no-op.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+TRACING_ENABLED = os.environ.get('TRACING_ENABLED', 'false').lower() == 'true'
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'false').lower() == 'true'
+
+ENABLED = TRACING_ENABLED or METRICS_ENABLED
+
+
+class Trace:
+    """Spans recorded while handling one request. Safe to add to from threads."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans: List[Tuple[str, float, Dict[str, Any]]] = []
+        self._lock = threading.Lock()
+
+    def add(self, name: str, duration_ms: float, attrs: Dict[str, Any]) -> None:
+        with self._lock:
+            self.spans.append((name, duration_ms, attrs))
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def summary(self) -> Dict[str, Tuple[int, float]]:
+        """Get the number of spans and their total duration by name."""
+        totals: Dict[str, Tuple[int, float]] = {}
+        with self._lock:
+            spans = list(self.spans)
+        for name, duration_ms, _ in spans:
+            count, total = totals.get(name, (0, 0.0))
+            totals[name] = (count + 1, total + duration_ms)
+        return totals
+
+    def server_timing(self) -> str:
+        """Format the spans so far, and the elapsed time, as a Server-Timing value."""
+        entries = [
+            f'{name};dur={total:.1f};desc="{count} calls"'
+            for name, (count, total) in self.summary().items()
+        ]
+        entries.append(f'app;dur={self.elapsed_ms():.1f}')
+        return ', '.join(entries)
+
+
+_current: ContextVar[Optional[Trace]] = ContextVar('trace', default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+def record(name: str, duration_ms: float, **attrs) -> None:
+    """
+    Record a finished span in the current trace and the metrics.
+
+    String attributes become metric labels; numeric ones are summed into
+    counters, so averages are the sum over {name}_total.
+    """
+    if not ENABLED:
+        return
+    trace = _current.get()
+    if trace is not None:
+        trace.add(name, duration_ms, attrs)
+    if METRICS_ENABLED:
+        _metrics.observe(name, duration_ms, attrs)
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Dict[str, Any]]:
+    """
+    Time a block as a span. Attributes can be added to the yielded dict
+    before the block ends.
+    """
+    if not ENABLED:
+        yield attrs
+        return
+    started = time.perf_counter()
+    try:
+        yield attrs
+    finally:
+        record(name, (time.perf_counter() - started) * 1000, **attrs)
+
+
+# ============================================
+# Metrics
+# ============================================
+
+class _Metrics:
+    def __init__(self):
+        self._values: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, metric: str, labels: Dict[str, str], value: float = 1) -> None:
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def observe(self, name: str, duration_ms: float, attrs: Dict[str, Any]) -> None:
+        labels = {k: str(v) for k, v in attrs.items() if isinstance(v, str)}
+        self.inc(f'{name}_total', labels)
+        self.inc(f'{name}_duration_seconds_total', labels, duration_ms / 1000)
+        for key, value in attrs.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                self.inc(f'{name}_{key}_total', labels, value)
+
+    def render(self) -> str:
+        with self._lock:
+            values = sorted(self._values.items())
+
+        lines = []
+        last_metric = None
+        for (metric, labels), value in values:
+            if metric != last_metric:
+                lines.append(f'# TYPE {metric} counter')
+                last_metric = metric
+            label_text = ','.join(f'{k}="{_escape_label(v)}"' for k, v in labels)
+            lines.append(f'{metric}{{{label_text}}} {value:g}' if label_text else f'{metric} {value:g}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+_metrics = _Metrics()
+
+
+def render_metrics() -> str:
+    """Render all metrics in Prometheus text exposition format."""
+    return _metrics.render()
+
+
+# ============================================
+# DynamoDB Instrumentation
+# ============================================
+
+def _add_consumed_capacity(params: Dict[str, Any], model, context: Dict[str, Any], **kwargs) -> None:
+    context['trace_table'] = params.get('TableName')
+    if 'ReturnConsumedCapacity' in model.input_shape.members:
+        params.setdefault('ReturnConsumedCapacity', 'TOTAL')
+
+
+def _start_call(context: Dict[str, Any], **kwargs) -> None:
+    context['trace_started'] = time.perf_counter()
+
+
+def _end_call(parsed: Dict[str, Any], model, context: Dict[str, Any], **kwargs) -> None:
+    started = context.get('trace_started')
+    if started is None:
+        return
+
+    consumed = parsed.get('ConsumedCapacity') or []
+    if isinstance(consumed, dict):
+        consumed = [consumed]
+    tables = {c['TableName'] for c in consumed if c.get('TableName')}
+    if not tables and context.get('trace_table'):
+        tables = {context['trace_table']}
+
+    record(
+        'dynamodb',
+        (time.perf_counter() - started) * 1000,
+        table=tables.pop() if len(tables) == 1 else 'multiple' if tables else 'unknown',
+        operation=model.name,
+        capacity=sum(float(c.get('CapacityUnits', 0)) for c in consumed)
+    )
+
+
+def instrument_dynamodb(client) -> None:
+    """Record a span for every call made through a DynamoDB client."""
+    if not ENABLED:
+        return
+    events = client.meta.events
+    events.register('before-parameter-build.dynamodb.*', _add_consumed_capacity)
+    events.register('before-call.dynamodb.*', _start_call)
+    events.register('after-call.dynamodb.*', _end_call)
+
+
+# ============================================
+# ASGI Middleware
+# ============================================
+
+class TracingMiddleware:
+    """
+    Traces each HTTP request. Pure ASGI, so streamed responses pass through
+    unbuffered.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace()
+        token = _current.set(trace)
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                if TRACING_ENABLED:
+                    headers = list(message.get('headers', []))
+                    headers.append((b'server-timing', trace.server_timing().encode()))
+                    message = {**message, 'headers': headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            self._finish(scope, trace, status)
+
+    def _finish(self, scope, trace: Trace, status: int) -> None:
+        duration_ms = trace.elapsed_ms()
+        # The router stores the matched endpoint in the scope; its name keeps
+        # metric labels bounded, unlike raw paths
+        endpoint = scope.get('endpoint')
+        route = getattr(endpoint, '__name__', 'unmatched')
+
+        if METRICS_ENABLED:
+            _metrics.observe('http_requests', duration_ms, {
+                'route': route,
+                'method': scope['method'],
+                'status': str(status)
+            })
+
+        if TRACING_ENABLED:
+            logger.info(json.dumps({
+                'type': 'request',
+                'method': scope['method'],
+                'path': scope['path'],
+                'route': route,
+                'status': status,
+                'duration_ms': round(duration_ms, 1),
+                'spans': {
+                    name: {'count': count, 'duration_ms': round(total, 1)}
+                    for name, (count, total) in trace.summary().items()
+                },
+            }))
@@ -0,0 +1,61 @@
+"""
+Write-behind persistence for work that shouldn't hold up a response.
+
+Writes are submitted as background tasks and retried with jittered backoff,
+so a completion can be marked done before DynamoDB has been written. The
+request that submits a write still waits for it before it ends (completions
+once the client has its final event), because on Lambda the process may be
+frozen or stopped as soon as the invocation returns. Mangum runs without
+lifespan events, so the shutdown flush() only applies under uvicorn.
+"""
+import asyncio
+import logging
+import os
+import random
+from typing import Any, Awaitable, Callable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+WRITE_BEHIND_MAX_ATTEMPTS = int(os.environ.get('WRITE_BEHIND_MAX_ATTEMPTS', '5'))
+
+# Base delay in seconds for the first retry; doubles on each attempt
+WRITE_BEHIND_RETRY_BASE = 0.1
+
+_pending: Set[asyncio.Task] = set()
+
+
+async def _run_with_retries(fn: Callable[..., Awaitable[Any]], args: tuple, kwargs: dict) -> Any:
+    for attempt in range(1, WRITE_BEHIND_MAX_ATTEMPTS + 1):
+        try:
+            return await fn(*args, **kwargs)
+        except Exception:
+            if attempt == WRITE_BEHIND_MAX_ATTEMPTS:
+                logger.exception("Write-behind %s failed after %d attempts", fn.__name__, attempt)
+                raise
+            await asyncio.sleep(random.uniform(0, WRITE_BEHIND_RETRY_BASE * 2 ** attempt))
+
+
+def _on_done(task: asyncio.Task) -> None:
+    _pending.discard(task)
+    if not task.cancelled():
+        # Mark the exception as retrieved; it was logged by _run_with_retries
+        task.exception()
+
+
+def submit(fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> asyncio.Task:
+    """Queue an async write to run in the background, with retries."""
+    task = asyncio.get_running_loop().create_task(_run_with_retries(fn, args, kwargs))
+    _pending.add(task)
+    task.add_done_callback(_on_done)
+    return task
+
+
+def pending_count() -> int:
+    """Number of writes not yet completed."""
+    return len(_pending)
+
+
+async def flush(timeout: Optional[float] = None) -> None:
+    """Wait for all pending writes. Failures have already been logged."""
+    if _pending:
+        await asyncio.wait(set(_pending), timeout=timeout)
@@ -6,6 +6,10 @@ import PatternLock from './components/PatternLock';
 import { chatApi, modelApi } from './api';
 import { Menu, X } from 'lucide-react';
 
+// Number of messages loaded per history page
+const MESSAGE_PAGE_SIZE = 50;
+const CHAT_PAGE_SIZE = 50;
+
 // Check if already authenticated (session storage)
 const isAuthenticated = () => {
     return sessionStorage.getItem('chatgpt_auth') === 'true';
@@ -14,6 +18,7 @@ const isAuthenticated = () => {
 function App() {
     const [authenticated, setAuthenticated] = useState(isAuthenticated());
     const [chats, setChats] = useState([]);
+    const [chatsCursor, setChatsCursor] = useState(null);
     const [currentChatId, setCurrentChatId] = useState(null);
     const [currentChat, setCurrentChat] = useState(null);
     const [models, setModels] = useState([]);
@@ -34,11 +39,12 @@ function App() {
             setError(null);
 
             const [chatsRes, modelsRes] = await Promise.all([
-                chatApi.list(),
+                chatApi.list({ limit: CHAT_PAGE_SIZE }),
                 modelApi.list()
             ]);
 
             setChats(chatsRes.chats || []);
+            setChatsCursor(chatsRes.next_cursor || null);
             setModels(modelsRes.models || []);
 
             // Set default model
@@ -65,7 +71,7 @@ function App() {
 
     const loadChat = async (chatId) => {
         try {
-            const chat = await chatApi.get(chatId);
+            const chat = await chatApi.get(chatId, { limit: MESSAGE_PAGE_SIZE });
             setCurrentChat(chat);
         } catch (err) {
             console.error('Failed to load chat:', err);
@@ -73,15 +79,51 @@ function App() {
         }
     };
 
+    const loadOlderMessages = async () => {
+        if (!currentChat?.next_cursor) return;
+        try {
+            const page = await chatApi.get(currentChat.chat_id, {
+                limit: MESSAGE_PAGE_SIZE,
+                cursor: currentChat.next_cursor
+            });
+            setCurrentChat(prev => {
+                if (!prev || prev.chat_id !== page.chat_id) return prev;
+                return {
+                    ...prev,
+                    messages: [...page.messages, ...(prev.messages || [])],
+                    next_cursor: page.next_cursor
+                };
+            });
+        } catch (err) {
+            console.error('Failed to load older messages:', err);
+        }
+    };
+
     const refreshChats = async () => {
         try {
-            const res = await chatApi.list();
+            const res = await chatApi.list({ limit: CHAT_PAGE_SIZE });
             setChats(res.chats || []);
+            setChatsCursor(res.next_cursor || null);
         } catch (err) {
             console.error('Failed to refresh chats:', err);
         }
     };
 
+    const loadMoreChats = async () => {
+        if (!chatsCursor) return;
+        try {
+            const res = await chatApi.list({ limit: CHAT_PAGE_SIZE, cursor: chatsCursor });
+            setChats(prev => {
+                // A chat that became active since the first page may show up again
+                const seen = new Set(prev.map(c => c.chat_id));
+                return [...prev, ...(res.chats || []).filter(c => !seen.has(c.chat_id))];
+            });
+            setChatsCursor(res.next_cursor || null);
+        } catch (err) {
+            console.error('Failed to load more chats:', err);
+        }
+    };
+
     const handleNewChat = () => {
         setCurrentChatId(null);
         setCurrentChat(null);
@@ -121,6 +163,13 @@ function App() {
     };
 
     const handleChatUpdate = useCallback((chatId, title) => {
+        if (title) {
+            // Titles can arrive mid-stream, before they are persisted,
+            // so apply them locally instead of refetching
+            setChats(prev => prev.map(c => c.chat_id === chatId ? { ...c, title } : c));
+            setCurrentChat(prev => prev && prev.chat_id === chatId ? { ...prev, title } : prev);
+            return;
+        }
         // Update chats list with new chat
         refreshChats();
         setCurrentChatId(chatId);
@@ -190,6 +239,8 @@ function App() {
       `}>
                 <Sidebar
                     chats={chats}
+                    hasMoreChats={!!chatsCursor}
+                    onLoadMoreChats={loadMoreChats}
                     currentChatId={currentChatId}
                     onNewChat={handleNewChat}
                     onSelectChat={handleSelectChat}
@@ -230,6 +281,7 @@ function App() {
                     onSelectModel={setSelectedModelId}
                     onChatUpdate={handleChatUpdate}
                     onMessageAdded={handleMessageAdded}
+                    onLoadOlder={loadOlderMessages}
                 />
             </div>
 
@@ -1,6 +1,10 @@
 // API configuration
 const API_BASE_URL = import.meta.env.VITE_API_URL || '';
 
+// Reconnect attempts when a completion stream drops mid-answer
+const STREAM_RECONNECT_ATTEMPTS = 5;
+const STREAM_RECONNECT_DELAY_MS = 500;
+
 // Helper for API calls
 async function apiCall(endpoint, options = {}) {
     const url = `${API_BASE_URL}${endpoint}`;
@@ -21,11 +25,73 @@ async function apiCall(endpoint, options = {}) {
     return response.json();
 }
 
+// Parse a server-sent event stream into { id, event, data } objects
+async function* parseEventStream(response) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let id = null;
+    let event = 'message';
+    let dataLines = [];
+
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        // Keep the trailing partial line for the next read
+        buffer = lines.pop();
+
+        for (const rawLine of lines) {
+            const line = rawLine.endsWith('\r') ? rawLine.slice(0, -1) : rawLine;
+
+            // A blank line dispatches the event
+            if (line === '') {
+                if (dataLines.length) {
+                    try {
+                        yield { id, event, data: JSON.parse(dataLines.join('\n')) };
+                    } catch (e) {
+                        console.warn('Failed to parse SSE data:', dataLines.join('\n'));
+                    }
+                }
+                event = 'message';
+                dataLines = [];
+                continue;
+            }
+            if (line.startsWith(':')) continue;
+
+            const colon = line.indexOf(':');
+            const field = colon === -1 ? line : line.slice(0, colon);
+            let fieldValue = colon === -1 ? '' : line.slice(colon + 1);
+            if (fieldValue.startsWith(' ')) fieldValue = fieldValue.slice(1);
+
+            if (field === 'data') dataLines.push(fieldValue);
+            else if (field === 'event') event = fieldValue;
+            else if (field === 'id') id = fieldValue;
+        }
+    }
+}
+
 // Chat API
 export const chatApi = {
-    list: () => apiCall('/api/chats'),
+    // Most recently active first; pass { limit, cursor } to page through
+    list: ({ limit, cursor } = {}) => {
+        const params = new URLSearchParams();
+        if (limit) params.set('limit', limit);
+        if (cursor) params.set('cursor', cursor);
+        const query = params.toString();
+        return apiCall(`/api/chats${query ? `?${query}` : ''}`);
+    },
 
-    get: (chatId) => apiCall(`/api/chats/${chatId}`),
+    // Pass { limit, cursor } to page through history, newest page first
+    get: (chatId, { limit, cursor } = {}) => {
+        const params = new URLSearchParams();
+        if (limit) params.set('limit', limit);
+        if (cursor) params.set('cursor', cursor);
+        const query = params.toString();
+        return apiCall(`/api/chats/${chatId}${query ? `?${query}` : ''}`);
+    },
 
     create: (title = 'New Chat') => apiCall('/api/chats', {
         method: 'POST',
@@ -41,11 +107,25 @@ export const chatApi = {
         method: 'DELETE',
     }),
 
+    // Pass { background: true } for large batches: the chats are hidden
+    // immediately and their messages are purged server-side
+    bulkDelete: (chatIds, { background = false } = {}) => apiCall('/api/chats/bulk-delete', {
+        method: 'POST',
+        body: JSON.stringify({ chat_ids: chatIds, background }),
+    }),
+
+    // Stop a running completion; the partial answer is kept. The chat ID
+    // lets another server instance pass the cancel on.
+    cancelGeneration: (generationId, chatId = null) => apiCall(
+        `/api/generations/${generationId}/cancel${chatId ? `?chat_id=${chatId}` : ''}`,
+        { method: 'POST' }
+    ),
+
     // Streaming chat completion
     sendMessage: async function* (content, chatId = null, modelConfigId = null) {
         const url = `${API_BASE_URL}/api/chat/completions`;
 
-        const response = await fetch(url, {
+        let response = await fetch(url, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
@@ -62,38 +142,62 @@ export const chatApi = {
             throw new Error(error.detail || `HTTP error ${response.status}`);
         }
 
-        const reader = response.body.getReader();
-        const decoder = new TextDecoder();
+        // If the connection drops, resume the generation from the last
+        // event received instead of sending the message again
+        let generationId = null;
+        let lastEventId = null;
+        let attempts = 0;
 
         while (true) {
-            const { done, value } = await reader.read();
-            if (done) break;
-
-            const chunk = decoder.decode(value, { stream: true });
-            const lines = chunk.split('\n');
+            try {
+                // Yields { id, event, data } for meta/content/title/usage events
+                for await (const message of response ? parseEventStream(response) : []) {
+                    if (message.id) lastEventId = message.id;
+                    if (message.event === 'meta') generationId = message.data.generation_id;
+                    if (message.event === 'error') throw new Error(message.data.message);
+                    if (message.event === 'done') return;
+                    attempts = 0;
+                    yield message;
+                }
+            } catch (e) {
+                // Network failures surface as TypeError; anything else is final
+                if (!generationId || e.name !== 'TypeError' || attempts >= STREAM_RECONNECT_ATTEMPTS) {
+                    throw e;
+                }
+            }
 
-            for (const line of lines) {
-                if (line.startsWith('data: ')) {
-                    const data = line.slice(6);
-                    if (data === '[DONE]') return;
+            if (!generationId || attempts >= STREAM_RECONNECT_ATTEMPTS) {
+                throw new Error('Connection lost while streaming the response');
+            }
+            attempts += 1;
+            await new Promise((resolve) => setTimeout(resolve, STREAM_RECONNECT_DELAY_MS * attempts));
+
+            try {
+                response = await fetch(`${API_BASE_URL}/api/generations/${generationId}/stream`, {
+                    headers: lastEventId ? { 'Last-Event-ID': lastEventId } : {},
+                });
+            } catch (e) {
+                // Still offline; try again on the next pass
+                response = null;
+            }
 
-                    try {
-                        // Parse the data - it's in a Python-like format, convert to JSON
-                        const jsonStr = data
-                            .replace(/'/g, '"')
-                            .replace(/True/g, 'true')
-                            .replace(/False/g, 'false');
-                        yield JSON.parse(jsonStr);
-                    } catch (e) {
-                        // Skip malformed data
-                        console.warn('Failed to parse SSE data:', data);
-                    }
-                }
+            if (response && !response.ok) {
+                const error = await response.json().catch(() => ({ detail: 'Unknown error' }));
+                throw new Error(error.detail || `HTTP error ${response.status}`);
             }
         }
     },
 };
 
+// Search API
+export const searchApi = {
+    // Matches are ranked best first; snippets wrap matched words in <mark>
+    search: (query, { limit = 20 } = {}) => {
+        const params = new URLSearchParams({ q: query, limit });
+        return apiCall(`/api/search?${params}`);
+    },
+};
+
 // Memory API
 export const memoryApi = {
     list: () => apiCall('/api/memories'),
@@ -1,5 +1,5 @@
 import { useState, useRef, useEffect } from 'react';
-import { Send, Loader2, ChevronDown, Sparkles, Bot, User, Zap } from 'lucide-react';
+import { Send, Square, Loader2, ChevronDown, Sparkles, Bot, User, Zap } from 'lucide-react';
 import MessageRenderer from './MessageRenderer';
 import { chatApi } from '../api';
 
@@ -10,22 +10,28 @@ function Chat({
     selectedModelId,
     onSelectModel,
     onChatUpdate,
-    onMessageAdded
+    onMessageAdded,
+    onLoadOlder
 }) {
     const [input, setInput] = useState('');
     const [isStreaming, setIsStreaming] = useState(false);
     const [streamingContent, setStreamingContent] = useState('');
     const [showModelDropdown, setShowModelDropdown] = useState(false);
+    const [loadingOlder, setLoadingOlder] = useState(false);
     const messagesEndRef = useRef(null);
     const textareaRef = useRef(null);
     const dropdownRef = useRef(null);
+    const generationIdRef = useRef(null);
+    const generationChatIdRef = useRef(null);
 
     const messages = chat?.messages || [];
     const selectedModel = models.find(m => m.config_id === selectedModelId);
+    const lastMessageId = messages[messages.length - 1]?.message_id;
 
+    // Only scroll for new messages, not when older pages are prepended
     useEffect(() => {
         messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
-    }, [messages, streamingContent]);
+    }, [lastMessageId, streamingContent]);
 
     useEffect(() => {
         if (textareaRef.current) {
@@ -65,39 +71,61 @@ function Chat({
             let currentChatId = chatId;
             let fullContent = '';
 
-            for await (const chunk of chatApi.sendMessage(userMessage, chatId, selectedModelId)) {
-                if (chunk.chat_id) {
-                    currentChatId = chunk.chat_id;
-                    if (chunk.is_new) {
-                        onChatUpdate(chunk.chat_id, null);
+            for await (const { event, data } of chatApi.sendMessage(userMessage, chatId, selectedModelId)) {
+                if (event === 'meta') {
+                    currentChatId = data.chat_id;
+                    generationIdRef.current = data.generation_id;
+                    generationChatIdRef.current = data.chat_id;
+                    if (data.is_new) {
+                        onChatUpdate(data.chat_id, null);
                     }
-                }
-                if (chunk.content) {
-                    fullContent += chunk.content;
+                } else if (event === 'content') {
+                    fullContent += data.text;
                     setStreamingContent(fullContent);
-                }
-                if (chunk.title) {
-                    onChatUpdate(currentChatId, chunk.title);
+                } else if (event === 'title') {
+                    onChatUpdate(currentChatId, data.title);
                 }
             }
 
-            const assistantMsg = {
-                message_id: `temp-${Date.now() + 1}`,
-                role: 'assistant',
-                content: fullContent,
-                created_at: new Date().toISOString()
-            };
-            onMessageAdded(assistantMsg);
+            if (fullContent) {
+                const assistantMsg = {
+                    message_id: `temp-${Date.now() + 1}`,
+                    role: 'assistant',
+                    content: fullContent,
+                    created_at: new Date().toISOString()
+                };
+                onMessageAdded(assistantMsg);
+            }
             setStreamingContent('');
 
         } catch (err) {
             console.error('Failed to send message:', err);
             setStreamingContent(`\n\n**Error:** ${err.message}`);
         } finally {
+            generationIdRef.current = null;
             setIsStreaming(false);
         }
     };
 
+    const handleStop = async () => {
+        if (!generationIdRef.current) return;
+        try {
+            await chatApi.cancelGeneration(generationIdRef.current, generationChatIdRef.current);
+        } catch (err) {
+            // The generation may have just finished
+            console.error('Failed to stop generation:', err);
+        }
+    };
+
+    const handleLoadOlder = async () => {
+        setLoadingOlder(true);
+        try {
+            await onLoadOlder();
+        } finally {
+            setLoadingOlder(false);
+        }
+    };
+
     const handleKeyDown = (e) => {
         if (e.key === 'Enter' && !e.shiftKey) {
             e.preventDefault();
@@ -214,6 +242,19 @@ function Chat({
                     </div>
                 ) : (
                     <div className="max-w-4xl mx-auto py-6 px-4">
+                        {chat?.next_cursor && (
+                            <div className="flex justify-center mb-6">
+                                <button
+                                    onClick={handleLoadOlder}
+                                    disabled={loadingOlder}
+                                    className="flex items-center gap-2 px-4 py-2 rounded-lg border border-gray-700 text-sm text-gray-400 hover:text-white hover:border-gray-600 transition-colors"
+                                >
+                                    {loadingOlder && <Loader2 size={14} className="animate-spin" />}
+                                    Load earlier messages
+                                </button>
+                            </div>
+                        )}
+
                         {messages.map((message, index) => (
                             <div
                                 key={message.message_id || index}
@@ -299,21 +340,29 @@ function Chat({
                             rows={1}
                             disabled={isStreaming}
                         />
-                        <button
-                            type="submit"
-                            disabled={!input.trim() || isStreaming}
-                            className={`m-2 p-3 rounded-lg transition-all duration-200 ${input.trim() && !isStreaming
-                                    ? 'text-gray-900 hover:opacity-90'
-                                    : 'bg-gray-700 text-gray-500 cursor-not-allowed'
-                                }`}
-                            style={input.trim() && !isStreaming ? { background: 'var(--pr-lime)' } : {}}
-                        >
-                            {isStreaming ? (
-                                <Loader2 size={20} className="animate-spin" />
-                            ) : (
+                        {isStreaming ? (
+                            <button
+                                type="button"
+                                onClick={handleStop}
+                                title="Stop generating"
+                                className="m-2 p-3 rounded-lg transition-all duration-200 text-gray-900 hover:opacity-90"
+                                style={{ background: 'var(--pr-lime)' }}
+                            >
+                                <Square size={20} />
+                            </button>
+                        ) : (
+                            <button
+                                type="submit"
+                                disabled={!input.trim()}
+                                className={`m-2 p-3 rounded-lg transition-all duration-200 ${input.trim()
+                                        ? 'text-gray-900 hover:opacity-90'
+                                        : 'bg-gray-700 text-gray-500 cursor-not-allowed'
+                                    }`}
+                                style={input.trim() ? { background: 'var(--pr-lime)' } : {}}
+                            >
                                 <Send size={20} />
-                            )}
-                        </button>
+                            </button>
+                        )}
                     </div>
                     <p className="text-center text-xs text-gray-600 mt-3">
                         Powered by Claude via AWS Bedrock
@@ -12,7 +12,10 @@ function Settings({ models, onClose, onUpdateModels }) {
         model_id: '',
         max_tokens: 4096,
         temperature: 0.7,
-        is_default: false
+        is_default: false,
+        fallback_config_ids: [],
+        ttft_deadline_ms: null,
+        hedge: false
     });
     const [showAddModel, setShowAddModel] = useState(false);
     const [loading, setLoading] = useState(false);
@@ -80,7 +83,7 @@ function Settings({ models, onClose, onUpdateModels }) {
             await modelApi.create(newModel);
             await onUpdateModels();
             setShowAddModel(false);
-            setNewModel({ config_id: '', name: '', model_id: '', max_tokens: 4096, temperature: 0.7, is_default: false });
+            setNewModel({ config_id: '', name: '', model_id: '', max_tokens: 4096, temperature: 0.7, is_default: false, fallback_config_ids: [], ttft_deadline_ms: null, hedge: false });
             showMessage('Model added!');
         } catch (err) {
             showMessage('Failed to add model', 'error');
@@ -193,6 +196,27 @@ function Settings({ models, onClose, onUpdateModels }) {
                                                 className="w-full pr-input text-sm" style={{ borderColor: '#3a3a50' }} />
                                         </div>
                                     </div>
+                                    <div className="grid grid-cols-2 gap-4">
+                                        <div>
+                                            <label className="block text-sm text-gray-400 mb-1">Fallback Model</label>
+                                            <select value={newModel.fallback_config_ids[0] || ''} onChange={(e) => setNewModel({ ...newModel, fallback_config_ids: e.target.value ? [e.target.value] : [] })}
+                                                className="w-full pr-input text-sm" style={{ borderColor: '#3a3a50' }}>
+                                                <option value="">None</option>
+                                                {models.filter(m => m.config_id !== newModel.config_id).map(m => (
+                                                    <option key={m.config_id} value={m.config_id}>{m.name}</option>
+                                                ))}
+                                            </select>
+                                        </div>
+                                        <div>
+                                            <label className="block text-sm text-gray-400 mb-1">First Token Deadline (ms)</label>
+                                            <input type="number" min="1" value={newModel.ttft_deadline_ms || ''} onChange={(e) => setNewModel({ ...newModel, ttft_deadline_ms: parseInt(e.target.value) || null })}
+                                                placeholder="None" className="w-full pr-input text-sm" style={{ borderColor: '#3a3a50' }} />
+                                        </div>
+                                    </div>
+                                    <div className="flex items-center gap-2">
+                                        <input type="checkbox" id="hedge" checked={newModel.hedge} onChange={(e) => setNewModel({ ...newModel, hedge: e.target.checked })} className="w-4 h-4 rounded" />
+                                        <label htmlFor="hedge" className="text-sm text-gray-300">Keep waiting while the fallback starts (hedge)</label>
+                                    </div>
                                     <div className="flex items-center gap-2">
                                         <input type="checkbox" id="is_default" checked={newModel.is_default} onChange={(e) => setNewModel({ ...newModel, is_default: e.target.checked })} className="w-4 h-4 rounded" />
                                         <label htmlFor="is_default" className="text-sm text-gray-300">Set as default</label>
@@ -221,6 +245,9 @@ function Settings({ models, onClose, onUpdateModels }) {
                                                 <div className="flex gap-4 mt-2 text-xs text-gray-400">
                                                     <span>Max: {model.max_tokens}</span>
                                                     <span>Temp: {model.temperature}</span>
+                                                    {model.fallback_config_ids?.length > 0 && (
+                                                        <span>Fallback: {model.fallback_config_ids.join(', ')}</span>
+                                                    )}
                                                 </div>
                                             </div>
                                             <div className="flex items-center gap-2">
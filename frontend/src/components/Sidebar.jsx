@@ -1,4 +1,4 @@
-import { useState } from 'react';
+import { useState, useEffect } from 'react';
 import {
     MessageSquarePlus,
     MessageSquare,
@@ -9,11 +9,29 @@ import {
     Settings,
     Home,
     Sparkles,
-    LogOut
+    LogOut,
+    Loader2,
+    Search
 } from 'lucide-react';
+import { searchApi } from '../api';
+
+// Milliseconds to wait after typing before searching
+const SEARCH_DEBOUNCE_MS = 250;
+
+// Render a search snippet, highlighting the <mark>ed words without
+// interpreting the rest of the message as HTML
+function Snippet({ text }) {
+    const parts = text.split(/<mark>|<\/mark>/);
+    return parts.map((part, i) => i % 2 === 1
+        ? <mark key={i} className="bg-transparent font-semibold" style={{ color: 'var(--pr-lime)' }}>{part}</mark>
+        : <span key={i}>{part}</span>
+    );
+}
 
 function Sidebar({
     chats,
+    hasMoreChats,
+    onLoadMoreChats,
     currentChatId,
     onNewChat,
     onSelectChat,
@@ -25,6 +43,44 @@ function Sidebar({
     const [editingId, setEditingId] = useState(null);
     const [editTitle, setEditTitle] = useState('');
     const [deleteConfirm, setDeleteConfirm] = useState(null);
+    const [loadingMore, setLoadingMore] = useState(false);
+    const [query, setQuery] = useState('');
+    const [results, setResults] = useState([]);
+    const [searching, setSearching] = useState(false);
+
+    const isSearch = query.trim().length > 0;
+
+    useEffect(() => {
+        if (!isSearch) {
+            setResults([]);
+            return;
+        }
+        let cancelled = false;
+        const timer = setTimeout(async () => {
+            setSearching(true);
+            try {
+                const res = await searchApi.search(query.trim());
+                if (!cancelled) setResults(res.results || []);
+            } catch (err) {
+                console.error('Search failed:', err);
+            } finally {
+                if (!cancelled) setSearching(false);
+            }
+        }, SEARCH_DEBOUNCE_MS);
+        return () => {
+            cancelled = true;
+            clearTimeout(timer);
+        };
+    }, [query]);
+
+    const handleLoadMore = async () => {
+        setLoadingMore(true);
+        try {
+            await onLoadMoreChats();
+        } finally {
+            setLoadingMore(false);
+        }
+    };
 
     const handleStartEdit = (chat) => {
         setEditingId(chat.chat_id);
@@ -92,15 +148,56 @@ function Sidebar({
                     <Home size={18} />
                     Home
                 </button>
+
+                {/* Search */}
+                <div className="relative mt-3">
+                    <Search size={14} className="absolute left-3 top-1/2 -translate-y-1/2 text-gray-500" />
+                    <input
+                        type="text"
+                        value={query}
+                        onChange={(e) => setQuery(e.target.value)}
+                        onKeyDown={(e) => e.key === 'Escape' && setQuery('')}
+                        placeholder="Search chats"
+                        className="w-full bg-gray-900 border border-gray-800 rounded-lg pl-8 pr-3 py-2 text-sm text-white placeholder-gray-600 focus:border-lime-400 focus:outline-none"
+                    />
+                </div>
             </div>
 
             {/* Chat List */}
             <div className="flex-1 overflow-y-auto px-3">
                 <div className="text-xs font-semibold text-gray-500 uppercase tracking-wider px-3 mb-2">
-                    Recent Chats
+                    {isSearch ? 'Search Results' : 'Recent Chats'}
                 </div>
 
-                {chats.length === 0 ? (
+                {isSearch ? (
+                    results.length === 0 ? (
+                        <div className="text-center py-8 px-4">
+                            {searching
+                                ? <Loader2 size={20} className="mx-auto animate-spin text-gray-600" />
+                                : <p className="text-sm text-gray-500">No matches</p>}
+                        </div>
+                    ) : (
+                        <div className="space-y-1">
+                            {results.map((result) => (
+                                <div
+                                    key={result.message_id}
+                                    onClick={() => onSelectChat(result.chat_id)}
+                                    className={`rounded-lg px-3 py-2.5 cursor-pointer transition-all duration-200 ${currentChatId === result.chat_id
+                                            ? 'bg-gray-800'
+                                            : 'hover:bg-gray-800/50'
+                                        }`}
+                                >
+                                    <div className="truncate text-sm text-gray-300">
+                                        {result.chat_title || 'New Chat'}
+                                    </div>
+                                    <div className="text-xs text-gray-500 line-clamp-2">
+                                        <Snippet text={result.snippet} />
+                                    </div>
+                                </div>
+                            ))}
+                        </div>
+                    )
+                ) : chats.length === 0 ? (
                     <div className="text-center py-8 px-4">
                         <MessageSquare size={32} className="mx-auto mb-3 text-gray-600" />
                         <p className="text-sm text-gray-500">No chats yet</p>
@@ -148,9 +245,16 @@ function Sidebar({
                                         className="flex items-center gap-3 px-3 py-2.5 cursor-pointer"
                                     >
                                         <MessageSquare size={16} className="flex-shrink-0 text-gray-500" />
-                                        <span className="flex-1 truncate text-sm text-gray-300">
-                                            {chat.title || 'New Chat'}
-                                        </span>
+                                        <div className="flex-1 min-w-0">
+                                            <div className="truncate text-sm text-gray-300">
+                                                {chat.title || 'New Chat'}
+                                            </div>
+                                            {chat.last_message_preview && (
+                                                <div className="truncate text-xs text-gray-500">
+                                                    {chat.last_message_preview}
+                                                </div>
+                                            )}
+                                        </div>
                                         <div className="flex items-center gap-1 opacity-0 group-hover:opacity-100 transition-opacity">
                                             <button
                                                 onClick={(e) => {
@@ -178,6 +282,17 @@ function Sidebar({
                                 )}
                             </div>
                         ))}
+
+                        {hasMoreChats && (
+                            <button
+                                onClick={handleLoadMore}
+                                disabled={loadingMore}
+                                className="w-full flex items-center justify-center gap-2 px-3 py-2 text-xs text-gray-500 hover:text-white transition-colors"
+                            >
+                                {loadingMore && <Loader2 size={12} className="animate-spin" />}
+                                Load more
+                            </button>
+                        )}
                     </div>
                 )}
             </div>
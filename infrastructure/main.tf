@@ -103,6 +103,19 @@ resource "aws_dynamodb_table" "chats" {
     type = "S"
   }
 
+  attribute {
+    name = "updated_at"
+    type = "S"
+  }
+
+  # Serves the chat list, most recently active first
+  global_secondary_index {
+    name            = "user-updated-index"
+    hash_key        = "user_id"
+    range_key       = "updated_at"
+    projection_type = "ALL"
+  }
+
   tags = {
     Project = var.project_name
   }
@@ -168,6 +181,50 @@ resource "aws_dynamodb_table" "model_config" {
   }
 }
 
+# Usage Totals Table (per model, chat and day buckets)
+resource "aws_dynamodb_table" "usage" {
+  name           = "${local.project_name}-usage"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "user_id"
+  range_key      = "bucket"
+
+  attribute {
+    name = "user_id"
+    type = "S"
+  }
+
+  attribute {
+    name = "bucket"
+    type = "S"
+  }
+
+  tags = {
+    Project = var.project_name
+  }
+}
+
+# ============================================
+# S3 Bucket for Large Message Content
+# ============================================
+
+resource "aws_s3_bucket" "blobs" {
+  bucket        = "${local.project_name}-blobs"
+  force_destroy = true
+
+  tags = {
+    Project = var.project_name
+  }
+}
+
+resource "aws_s3_bucket_public_access_block" "blobs" {
+  bucket = aws_s3_bucket.blobs.id
+
+  block_public_acls       = true
+  block_public_policy     = true
+  ignore_public_acls      = true
+  restrict_public_buckets = true
+}
+
 # ============================================
 # S3 Bucket for Frontend
 # ============================================
@@ -348,7 +405,7 @@ resource "aws_iam_role_policy_attachment" "lambda_basic" {
   policy_arn = "arn:aws:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole"
 }
 
-# Custom policy for Bedrock and DynamoDB access
+# Custom policy for Bedrock, DynamoDB and blob bucket access
 resource "aws_iam_role_policy" "lambda_custom" {
   name = "${local.project_name}-lambda-policy"
   role = aws_iam_role.lambda.id
@@ -372,14 +429,26 @@ resource "aws_iam_role_policy" "lambda_custom" {
           "dynamodb:UpdateItem",
           "dynamodb:DeleteItem",
           "dynamodb:Query",
-          "dynamodb:Scan"
+          "dynamodb:Scan",
+          "dynamodb:BatchWriteItem"
         ]
         Resource = [
           aws_dynamodb_table.chats.arn,
+          "${aws_dynamodb_table.chats.arn}/index/*",
           aws_dynamodb_table.messages.arn,
           aws_dynamodb_table.memories.arn,
-          aws_dynamodb_table.model_config.arn
+          aws_dynamodb_table.model_config.arn,
+          aws_dynamodb_table.usage.arn
+        ]
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "s3:GetObject",
+          "s3:PutObject",
+          "s3:DeleteObject"
         ]
+        Resource = "${aws_s3_bucket.blobs.arn}/*"
       }
     ]
   })
@@ -401,6 +470,10 @@ resource "aws_lambda_function" "api" {
       MESSAGES_TABLE     = aws_dynamodb_table.messages.name
       MEMORIES_TABLE     = aws_dynamodb_table.memories.name
       MODEL_CONFIG_TABLE = aws_dynamodb_table.model_config.name
+      USAGE_TABLE        = aws_dynamodb_table.usage.name
+      SEARCH_INDEX_PATH  = "/tmp/search.db"
+      BLOB_STORE         = "s3"
+      BLOB_BUCKET        = aws_s3_bucket.blobs.bucket
       AWS_REGION_NAME    = var.aws_region
     }
   }
@@ -42,3 +42,8 @@ output "model_config_table" {
   description = "DynamoDB table name for model config"
   value       = aws_dynamodb_table.model_config.name
 }
+
+output "usage_table" {
+  description = "DynamoDB table name for usage totals"
+  value       = aws_dynamodb_table.usage.name
+}